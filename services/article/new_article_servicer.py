@@ -43,18 +43,7 @@ class NewArticleServicer:
             return database_pb2.PostsResponse.error, None
         global_id = author.global_id
 
-        html_body = md_to_html(self._md_stub, req.body)
-        tags_string = convert_to_tags_string(req.tags)
-        pe = database_pb2.PostsEntry(
-            author_id=global_id,
-            title=req.title,
-            body=html_body,
-            md_body=req.body,
-            creation_datetime=req.creation_datetime,
-            ap_id=req.ap_id,
-            tags=tags_string,
-            summary=req.summary,
-        )
+        pe = self._post_entry(req, global_id)
         pr = database_pb2.PostsRequest(
             request_type=database_pb2.PostsRequest.INSERT,
             entry=pe
@@ -73,8 +62,21 @@ class NewArticleServicer:
 
         return posts_resp.result_type, posts_resp.global_id
 
-    def send_create_activity_request(self, req, global_id):
-        html_body = md_to_html(self._md_stub, req.body)
+    def _post_entry(self, req, author_id):
+        return database_pb2.PostsEntry(
+            author_id=author_id,
+            title=req.title,
+            body=md_to_html(self._md_stub, req.body),
+            md_body=req.body,
+            creation_datetime=req.creation_datetime,
+            ap_id=req.ap_id,
+            tags=convert_to_tags_string(req.tags),
+            summary=req.summary,
+        )
+
+    def send_create_activity_request(self, req, global_id, html_body=None):
+        if html_body is None:
+            html_body = md_to_html(self._md_stub, req.body)
         ad = create_pb2.ArticleDetails(
             author_id=req.author_id,
             title=req.title,
@@ -112,3 +114,57 @@ class NewArticleServicer:
         else:
             resp.result_type = article_pb2.NewArticleResponse.ERROR
         return resp
+
+    def CreateNewArticles(self, req, context):
+        """
+        CreateNewArticles creates a batch of articles with a single database
+        write, rather than two statements and a commit per article.
+
+        Articles whose ap_id the database already has are skipped, so a feed
+        that is fetched again only creates its new items.
+        """
+        self._logger.info('Received %d new articles.', len(req.articles))
+        resp = article_pb2.NewArticlesResponse()
+        authors = {}
+        entries = []
+        for art in req.articles:
+            if art.author_id not in authors:
+                authors[art.author_id] = self._users_util.get_user_from_db(
+                    global_id=art.author_id)
+            author = authors[art.author_id]
+            if author is None:
+                self._logger.error(
+                    'Could not find user id in db: ' + str(art.author_id))
+                resp.result_type = article_pb2.NewArticlesResponse.ERROR
+                resp.error = 'unknown author ' + str(art.author_id)
+                return resp
+            entries.append(self._post_entry(art, author.global_id))
+
+        db_resp = self._db_stub.BatchInsertPosts(
+            database_pb2.BatchInsertPostsRequest(entries=entries))
+        if db_resp.result_type == database_pb2.BatchInsertPostsResponse.ERROR:
+            self._logger.error('Could not insert into db: %s', db_resp.error)
+            resp.result_type = article_pb2.NewArticlesResponse.ERROR
+            resp.error = db_resp.error
+            return resp
+
+        created = 0
+        for art, pe, global_id, inserted in zip(
+                req.articles, entries, db_resp.global_ids, db_resp.inserted):
+            resp.global_ids.append(str(global_id))
+            if not inserted:
+                continue
+            created += 1
+            pe.global_id = global_id
+            self.index(pe)
+            if self._post_recommendation_stub is not None:
+                self._add_post_to_recommender(pe)
+            if not art.foreign:
+                create_success = self.send_create_activity_request(
+                    art, global_id, pe.body)
+                if create_success == create_pb2.CreateResponse.ERROR:
+                    self._logger.error('Could not send create Activity')
+        self._logger.info('%d of %d articles created.', created,
+                          len(req.articles))
+        resp.result_type = article_pb2.NewArticlesResponse.OK
+        return resp
@@ -19,5 +19,6 @@ class ArticleServicer(article_pb2_grpc.ArticleServicer):
                                                   logger, users_util,
                                                   post_recommendation_stub)
         self.CreateNewArticle = new_article_servicer.CreateNewArticle
+        self.CreateNewArticles = new_article_servicer.CreateNewArticles
         preview_servicer = PreviewServicer(md_stub, logger)
         self.PreviewArticle = preview_servicer.PreviewArticle
@@ -0,0 +1,211 @@
+import asyncio
+import concurrent.futures
+import inspect
+import threading
+import time
+
+import grpc
+
+import follow_servicer
+import stats as stats_lib
+from services.proto import database_pb2
+from services.proto import database_pb2_grpc
+
+# Threads serving ordinary reads. Each has its own SQLite connection.
+DEFAULT_READERS = 16
+# Threads serving RPCs that write. They spend nearly all their time waiting
+# for the single writer thread to commit, so there can be many of them;
+# the more writes are waiting, the larger the writer's group commits.
+DEFAULT_WRITE_WAITERS = 32
+# Threads serving RPCs that scan whole tables, including every streaming
+# RPC. Kept separate so that a few long scans can't hold up short reads.
+DEFAULT_BULK_WORKERS = 2
+# Responses of a streaming RPC read ahead of the client.
+STREAM_BUFFER = 2
+# Seconds in-flight RPCs get to finish on shutdown.
+SHUTDOWN_GRACE = 5
+
+READ = 'read'
+WRITE = 'write'
+BULK = 'bulk'
+
+WRITE_METHODS = frozenset([
+    'AddLike', 'RemoveLike', 'AddShare', 'AddView', 'AddLog',
+    'SafeRemovePost', 'CreatePostsIndex', 'CreateUsersIndex',
+    'BatchInsertPosts',
+])
+BULK_METHODS = frozenset([
+    'AllUsers', 'AllUserLikes', 'TaggedPosts', 'RunMaintenance',
+])
+# Posts, Users and Follow write or read depending on their request_type.
+WRITE_REQUEST_TYPES = frozenset(['INSERT', 'UPDATE', 'DELETE'])
+
+_DONE = object()
+
+
+def _is_write(request):
+    field = request.DESCRIPTOR.fields_by_name.get('request_type')
+    if field is None or field.enum_type is None:
+        return False
+    value = field.enum_type.values_by_number.get(request.request_type)
+    return value is not None and value.name in WRITE_REQUEST_TYPES
+
+
+class AioDatabaseServicer:
+    """
+    AioDatabaseServicer serves the methods of a DatabaseServicer from a
+    grpc.aio server.
+
+    The servicer methods are synchronous and block on SQLite, so each call
+    is run on one of three thread pools, chosen by what it does: reads,
+    writes (which wait on the DB's single writer thread) and whole-table
+    scans. The event loop only parses requests and sends responses, so
+    any number of RPCs can be in flight without a thread each, and a long
+    scan or a burst of writes does not hold up ordinary reads.
+    """
+
+    def __init__(self, servicer, logger, readers=DEFAULT_READERS,
+                 write_waiters=DEFAULT_WRITE_WAITERS,
+                 bulk_workers=DEFAULT_BULK_WORKERS, stats=None):
+        self._logger = logger
+        self._stats = stats
+        self._pools = {
+            READ: concurrent.futures.ThreadPoolExecutor(
+                readers, thread_name_prefix='db-read'),
+            WRITE: concurrent.futures.ThreadPoolExecutor(
+                write_waiters, thread_name_prefix='db-write'),
+            BULK: concurrent.futures.ThreadPoolExecutor(
+                bulk_workers, thread_name_prefix='db-bulk'),
+        }
+        service = database_pb2.DESCRIPTOR.services_by_name['Database']
+        for method in service.methods:
+            name = method.name
+            # DatabaseServicer only sets the methods it implements.
+            fn = vars(servicer).get(name)
+            if fn is None:
+                handler = self._unimplemented(name)
+            elif inspect.isgeneratorfunction(fn):
+                handler = self._stream(name, fn)
+            else:
+                handler = self._unary(name, fn)
+            setattr(self, name, handler)
+
+    def _pool(self, name, request):
+        if name in BULK_METHODS or (
+                name == 'Follow' and follow_servicer.is_full_scan(request)):
+            return self._pools[BULK]
+        if name in WRITE_METHODS or _is_write(request):
+            return self._pools[WRITE]
+        return self._pools[READ]
+
+    def _unimplemented(self, name):
+        async def handle(request, context):
+            await context.abort(grpc.StatusCode.UNIMPLEMENTED,
+                                name + ' is not implemented')
+        return handle
+
+    def _unary(self, name, fn):
+        async def handle(request, context):
+            start = time.perf_counter()
+            return await asyncio.get_running_loop().run_in_executor(
+                self._pool(name, request), self._call, name, fn, request,
+                start)
+        return handle
+
+    def _call(self, name, fn, request, start):
+        if self._stats is None:
+            return fn(request, None)
+        call = self._stats.begin_rpc(name)
+        error = True
+        try:
+            resp = fn(request, None)
+            error = stats_lib.is_error(resp)
+            return resp
+        finally:
+            self._stats.end_rpc(call, time.perf_counter() - start, error)
+
+    def _iterate(self, name, fn, request, start):
+        if self._stats is None:
+            yield from fn(request, None)
+            return
+        call = self._stats.begin_rpc(name)
+        error = False
+        try:
+            for resp in fn(request, None):
+                error = error or stats_lib.is_error(resp)
+                yield resp
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self._stats.end_rpc(call, time.perf_counter() - start, error)
+
+    def _stream(self, name, fn):
+        async def handle(request, context):
+            start = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            queue = asyncio.Queue(maxsize=STREAM_BUFFER)
+            cancelled = threading.Event()
+
+            def put(item):
+                asyncio.run_coroutine_threadsafe(
+                    queue.put(item), loop).result()
+
+            def produce():
+                # The whole stream is read on one thread, as the cursor
+                # behind it belongs to that thread's connection.
+                responses = self._iterate(name, fn, request, start)
+                try:
+                    for resp in responses:
+                        if cancelled.is_set():
+                            return
+                        put(resp)
+                except Exception as e:
+                    if not cancelled.is_set():
+                        put(e)
+                    return
+                finally:
+                    responses.close()
+                if not cancelled.is_set():
+                    put(_DONE)
+
+            producer = loop.run_in_executor(self._pools[BULK], produce)
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is _DONE:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+            finally:
+                # Unblock the producer if the client went away, so it
+                # stops at its next response.
+                cancelled.set()
+                while not queue.empty():
+                    queue.get_nowait()
+            await producer
+        return handle
+
+    def close(self):
+        for pool in self._pools.values():
+            pool.shutdown()
+
+
+async def serve(servicer, logger, address, readers=DEFAULT_READERS,
+                write_waiters=DEFAULT_WRITE_WAITERS,
+                bulk_workers=DEFAULT_BULK_WORKERS, stats=None):
+    """serve runs a grpc.aio server for servicer until cancelled."""
+    aio_servicer = AioDatabaseServicer(
+        servicer, logger, readers=readers, write_waiters=write_waiters,
+        bulk_workers=bulk_workers, stats=stats)
+    server = grpc.aio.server()
+    database_pb2_grpc.add_DatabaseServicer_to_server(aio_servicer, server)
+    server.add_insecure_port(address)
+    logger.info("Starting asyncio database service on %s", address)
+    await server.start()
+    try:
+        await server.wait_for_termination()
+    finally:
+        await server.stop(SHUTDOWN_GRACE)
+        aio_servicer.close()
@@ -0,0 +1,230 @@
+"""
+Generate a synthetic instance to benchmark the database service against.
+
+Activity on a federated instance is very uneven: a few users have most of
+the followers, and a few posts get most of the likes and shares. Follows,
+likes and shares pick their target from a Zipf distribution, so
+popularity follows a power law like it does on a real instance. Everything
+is derived from the seed, so a given scale always gives the same database.
+
+Rows are written with plain INSERTs in large transactions rather than
+through the servicers, which would take hours at the larger scales. The
+search index triggers still run, so posts_idx is populated as usual.
+
+Run from the database service directory:
+  python3 -m benchmarks.dataset --scale small --db /tmp/small.db
+"""
+import argparse
+import bisect
+import itertools
+import logging
+import os
+import random
+
+from database import build_database
+
+# Users generated at each scale. The other tables are sized from the user
+# count, for a total of roughly 60 rows per user.
+SCALES = {
+    'tiny': 200,
+    'small': 2000,
+    'medium': 20000,
+    'large': 160000,
+}
+POSTS_PER_USER = 5
+FOLLOWS_PER_USER = 20
+LIKES_PER_USER = 30
+SHARES_PER_USER = 3
+# Share of users whose host is NULL, i.e. who are local to this instance.
+LOCAL_USERS = 0.2
+PRIVATE_USERS = 0.05
+# Exponent of the Zipf distributions. Around 1 for social graphs.
+ZIPF_EXPONENT = 1.1
+VOCABULARY_SIZE = 5000
+TAG_VOCABULARY_SIZE = 500
+HOSTS = 50
+# Rows inserted per transaction.
+BATCH_ROWS = 10000
+# Posts are spread over the year before this time.
+NOW = 1700000000
+YEAR = 365 * 24 * 60 * 60
+
+_SYLLABLES = ('ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'an', 'el',
+              'or', 'us', 'be', 'da', 'fi', 'go', 'hu', 'ja', 'pe', 'zo')
+
+
+def get_args():
+    parser = argparse.ArgumentParser('Generate a benchmark database')
+    parser.add_argument('--scale', default='small', choices=sorted(SCALES),
+                        help='Size of the instance.')
+    parser.add_argument('--users', type=int,
+                        help='Number of users, overriding --scale.')
+    parser.add_argument('--seed', default=1, type=int)
+    parser.add_argument('--db', required=True,
+                        help='Where to write the database. Must not exist.')
+    return parser.parse_args()
+
+
+class Zipf:
+    """Zipf samples 1..n, with k drawn in proportion to 1 / k**exponent."""
+
+    def __init__(self, rng, n, exponent=ZIPF_EXPONENT):
+        self._rng = rng
+        self._cum_weights = list(itertools.accumulate(
+            1 / k ** exponent for k in range(1, n + 1)))
+
+    def sample(self):
+        x = self._rng.random() * self._cum_weights[-1]
+        return bisect.bisect(self._cum_weights, x) + 1
+
+
+def _words(rng, n):
+    words = set()
+    while len(words) < n:
+        words.add(''.join(rng.choice(_SYLLABLES)
+                          for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _insert(db, statement, rows):
+    """_insert writes rows in transactions of BATCH_ROWS and counts them."""
+    total = 0
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, BATCH_ROWS))
+        if not batch:
+            return total
+        with db.transaction() as tx:
+            tx.execute_many(statement, batch)
+        total += len(batch)
+
+
+def _unique_pairs(rng, sources, n_per_source, target):
+    """
+    _unique_pairs yields up to n_per_source distinct (source, target()) for
+    each source, with the count per source varying around the mean.
+    """
+    for source in sources:
+        seen = set()
+        want = rng.randint(0, 2 * n_per_source)
+        for _ in range(2 * want):
+            if len(seen) >= want:
+                break
+            t = target()
+            if t != source and t not in seen:
+                seen.add(t)
+                yield source, t
+
+
+def generate(db, users, seed=1):
+    """
+    generate fills an empty database with users and their posts, follows,
+    likes and shares.
+
+    Global ids are assigned in insert order from 1, so users are 1..users
+    and posts are 1..the number of posts, ordered by creation time. User 1
+    is the most followed user and post 1 the most liked post.
+
+    Returns:
+      A dict of the number of rows written to each table.
+    """
+    rng = random.Random(seed)
+    vocabulary = _words(rng, VOCABULARY_SIZE)
+    tags = _words(rng, TAG_VOCABULARY_SIZE)
+    word = Zipf(rng, len(vocabulary))
+    tag = Zipf(rng, len(tags))
+    counts = {}
+
+    def user_rows():
+        for i in range(1, users + 1):
+            local = rng.random() < LOCAL_USERS
+            yield ('user{}'.format(i),
+                   None if local else 'host{}.example'.format(i % HOSTS),
+                   'User {}'.format(i),
+                   'bio of user {}'.format(i),
+                   rng.random() < PRIVATE_USERS)
+    counts['users'] = _insert(
+        db,
+        'INSERT INTO users (handle, host, display_name, password, bio, '
+        'private, public_key, private_key) VALUES (?, ?, ?, "", ?, ?, "", "")',
+        user_rows())
+
+    def text(n):
+        return ' '.join(vocabulary[word.sample() - 1] for _ in range(n))
+
+    n_posts = users * POSTS_PER_USER
+    times = sorted(rng.randint(NOW - YEAR, NOW) for _ in range(n_posts))
+
+    def post_rows():
+        for i, created in enumerate(times, 1):
+            author = rng.randint(1, users)
+            body = text(rng.randint(30, 300))
+            yield (author, text(rng.randint(2, 8)), '<p>' + body + '</p>',
+                   created, body,
+                   '' if rng.random() < LOCAL_USERS else
+                   'https://host{}.example/ap/{}'.format(author % HOSTS, i),
+                   '|'.join(sorted({tags[tag.sample() - 1]
+                                    for _ in range(rng.randint(0, 4))})),
+                   text(rng.randint(5, 20)))
+    counts['posts'] = _insert(
+        db,
+        'INSERT INTO posts (author_id, title, body, creation_datetime, '
+        'md_body, ap_id, tags, summary) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        post_rows())
+
+    popular_user = Zipf(rng, users)
+    popular_post = Zipf(rng, counts['posts'])
+    user_ids = range(1, users + 1)
+    counts['follows'] = _insert(
+        db,
+        'INSERT INTO follows (follower, followed, state) VALUES (?, ?, 0)',
+        _unique_pairs(rng, user_ids, FOLLOWS_PER_USER, popular_user.sample))
+    counts['likes'] = _insert(
+        db,
+        'INSERT INTO likes (user_id, article_id) VALUES (?, ?)',
+        _unique_pairs(rng, user_ids, LIKES_PER_USER, popular_post.sample))
+    counts['shares'] = _insert(
+        db,
+        'INSERT INTO shares (user_id, article_id, announce_datetime) '
+        'VALUES (?, ?, ?)',
+        ((u, p, rng.randint(NOW - YEAR, NOW)) for u, p in _unique_pairs(
+            rng, user_ids, SHARES_PER_USER, popular_post.sample)))
+    with db.transaction() as tx:
+        tx.execute('UPDATE posts SET '
+                   'likes_count = (SELECT COUNT(*) FROM likes '
+                   'WHERE article_id = global_id), '
+                   'shares_count = (SELECT COUNT(*) FROM shares '
+                   'WHERE article_id = global_id)')
+    db.execute('ANALYZE')
+    return counts
+
+
+def build(logger, path, users, seed=1):
+    """build creates a database at path and generates an instance in it."""
+    schema = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'rabble_schema.sql')
+    db = build_database(logger, schema, path)
+    try:
+        counts = generate(db, users, seed)
+    except BaseException:
+        db.close()
+        raise
+    return db, counts
+
+
+def main():
+    args = get_args()
+    if os.path.exists(args.db):
+        raise SystemExit('{} already exists'.format(args.db))
+    logger = logging.getLogger('benchmark')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    db, counts = build(logger, args.db, args.users or SCALES[args.scale],
+                       args.seed)
+    db.close()
+    for table, n in counts.items():
+        print('{:>10} {:>10}'.format(table, n))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Measure the cost of building FIND and UPDATE SQL with and without caching.
+
+The first table times util.equivalent_filter and util.entry_to_update on
+their own. "uncached" clears the plan cache before every call, which is the
+work the builder did for every request before plans were cached.
+
+The second table runs user-by-global_id FINDs through UsersDatabaseServicer.
+"uncached" also disables the sqlite3 statement cache, so every request pays
+for building the SQL text and for SQLite preparing it, as happens when a
+statement has been evicted from a too small cache.
+
+Run from the database service directory:
+  python3 -m benchmarks.filters --calls 100000
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import util
+from database import DB, DEFAULT_CACHED_STATEMENTS, build_database
+from users_servicer import UsersDatabaseServicer
+from services.proto import database_pb2
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        'Benchmark the SQL builder plan cache')
+    parser.add_argument('--calls', default=100000, type=int,
+                        help='Builder calls per case and mode.')
+    parser.add_argument('--finds', default=20000, type=int,
+                        help='Users FIND requests per mode.')
+    return parser.parse_args()
+
+
+def builder_cases():
+    deferred = {'ap_id': lambda entry, comp: ('ap_id' + comp, entry.ap_id)}
+    return [
+        ('filter global_id', lambda: util.equivalent_filter(
+            database_pb2.UsersEntry(global_id=7))),
+        ('filter handle+host', lambda: util.equivalent_filter(
+            database_pb2.UsersEntry(handle='a', host='b.com'))),
+        ('filter deferred', lambda: util.equivalent_filter(
+            database_pb2.PostsEntry(ap_id='https://a.b/1'),
+            deferred=deferred)),
+        ('update 3 fields', lambda: util.entry_to_update(
+            database_pb2.UsersEntry(display_name='a', bio='b', rss='c'))),
+    ]
+
+
+def time_builder(fn, calls, cached):
+    start = time.perf_counter()
+    for _ in range(calls):
+        if not cached:
+            util.clear_plan_cache()
+        fn()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def time_finds(schema, logger, finds, cached):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        db = build_database(logger, schema, path)
+        with db.transaction() as tx:
+            for i in range(100):
+                tx.execute(
+                    'INSERT INTO users (handle, display_name, password, '
+                    'bio, private, public_key, private_key) '
+                    'VALUES (?, "", "", "", 0, "", "")', 'user{}'.format(i))
+        db.close()
+        # Reopen with the statement cache setting under test.
+        db = DB(path, cached_statements=(
+            DEFAULT_CACHED_STATEMENTS if cached else 0))
+        users = UsersDatabaseServicer(db, logger)
+        start = time.perf_counter()
+        for i in range(finds):
+            if not cached:
+                util.clear_plan_cache()
+            users.Users(database_pb2.UsersRequest(
+                request_type=database_pb2.UsersRequest.FIND,
+                match=database_pb2.UsersEntry(global_id=i % 100 + 1),
+            ), None)
+        elapsed = time.perf_counter() - start
+        db.close()
+    return elapsed / finds * 1e6
+
+
+def main():
+    args = get_args()
+    logger = logging.getLogger('benchmark')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    schema = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'rabble_schema.sql')
+
+    print('{:>20} {:>14} {:>14}'.format(
+        'builder', 'uncached us', 'cached us'))
+    for name, fn in builder_cases():
+        before = time_builder(fn, args.calls, False)
+        after = time_builder(fn, args.calls, True)
+        print('{:>20} {:>14.2f} {:>14.2f}'.format(name, before, after))
+
+    print()
+    print('{:>20} {:>14} {:>14}'.format(
+        'request', 'uncached us', 'cached us'))
+    before = time_finds(schema, logger, args.finds, False)
+    after = time_finds(schema, logger, args.finds, True)
+    print('{:>20} {:>14.2f} {:>14.2f}'.format(
+        'user by global_id', before, after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Measure the latency and throughput of DatabaseServicer methods on a
+synthetic instance, see benchmarks/dataset.py.
+
+Each case calls one servicer method in-process with arguments drawn the
+way real traffic would draw them: viewers uniformly, and users and posts
+being looked at by popularity. Every call is timed on its own, and the
+table shows percentiles of those times and calls per second.
+
+The results can be saved as JSON and compared with a later run to catch
+regressions:
+  python3 -m benchmarks.servicers --scale small --json before.json
+  python3 -m benchmarks.servicers --scale small --compare before.json
+
+Run from the database service directory. The generated database is reused
+if --db names an existing file, which saves generating it on every run.
+Cases that write go last, so they don't change what the reads see.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks import dataset
+from database import DB
+from database_servicer import DatabaseServicer
+from services.proto import database_pb2
+
+PERCENTILES = (50, 95, 99)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        'Benchmark the database servicers')
+    parser.add_argument('--scale', default='small',
+                        choices=sorted(dataset.SCALES),
+                        help='Size of the generated instance.')
+    parser.add_argument('--users', type=int,
+                        help='Number of users, overriding --scale.')
+    parser.add_argument('--seed', default=1, type=int)
+    parser.add_argument('--db',
+                        help='Database to use, generated if it does not '
+                        'exist. A temporary database is used if not set.')
+    parser.add_argument('--calls', default=2000, type=int,
+                        help='Calls per case.')
+    parser.add_argument('--threads', default=1, type=int,
+                        help='Client threads calling each case at once.')
+    parser.add_argument('--cases',
+                        help='Comma separated cases to run. All by default.')
+    parser.add_argument('--json', help='Write the results to this file.')
+    parser.add_argument('--compare',
+                        help='Results of an earlier run to compare with.')
+    parser.add_argument('--threshold', default=0.2, type=float,
+                        help='Flag cases whose p50 or p99 got worse than '
+                        'this fraction in the comparison.')
+    return parser.parse_args()
+
+
+class Traffic:
+    """Traffic draws the arguments of benchmark requests."""
+
+    def __init__(self, db, seed):
+        self.rng = random.Random(seed)
+        self.users = db.execute('SELECT COUNT(*) FROM users')[0][0]
+        self.posts = db.execute('SELECT COUNT(*) FROM posts')[0][0]
+        self._popular_user = dataset.Zipf(self.rng, self.users)
+        self._popular_post = dataset.Zipf(self.rng, self.posts)
+        self.words = [r[0] for r in db.execute(
+            'SELECT title FROM posts LIMIT 200')]
+        self.ap_ids = [r[0] for r in db.execute(
+            'SELECT ap_id FROM posts WHERE ap_id != "" LIMIT 1000')]
+        self.sharers = [r[0] for r in db.execute(
+            'SELECT DISTINCT user_id FROM shares LIMIT 1000')]
+        self.local_users = [r[0] for r in db.execute(
+            'SELECT global_id FROM users WHERE host IS NULL')]
+        # New likes go to users that don't exist, so they never conflict
+        # with generated ones.
+        self._next_like = 0
+
+    def viewer(self):
+        return self.rng.randint(1, self.users)
+
+    def user(self):
+        return self._popular_user.sample()
+
+    def local_user(self):
+        return self.rng.choice(self.local_users)
+
+    def post(self):
+        return self._popular_post.sample()
+
+    def search_term(self):
+        words = self.rng.choice(self.words).split()
+        return self.rng.choice(words)[:self.rng.randint(3, 6)]
+
+    def new_like(self):
+        i = self._next_like
+        self._next_like += 1
+        return database_pb2.LikeEntry(
+            user_id=self.users + 1 + i // self.posts,
+            article_id=i % self.posts + 1)
+
+
+def cases(servicer, traffic):
+    """
+    cases returns (name, make_request, call) for each benchmark. The
+    request is made outside the timed part.
+    """
+    def with_viewer(req):
+        req.user_global_id.value = traffic.viewer()
+        return req
+
+    def posts_find(match):
+        req = database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.FIND, match=match)
+        return with_viewer(req)
+
+    def assembled_home_feed(req, context):
+        # How the feed service builds a home feed today: the user's follows,
+        # then the posts and shares of each followed user.
+        follows = servicer.Follow(database_pb2.DbFollowRequest(
+            request_type=database_pb2.DbFollowRequest.FIND,
+            match=database_pb2.Follow(follower=req.user_id)), context)
+        viewer = {'value': req.user_id}
+        for f in follows.results:
+            servicer.Posts(database_pb2.PostsRequest(
+                request_type=database_pb2.PostsRequest.FIND,
+                match=database_pb2.PostsEntry(author_id=f.followed),
+                user_global_id=viewer), context)
+            servicer.SharedPosts(database_pb2.SharedPostsRequest(
+                num_posts=50, sharer_id=f.followed,
+                user_global_id=viewer), context)
+        return follows
+
+    def home_feed_request():
+        return database_pb2.UserTimelineRequest(
+            user_id=traffic.local_user(), page_size=20)
+
+    feed_token = servicer.InstanceFeed(
+        database_pb2.InstanceFeedRequest(num_posts=20), None).next_page_token
+
+    return [
+        ('InstanceFeed',
+         lambda: with_viewer(database_pb2.InstanceFeedRequest(num_posts=20)),
+         servicer.InstanceFeed),
+        ('InstanceFeed page 2',
+         lambda: with_viewer(database_pb2.InstanceFeedRequest(
+             num_posts=20, page_token=feed_token)),
+         servicer.InstanceFeed),
+        ('Posts FIND global_id',
+         lambda: posts_find(database_pb2.PostsEntry(
+             global_id=traffic.post())),
+         servicer.Posts),
+        ('Posts FIND ap_id',
+         lambda: posts_find(database_pb2.PostsEntry(
+             ap_id=traffic.rng.choice(traffic.ap_ids))),
+         servicer.Posts),
+        ('Posts FIND author',
+         lambda: posts_find(database_pb2.PostsEntry(
+             author_id=traffic.user())),
+         servicer.Posts),
+        ('Users FIND global_id',
+         lambda: database_pb2.UsersRequest(
+             request_type=database_pb2.UsersRequest.FIND,
+             match=database_pb2.UsersEntry(
+                 global_id=traffic.user())),
+         servicer.Users),
+        ('Follow FIND followers',
+         lambda: database_pb2.DbFollowRequest(
+             request_type=database_pb2.DbFollowRequest.FIND,
+             match=database_pb2.Follow(followed=traffic.user())),
+         servicer.Follow),
+        ('Follow FIND following',
+         lambda: database_pb2.DbFollowRequest(
+             request_type=database_pb2.DbFollowRequest.FIND,
+             match=database_pb2.Follow(follower=traffic.viewer())),
+         servicer.Follow),
+        ('SearchArticles',
+         lambda: with_viewer(database_pb2.DatabaseSearchRequest(
+             query=traffic.search_term(), num_responses=20)),
+         servicer.SearchArticles),
+        ('SharedPosts',
+         lambda: with_viewer(database_pb2.SharedPostsRequest(
+             num_posts=20, sharer_id=traffic.rng.choice(traffic.sharers))),
+         servicer.SharedPosts),
+        ('RandomPosts',
+         lambda: database_pb2.RandomPostsRequest(
+             num_posts=10, user_id=traffic.viewer()),
+         servicer.RandomPosts),
+        ('UserTimeline', home_feed_request, servicer.UserTimeline),
+        ('HomeFeed', home_feed_request, servicer.HomeFeed),
+        ('HomeFeed assembled', home_feed_request, assembled_home_feed),
+        ('BatchGetPosts',
+         lambda: database_pb2.BatchGetPostsRequest(
+             global_ids=[traffic.post() for _ in range(20)],
+             user_global_id={'value': traffic.viewer()}),
+         servicer.BatchGetPosts),
+        ('AddLike', traffic.new_like, servicer.AddLike),
+    ]
+
+
+def percentile(samples, p):
+    """percentile of samples, which must be sorted."""
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def run_case(make_request, call, calls, threads):
+    requests = [make_request() for _ in range(calls)]
+    samples = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client(requests):
+        times = []
+        failed = 0
+        for req in requests:
+            start = time.perf_counter()
+            resp = call(req, None)
+            times.append(time.perf_counter() - start)
+            failed += getattr(resp, 'result_type', 0) != 0
+        with lock:
+            samples.extend(times)
+            errors[0] += failed
+
+    clients = [threading.Thread(target=client, args=(requests[i::threads],))
+               for i in range(threads)]
+    start = time.perf_counter()
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    elapsed = time.perf_counter() - start
+    samples.sort()
+    result = {'calls': calls, 'errors': errors[0],
+              'throughput': calls / elapsed,
+              'mean_ms': sum(samples) / len(samples) * 1000,
+              'max_ms': samples[-1] * 1000}
+    for p in PERCENTILES:
+        result['p{}_ms'.format(p)] = percentile(samples, p) * 1000
+    return result
+
+
+def print_results(results):
+    print('{:>24} {:>9} {:>9} {:>9} {:>10} {:>6}'.format(
+        'case', 'p50 ms', 'p95 ms', 'p99 ms', 'calls/s', 'errors'))
+    for name, r in results.items():
+        print('{:>24} {:>9.3f} {:>9.3f} {:>9.3f} {:>10.0f} {:>6}'.format(
+            name, r['p50_ms'], r['p95_ms'], r['p99_ms'], r['throughput'],
+            r['errors']))
+
+
+def compare(results, baseline, threshold):
+    print()
+    print('{:>24} {:>10} {:>10} {:>12}'.format(
+        'case', 'p50 ratio', 'p99 ratio', 'calls/s ratio'))
+    regressed = []
+    for name, r in results.items():
+        b = baseline['results'].get(name)
+        if b is None:
+            continue
+        p50 = r['p50_ms'] / b['p50_ms']
+        p99 = r['p99_ms'] / b['p99_ms']
+        flag = ''
+        if max(p50, p99) > 1 + threshold:
+            flag = ' worse'
+            regressed.append(name)
+        print('{:>24} {:>10.2f} {:>10.2f} {:>12.2f}{}'.format(
+            name, p50, p99, r['throughput'] / b['throughput'], flag))
+    return regressed
+
+
+def main():
+    args = get_args()
+    logger = logging.getLogger('benchmark')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    users = args.users or dataset.SCALES[args.scale]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, 'bench.db')
+        if os.path.exists(path):
+            db = DB(path)
+            counts = {t: db.execute('SELECT COUNT(*) FROM ' + t)[0][0]
+                      for t in ('users', 'posts', 'follows', 'likes',
+                                'shares')}
+        else:
+            start = time.perf_counter()
+            db, counts = dataset.build(logger, path, users, args.seed)
+            print('Generated {} in {:.1f}s'.format(
+                ', '.join('{} {}'.format(n, t) for t, n in counts.items()),
+                time.perf_counter() - start))
+        servicer = DatabaseServicer(db, logger)
+        traffic = Traffic(db, args.seed)
+        selected = args.cases.split(',') if args.cases else None
+        results = {}
+        for name, make_request, call in cases(servicer, traffic):
+            if selected is None or name in selected:
+                results[name] = run_case(make_request, call, args.calls,
+                                         args.threads)
+        servicer.close()
+        db.close()
+
+    print_results(results)
+    report = {'dataset': counts, 'seed': args.seed, 'calls': args.calls,
+              'threads': args.threads, 'results': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['dataset'] != counts:
+            print('Warning: the baseline was run on a different dataset')
+        if compare(results, baseline, args.threshold):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Compare AddView throughput with and without buffered ingestion.
+
+Client threads call ViewDatabaseServicer.AddView directly. In "direct" mode
+each view is its own DB.write, which is how views were written before the
+BufferedInserter. In "buffered" mode views are queued and written in
+batches; the timer stops once every view is in the database.
+
+Run from the database service directory:
+  python3 -m benchmarks.views --clients 16 --views 20000
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import ingest
+from database import build_database
+from view_servicer import ViewDatabaseServicer
+from services.proto import database_pb2
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        'Benchmark view ingestion throughput')
+    parser.add_argument('--clients', default=16, type=int,
+                        help='Number of concurrent client threads.')
+    parser.add_argument('--views', default=20000, type=int,
+                        help='Total number of views to add per mode.')
+    parser.add_argument('--drop_policy', default=ingest.BLOCK,
+                        choices=ingest.DROP_POLICIES,
+                        help='Drop policy for the buffered mode. The default '
+                        'blocks so that both modes store every view.')
+    return parser.parse_args()
+
+
+class DirectViews:
+    """Writes each view on its own, like AddView did before buffering."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def add(self, row):
+        self._db.write(lambda tx: tx.execute(
+            'INSERT INTO views (user_id, path, datetime) VALUES (?, ?, ?)',
+            *row))
+        return True
+
+    def close(self):
+        pass
+
+
+def run(db, logger, mode, args):
+    views = ViewDatabaseServicer(db, logger, drop_policy=args.drop_policy)
+    if mode == 'direct':
+        views._views.close()
+        views._views = DirectViews(db)
+    per_client = args.views // args.clients
+
+    def client(n):
+        for i in range(per_client):
+            views.AddView(database_pb2.View(
+                user=n, path='#/post/{}'.format(i)), None)
+
+    threads = [threading.Thread(target=client, args=(n,))
+               for n in range(args.clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    views.close()
+    elapsed = time.perf_counter() - start
+    stored = db.execute('SELECT COUNT(*) FROM views')[0][0]
+    return stored / elapsed, per_client * args.clients - stored
+
+
+def main():
+    args = get_args()
+    logger = logging.getLogger('benchmark')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    schema = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'rabble_schema.sql')
+    print('{:>10} {:>14} {:>10}'.format('mode', 'views/s', 'dropped'))
+    for mode in ('direct', 'buffered'):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = build_database(logger, schema, os.path.join(tmp, 'bench.db'))
+            rate, dropped = run(db, logger, mode, args)
+            print('{:>10} {:>14.1f} {:>10}'.format(mode, rate, dropped))
+            db.close()
+
+
+if __name__ == '__main__':
+    main()
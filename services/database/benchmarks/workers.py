@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Measure database service throughput as the gRPC worker count grows.
+
+A synthetic instance is written to a temporary database, then for each
+worker count a real gRPC server is started in-process and hammered by client
+threads issuing a mix of cheap point lookups, likes and occasional full scans
+(AllUserLikes). With a single worker every cheap request queues behind the
+scans; with more workers they proceed in parallel.
+
+Run from the database service directory:
+  python3 -m benchmarks.workers --workers 1,2,4,8
+"""
+from concurrent import futures
+import argparse
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+import grpc
+
+from database import build_database
+from database_servicer import DatabaseServicer
+from services.proto import database_pb2
+from services.proto import database_pb2_grpc
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        'Benchmark database service throughput by worker count')
+    parser.add_argument('--workers', default='1,2,4,8',
+                        help='Comma separated worker counts to try.')
+    parser.add_argument('--clients', default=16, type=int,
+                        help='Number of concurrent client threads.')
+    parser.add_argument('--duration', default=5.0, type=float,
+                        help='Seconds to run each worker count for.')
+    parser.add_argument('--users', default=2000, type=int)
+    parser.add_argument('--posts', default=20000, type=int)
+    parser.add_argument('--likes', default=50000, type=int)
+    parser.add_argument('--scan_ratio', default=0.02, type=float,
+                        help='Fraction of requests that are full scans.')
+    return parser.parse_args()
+
+
+def populate(db, n_users, n_posts, n_likes):
+    rand = random.Random(1798)
+    with db.transaction() as tx:
+        for i in range(n_users):
+            tx.execute(
+                'INSERT INTO users (handle, host, display_name, password, '
+                'bio, private, public_key, private_key) '
+                'VALUES (?, ?, ?, "", "", 0, "", "")',
+                'user{}'.format(i),
+                None if i % 3 else 'remote{}.com'.format(i % 17),
+                'User {}'.format(i))
+        for i in range(n_posts):
+            tx.execute(
+                'INSERT INTO posts (author_id, title, body, '
+                'creation_datetime, md_body, ap_id, tags, summary) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, "")',
+                rand.randint(1, n_users), 'Post {}'.format(i),
+                'body of post {}'.format(i), i, 'body of post',
+                'https://bench/{}'.format(i), 'tag{}'.format(i % 50))
+        seen = set()
+        while len(seen) < n_likes:
+            seen.add((rand.randint(1, n_users), rand.randint(1, n_posts)))
+        for user_id, article_id in seen:
+            tx.execute('INSERT INTO likes (user_id, article_id) '
+                       'VALUES (?, ?)', user_id, article_id)
+
+
+def client_loop(stub, args, stop, latencies, rand):
+    while not stop.is_set():
+        start = time.perf_counter()
+        r = rand.random()
+        if r < args.scan_ratio:
+            stub.AllUserLikes(database_pb2.AllUsersRequest())
+            continue
+        if r < 0.7:
+            stub.Users(database_pb2.UsersRequest(
+                request_type=database_pb2.UsersRequest.FIND,
+                match=database_pb2.UsersEntry(
+                    global_id=rand.randint(1, args.users))))
+        else:
+            stub.AddLike(database_pb2.LikeEntry(
+                user_id=rand.randint(1, args.users),
+                article_id=rand.randint(1, args.posts)))
+        latencies.append(time.perf_counter() - start)
+
+
+def run_once(db, logger, workers, args):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+    servicer = DatabaseServicer(db, logger)
+    database_pb2_grpc.add_DatabaseServicer_to_server(servicer, server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    stop = threading.Event()
+    latencies = []
+    threads = []
+    with grpc.insecure_channel('127.0.0.1:{}'.format(port)) as chan:
+        stub = database_pb2_grpc.DatabaseStub(chan)
+        for i in range(args.clients):
+            t = threading.Thread(
+                target=client_loop,
+                args=(stub, args, stop, latencies, random.Random(i)))
+            t.start()
+            threads.append(t)
+        time.sleep(args.duration)
+        stop.set()
+        for t in threads:
+            t.join()
+    server.stop(None)
+    servicer.close()
+    latencies.sort()
+    if not latencies:
+        return 0, 0
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return len(latencies) / args.duration, p99 * 1000
+
+
+def main():
+    args = get_args()
+    logger = logging.getLogger('benchmark')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    schema = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'rabble_schema.sql')
+    with tempfile.TemporaryDirectory() as tmp:
+        db = build_database(logger, schema, os.path.join(tmp, 'bench.db'))
+        populate(db, args.users, args.posts, args.likes)
+        print('{:>8} {:>14} {:>14}'.format(
+            'workers', 'point req/s', 'p99 ms'))
+        for workers in (int(w) for w in args.workers.split(',')):
+            rps, p99 = run_once(db, logger, workers, args)
+            print('{:>8} {:>14.1f} {:>14.2f}'.format(workers, rps, p99))
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
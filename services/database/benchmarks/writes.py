@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Compare like throughput with and without the group-commit writer.
+
+Client threads call LikeDatabaseServicer.AddLike directly. In "direct" mode
+each like commits its own transaction from the calling thread, which is how
+the service wrote before the writer existed. In "group" mode likes go
+through DB.write and share commits. Both modes fsync every commit.
+
+Run from the database service directory:
+  python3 -m benchmarks.writes --clients 32 --likes 5000
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from database import build_database
+from like_servicer import LikeDatabaseServicer
+from services.proto import database_pb2
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        'Benchmark database write throughput with group commit')
+    parser.add_argument('--clients', default=32, type=int,
+                        help='Number of concurrent writer threads.')
+    parser.add_argument('--likes', default=5000, type=int,
+                        help='Total number of likes to add per mode.')
+    parser.add_argument('--posts', default=100, type=int,
+                        help='Number of posts the likes are spread over.')
+    return parser.parse_args()
+
+
+class DirectWriteDB:
+    """Runs DB.write callbacks in a transaction on the calling thread."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def write(self, fn):
+        with self._db.transaction() as tx:
+            return fn(tx)
+
+
+def run(db, target, logger, args):
+    with db.transaction() as tx:
+        for i in range(args.posts):
+            tx.execute(
+                'INSERT INTO posts (author_id, title, body, '
+                'creation_datetime, md_body, ap_id, tags, summary) '
+                'VALUES (1, "", "", 0, "", ?, "", "")',
+                'https://bench/{}'.format(i))
+    likes = LikeDatabaseServicer(target, logger)
+    per_client = args.likes // args.clients
+
+    def client(n):
+        for i in range(per_client):
+            likes.AddLike(database_pb2.LikeEntry(
+                user_id=n * per_client + i,
+                article_id=i % args.posts + 1), None)
+
+    threads = [threading.Thread(target=client, args=(n,))
+               for n in range(args.clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return per_client * args.clients / (time.perf_counter() - start)
+
+
+def main():
+    args = get_args()
+    logger = logging.getLogger('benchmark')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    schema = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'rabble_schema.sql')
+    print('{:>8} {:>14}'.format('mode', 'likes/s'))
+    for mode in ('direct', 'group'):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = build_database(logger, schema, os.path.join(tmp, 'bench.db'))
+            target = db if mode == 'group' else DirectWriteDB(db)
+            rate = run(db, target, logger, args)
+            print('{:>8} {:>14.1f}'.format(mode, rate))
+            db.close()
+
+
+if __name__ == '__main__':
+    main()
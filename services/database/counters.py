@@ -0,0 +1,93 @@
+import sqlite3
+import threading
+
+# Seconds between folding pending counter changes into posts.
+DEFAULT_FOLD_INTERVAL = 10
+# Posts folded per write.
+FOLD_BATCH = 1000
+
+# Pass the post id to record a like, unlike, share or unshare of it.
+ADD_LIKE = ('INSERT INTO post_counter_deltas (post_id, likes) VALUES (?, 1) '
+            'ON CONFLICT (post_id) DO UPDATE SET likes = likes + 1')
+REMOVE_LIKE = ('INSERT INTO post_counter_deltas (post_id, likes) '
+               'VALUES (?, -1) '
+               'ON CONFLICT (post_id) DO UPDATE SET likes = likes - 1')
+ADD_SHARE = ('INSERT INTO post_counter_deltas (post_id, shares) '
+             'VALUES (?, 1) '
+             'ON CONFLICT (post_id) DO UPDATE SET shares = shares + 1')
+REMOVE_SHARE = ('INSERT INTO post_counter_deltas (post_id, shares) '
+                'VALUES (?, -1) '
+                'ON CONFLICT (post_id) DO UPDATE SET shares = shares - 1')
+
+# For queries on posts p: join in the pending changes and select the
+# current counts.
+JOIN_DELTAS = ('LEFT OUTER JOIN post_counter_deltas d '
+               'ON d.post_id = p.global_id ')
+LIKES_COUNT = 'p.likes_count + IFNULL(d.likes, 0)'
+SHARES_COUNT = 'p.shares_count + IFNULL(d.shares, 0)'
+
+
+class CounterFolder:
+    """
+    CounterFolder periodically moves pending like and share counts from
+    post_counter_deltas into posts.
+
+    Likes and shares add to a small row in post_counter_deltas rather than
+    updating the posts row, which holds the whole article, on every like.
+    Readers add the pending delta to the posts columns, so the counts they
+    see don't change when a fold happens.
+    """
+
+    def __init__(self, db, logger):
+        self._db = db
+        self._logger = logger
+        self._stop = threading.Event()
+        self._thread = None
+
+    def fold(self):
+        """
+        fold moves every pending delta into posts.
+
+        Returns:
+          The number of posts updated.
+        """
+        total = 0
+        try:
+            while True:
+                n = self._db.write(self._fold_batch)
+                total += n
+                if n < FOLD_BATCH:
+                    break
+        except sqlite3.Error as e:
+            self._logger.error('Folding post counters failed: %s', str(e))
+        self._logger.debug('Folded counters for %d posts', total)
+        return total
+
+    def _fold_batch(self, tx):
+        rows = tx.execute('SELECT post_id, likes, shares '
+                          'FROM post_counter_deltas LIMIT ?', FOLD_BATCH)
+        for post_id, likes, shares in rows:
+            if likes or shares:
+                tx.execute('UPDATE posts SET likes_count = likes_count + ?, '
+                           'shares_count = shares_count + ? '
+                           'WHERE global_id = ?', likes, shares, post_id)
+            tx.execute('DELETE FROM post_counter_deltas WHERE post_id = ?',
+                       post_id)
+        return len(rows)
+
+    def start(self, interval=DEFAULT_FOLD_INTERVAL):
+        """start folds every interval seconds in the background."""
+        def loop():
+            while not self._stop.wait(interval):
+                self.fold()
+        self._thread = threading.Thread(
+            target=loop, name='counters', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        # Leave nothing pending, so the posts columns are accurate on their
+        # own after shutdown.
+        self.fold()
@@ -1,58 +1,359 @@
+import contextlib
 import logging
+import os
+import queue
 import sqlite3
+import threading
+import time
+
+import migrate
+
+# Seconds a connection will wait on a lock held by another connection before
+# giving up with "database is locked".
+DEFAULT_BUSY_TIMEOUT = 30
+# The most writes the writer thread will fold into a single commit.
+DEFAULT_MAX_BATCH = 256
+# Prepared statements kept per connection. FIND, UPDATE and DELETE build a
+# distinct statement for every combination of fields set, which can outgrow
+# sqlite3's default of 128, and a miss means parsing the SQL again.
+DEFAULT_CACHED_STATEMENTS = 512
+
+
+class Transaction:
+    """
+    Transaction wraps a cursor that is inside an open transaction.
+
+    Statements run through it are only made durable once the enclosing
+    DB.transaction block or DB.write call completes without raising.
+    """
+
+    def __init__(self, conn, stats=None):
+        self._conn = conn
+        self._cursor = conn.cursor()
+        self._stats = stats
+
+    def execute(self, statement, *params):
+        start = time.perf_counter()
+        self._cursor.execute(statement, params)
+        res = self._cursor.fetchall()
+        self._record(statement, params, start, len(res))
+        return res
+
+    def execute_count(self, statement, *params):
+        start = time.perf_counter()
+        self._cursor.execute(statement, params)
+        self._record(statement, params, start, self._cursor.rowcount)
+        return self._cursor.rowcount
+
+    def execute_many(self, statement, rows):
+        start = time.perf_counter()
+        self._cursor.executemany(statement, rows)
+        # There is no single set of parameters to explain the query with.
+        self._record(statement, None, start, self._cursor.rowcount)
+        return self._cursor.rowcount
+
+    def _record(self, statement, params, start, rows):
+        if self._stats is not None:
+            self._stats.record_statement(self._conn, statement, params,
+                                         time.perf_counter() - start, rows)
+
+    def close(self):
+        self._cursor.close()
+
+
+class _WriteJob:
+
+    def __init__(self, fn):
+        self.fn = fn
+        # The RPC the write is attributed to in the stats.
+        self.call = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class GroupCommitWriter:
+    """
+    GroupCommitWriter owns the only connection that writes to the database.
+
+    Callers hand it a function taking a Transaction and block until that
+    function's changes are durable. Writes that queue up while a commit is in
+    progress are run together in the next transaction, so a burst of N
+    writes costs one fsync rather than N. Each write runs in its own
+    savepoint, so one failing write is rolled back and reported to its
+    caller without affecting the rest of the batch.
+    """
+
+    def __init__(self, connect, max_batch=DEFAULT_MAX_BATCH, stats=None):
+        self._connect = connect
+        self._max_batch = max_batch
+        self._stats = stats
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.writes = 0
+        self._thread = threading.Thread(
+            target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn):
+        if threading.current_thread() is self._thread:
+            raise RuntimeError('Writes cannot be nested inside a write')
+        job = _WriteJob(fn)
+        if self._stats is not None:
+            job.call = self._stats.current()
+        self._queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        conn = self._connect()
+        # In WAL mode NORMAL would skip the fsync on commit. Batching is what
+        # buys the throughput here, so keep every commit durable.
+        conn.execute('PRAGMA synchronous=FULL')
+        stopping = False
+        while not stopping:
+            job = self._queue.get()
+            if job is None:
+                break
+            batch = [job]
+            while len(batch) < self._max_batch:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+            self._commit_batch(conn, batch)
+        conn.close()
+
+    def _run_job(self, tx, job):
+        if self._stats is None:
+            return job.fn(tx)
+        with self._stats.bind(job.call):
+            return job.fn(tx)
+
+    def _commit_batch(self, conn, batch):
+        tx = Transaction(conn, self._stats)
+        try:
+            tx.execute('BEGIN IMMEDIATE')
+            for job in batch:
+                tx.execute('SAVEPOINT write_job')
+                try:
+                    job.result = self._run_job(tx, job)
+                except Exception as e:
+                    tx.execute('ROLLBACK TO write_job')
+                    job.error = e
+                tx.execute('RELEASE write_job')
+            conn.commit()
+            self.batches += 1
+            self.writes += len(batch)
+        except sqlite3.Error as e:
+            conn.rollback()
+            for job in batch:
+                job.result = None
+                job.error = e
+        finally:
+            tx.close()
+            for job in batch:
+                job.done.set()
 
 
 class DB:
 
-    def __init__(self, filename):
+    def __init__(self, filename, timeout=DEFAULT_BUSY_TIMEOUT,
+                 max_batch=DEFAULT_MAX_BATCH,
+                 cached_statements=DEFAULT_CACHED_STATEMENTS, stats=None):
         self.filename = filename
-        self.cursor = None
-
-    def _get_cursor(self):
-        # Connections and cursors can't be shared between threads so they're
-        # kept here for now.
-        # TODO(CianLR): Work out how gRPC threading works and how to share
-        # these objects properly.
-        conn = sqlite3.connect(self.filename)
-        return conn.cursor()
-
-    def commit(self):
-        if not self.cursor:
-            return
-        self.cursor.connection.commit()
-        self.cursor.close()
-        self.cursor = None
-
-    def discard_cursor(self):
-        if self.cursor is not None:
-            self.cursor.close()
-        self.cursor = None
-
-    def execute(self, statement, *params, commit=True):
-        if self.cursor is None:
-            self.cursor = self._get_cursor()
-        self.cursor.execute(statement, params)
-        res = self.cursor.fetchall()
-        if commit:
-            self.commit()
-        return res
+        self._timeout = timeout
+        self._cached_statements = cached_statements
+        # If set, every statement's latency is recorded in this stats.Stats.
+        self._stats = stats
+        # Each thread gets its own long-lived connection. gRPC reuses the
+        # threads in its pool so connections are opened once per worker
+        # rather than once per statement.
+        self._local = threading.local()
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        # Lets the maintenance scheduler return free pages to the file system
+        # a few at a time. This only takes effect when the database is
+        # created; an existing file keeps its mode until a full VACUUM.
+        self.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        # WAL lets readers carry on while the writer commits. The journal
+        # mode is stored in the database file so this only needs to happen
+        # once, before the writer starts.
+        self.execute('PRAGMA journal_mode=WAL')
+        self._writer = GroupCommitWriter(self._connect, max_batch, stats)
+
+    def _connect(self):
+        # isolation_level=None puts the connection in autocommit mode, so
+        # single statements commit immediately and multi-statement work has
+        # to be wrapped in an explicit transaction().
+        # check_same_thread is disabled only so that close() can tear down
+        # every thread's connection; each connection is otherwise only ever
+        # used by the thread that opened it.
+        return sqlite3.connect(self.filename,
+                               timeout=self._timeout,
+                               isolation_level=None,
+                               check_same_thread=False,
+                               cached_statements=self._cached_statements)
+
+    def _get_conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            with self._conns_lock:
+                self._conns.append(conn)
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        transaction opens a scoped transaction on this thread's connection.
+
+        Usage:
+          with db.transaction() as tx:
+              tx.execute('INSERT ...', a, b)
+              tx.execute('UPDATE ...', c)
+
+        The transaction is committed when the block exits normally and rolled
+        back if it raises. The write lock is taken up front (BEGIN IMMEDIATE)
+        so concurrent writers queue on the busy timeout instead of failing
+        when upgrading from a read lock.
+        """
+        conn = self._get_conn()
+        tx = Transaction(conn, self._stats)
+        try:
+            tx.execute('BEGIN IMMEDIATE')
+            yield tx
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+        finally:
+            tx.close()
+
+    def write(self, fn):
+        """
+        write runs fn(tx) on the writer thread and returns its result.
+
+        fn is given a Transaction and may run any number of statements; they
+        are committed atomically, possibly alongside other callers' writes,
+        before write returns. If fn raises, its statements are rolled back
+        and the exception is re-raised here.
+
+        Usage:
+          def add(tx):
+              tx.execute('INSERT ...', a)
+              return tx.execute('SELECT last_insert_rowid()')
+          res = db.write(add)
+        """
+        return self._writer.submit(fn)
+
+    def pending_writes(self):
+        """pending_writes is the number of writes waiting for the writer."""
+        return self._writer.pending()
+
+    def _record(self, conn, statement, params, start, rows):
+        if self._stats is not None:
+            self._stats.record_statement(conn, statement, params,
+                                         time.perf_counter() - start, rows)
+
+    def execute(self, statement, *params):
+        conn = self._get_conn()
+        cursor = conn.cursor()
+        try:
+            start = time.perf_counter()
+            cursor.execute(statement, params)
+            res = cursor.fetchall()
+            self._record(conn, statement, params, start, len(res))
+            return res
+        finally:
+            cursor.close()
+
+    def execute_chunks(self, chunk_size, statement, *params):
+        """
+        execute_chunks runs a query and yields its rows in lists of at most
+        chunk_size, reading them from SQLite as they are consumed.
+
+        The query holds a read snapshot until the generator is exhausted or
+        closed, so consume it promptly.
+        """
+        conn = self._get_conn()
+        cursor = conn.cursor()
+        rows_read = 0
+        # Only time spent in SQLite is recorded, not time spent waiting for
+        # the caller to consume a chunk.
+        elapsed = 0
+        try:
+            start = time.perf_counter()
+            cursor.execute(statement, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                elapsed += time.perf_counter() - start
+                if not rows:
+                    return
+                rows_read += len(rows)
+                yield rows
+                start = time.perf_counter()
+        finally:
+            cursor.close()
+            if self._stats is not None:
+                self._stats.record_statement(conn, statement, params,
+                                             elapsed, rows_read)
 
     def execute_count(self, statement, *params):
-        cursor = self._get_cursor()
-        cursor.execute(statement, params)
-        count = cursor.rowcount
-        cursor.connection.commit()
-        cursor.close()
-        return count
+        conn = self._get_conn()
+        cursor = conn.cursor()
+        try:
+            start = time.perf_counter()
+            cursor.execute(statement, params)
+            self._record(conn, statement, params, start, cursor.rowcount)
+            return cursor.rowcount
+        finally:
+            cursor.close()
+
+    def backup(self, target):
+        """
+        backup copies the database into target, an open sqlite3 connection.
+
+        The copy is made in a single step, so it is a consistent snapshot
+        of the last commit even while the writer carries on.
+        """
+        self._get_conn().backup(target)
 
     def execute_script(self, script):
-        cursor = self._get_cursor()
-        cursor.executescript(script)
-        cursor.close()
+        self._get_conn().executescript(script)
+
+    def rollback(self):
+        conn = self._get_conn()
+        if conn.in_transaction:
+            conn.rollback()
+
+    def close(self):
+        self._writer.stop()
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
 
 
-def build_database(logger, schema_path, db_path):
-    db = DB(db_path)
+def build_database(logger, schema_path, db_path, migrations_dir=None,
+                   stats=None):
+    db = DB(db_path, stats=stats)
     try:
         f = open(schema_path)
         script = f.read()
@@ -61,4 +362,9 @@ def build_database(logger, schema_path, db_path):
         logger.error("Couldn't find schema file at: '{}'", schema_path)
         raise
     db.execute_script(script)
+    if migrations_dir is None:
+        migrations_dir = os.path.join(
+            os.path.dirname(schema_path), 'migrations')
+    version = migrate.apply_migrations(logger, db, migrations_dir)
+    logger.info("Database is at schema version %d", version)
     return db
@@ -5,17 +5,33 @@ from like_servicer import LikeDatabaseServicer
 from view_servicer import ViewDatabaseServicer
 from log_servicer import LogDatabaseServicer
 from share_servicer import ShareDatabaseServicer
+from rollup_servicer import RollupDatabaseServicer
+from maintenance import Scheduler
+from maintenance_servicer import MaintenanceDatabaseServicer
+from stats_servicer import StatsDatabaseServicer
+from purge_servicer import PurgeDatabaseServicer
+import usercache
 
 from services.proto import database_pb2_grpc
 
 
 class DatabaseServicer(database_pb2_grpc.DatabaseServicer):
 
-    def __init__(self, db, logger):
+    def __init__(self, db, logger, ingest_options=None, scheduler=None,
+                 stats=None, user_cache_size=usercache.DEFAULT_SIZE,
+                 snapshots=None):
         self._db = db
         self._logger = logger
+        # Passed on to the BufferedInserters for views and logs.
+        ingest_options = ingest_options or {}
+        # Maintenance can still be run on demand if no scheduler is running.
+        if scheduler is None:
+            scheduler = Scheduler(db, logger)
+        # The recommenders' whole-table reads are served from snapshots of
+        # the database if given, or else from the database itself.
+        bulk_db = snapshots or db
 
-        posts_servicer = PostsDatabaseServicer(db, logger)
+        posts_servicer = PostsDatabaseServicer(db, logger, bulk_db)
         self.Posts = posts_servicer.Posts
         self.InstanceFeed = posts_servicer.InstanceFeed
         self.SearchArticles = posts_servicer.SearchArticles
@@ -23,25 +39,58 @@ class DatabaseServicer(database_pb2_grpc.DatabaseServicer):
         self.RandomPosts = posts_servicer.RandomPosts
         self.SafeRemovePost = posts_servicer.SafeRemovePost
         self.TaggedPosts = posts_servicer.TaggedPosts
-        users_servicer = UsersDatabaseServicer(db, logger)
+        self.StreamTaggedPosts = posts_servicer.StreamTaggedPosts
+        self.BatchGetPosts = posts_servicer.BatchGetPosts
+        self.BatchInsertPosts = posts_servicer.BatchInsertPosts
+        self.UserTimeline = posts_servicer.UserTimeline
+        self.HomeFeed = posts_servicer.HomeFeed
+        self.PostsByTag = posts_servicer.PostsByTag
+        self.TagStats = posts_servicer.TagStats
+        self.StreamPostTags = posts_servicer.StreamPostTags
+        users_servicer = UsersDatabaseServicer(
+            db, logger, user_cache_size, bulk_db)
         self.Users = users_servicer.Users
         self.SearchUsers = users_servicer.SearchUsers
         self.PendingFollows = users_servicer.PendingFollows
         self.CreateUsersIndex = users_servicer.CreateUsersIndex
-        follow_servicer = FollowDatabaseServicer(db, logger)
+        follow_servicer = FollowDatabaseServicer(db, logger, bulk_db)
         self.Follow = follow_servicer.Follow
+        self.StreamAllFollows = follow_servicer.StreamAllFollows
         like_servicer = LikeDatabaseServicer(db, logger)
         self.AddLike = like_servicer.AddLike
         self.RemoveLike = like_servicer.RemoveLike
         self.LikedCollection = like_servicer.LikedCollection
-        view_servicer = ViewDatabaseServicer(db, logger)
-        self.AddView = view_servicer.AddView
-        log_servicer = LogDatabaseServicer(db, logger)
-        self.AddLog = log_servicer.AddLog
+        self._view_servicer = ViewDatabaseServicer(
+            db, logger, **ingest_options)
+        self.AddView = self._view_servicer.AddView
+        self._log_servicer = LogDatabaseServicer(
+            db, logger, **ingest_options)
+        self.AddLog = self._log_servicer.AddLog
+        rollup_servicer = RollupDatabaseServicer(db, logger)
+        self.Rollups = rollup_servicer.Rollups
+        maintenance_servicer = MaintenanceDatabaseServicer(
+            db, logger, scheduler)
+        self.MaintenanceStatus = maintenance_servicer.MaintenanceStatus
+        self.RunMaintenance = maintenance_servicer.RunMaintenance
+        stats_servicer = StatsDatabaseServicer(
+            db, logger, stats, caches={'users': users_servicer.cache})
+        self.DatabaseStats = stats_servicer.DatabaseStats
         self.AllUsers = users_servicer.AllUsers
         self.AllUserLikes = users_servicer.AllUserLikes
+        self.StreamAllUsers = users_servicer.StreamAllUsers
+        self.StreamAllUserLikes = users_servicer.StreamAllUserLikes
+        self.BatchGetUsers = users_servicer.BatchGetUsers
+        purge_servicer = PurgeDatabaseServicer(
+            db, logger, users_servicer.cache)
+        self.PurgeUser = purge_servicer.PurgeUser
+        self.PurgeHost = purge_servicer.PurgeHost
         share_servicer = ShareDatabaseServicer(db, logger)
         self.AddShare = share_servicer.AddShare
         self.FindShare = share_servicer.FindShare
         self.SharedPosts = share_servicer.SharedPosts
         self.GetSharersOfPost = share_servicer.GetSharersOfPost
+
+    def close(self):
+        # Write out buffered views and logs. Call before closing the DB.
+        self._view_servicer.close()
+        self._log_servicer.close()
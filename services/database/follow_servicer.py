@@ -5,11 +5,24 @@ import util
 from services.proto import database_pb2
 
 
+def is_full_scan(req):
+    """
+    is_full_scan is whether a Follow request reads every follow, as the
+    follow recommenders' FINDs with no match do.
+    """
+    return (req.request_type == database_pb2.DbFollowRequest.FIND and
+            not req.match.follower and not req.match.followed and
+            not req.page_size and not req.page_token)
+
+
 class FollowDatabaseServicer:
 
-    def __init__(self, db, logger):
+    def __init__(self, db, logger, bulk_db=None):
         self._db = db
         self._logger = logger
+        # Whole-table reads go to bulk_db, a snapshots.Snapshots or the DB
+        # itself.
+        self._bulk_db = bulk_db or db
         self._follow_type_handlers = {
             database_pb2.DbFollowRequest.INSERT: self._follow_handle_insert,
             database_pb2.DbFollowRequest.FIND: self._follow_handle_find,
@@ -40,6 +53,29 @@ class FollowDatabaseServicer:
         self._follow_type_handlers[request.request_type](request, response)
         return response
 
+    def StreamAllFollows(self, request, context):
+        # The active follows, as a Follow FIND with no match returns, in
+        # chunks rather than one response.
+        n = request.chunk_size or util.DEFAULT_CHUNK_SIZE
+        try:
+            for rows in self._bulk_db.execute_chunks(
+                    n,
+                    'SELECT follower, followed, state FROM follows '
+                    'WHERE state = ? ORDER BY rowid',
+                    database_pb2.Follow.ACTIVE):
+                response = database_pb2.DbFollowResponse(
+                    result_type=database_pb2.DbFollowResponse.OK)
+                for tup in rows:
+                    if not self._db_tuple_to_entry(tup, response.results.add()):
+                        del response.results[-1]
+                yield response
+        except sqlite3.Error as e:
+            self._logger.warning('Got error reading DB: ' + str(e))
+            yield database_pb2.DbFollowResponse(
+                result_type=database_pb2.DbFollowResponse.ERROR,
+                error=str(e),
+            )
+
     def _follow_handle_insert(self, req, resp):
         self._logger.info('Inserting new follow into Follow database.')
         # Make sure that we always set state with a default value of ACTIVE.
@@ -47,13 +83,13 @@ class FollowDatabaseServicer:
         if state == None:
             state = database_pb2.Follow.ACTIVE
         try:
-            self._db.execute(
+            self._db.write(lambda tx: tx.execute(
                 'INSERT INTO follows '
                 '(follower, followed, state) '
                 'VALUES (?, ?, ?)',
                 req.entry.follower,
                 req.entry.followed,
-                state)
+                state))
         except sqlite3.Error as e:
             self._logger.error(str(e))
             resp.result_type = database_pb2.DbFollowResponse.ERROR
@@ -74,13 +110,25 @@ class FollowDatabaseServicer:
                 resp.result_type = database_pb2.DbFollowResponse.ERROR
                 resp.error = err
                 return
+            elif req.page_size or req.page_token:
+                n = req.page_size or util.DEFAULT_PAGE_SIZE
+                filter_clause, values = util.keyset_filter(
+                    filter_clause, values, 'rowid', req.page_token)
+                query = ('SELECT follower, followed, state, rowid '
+                         'FROM follows WHERE ' + filter_clause +
+                         ' ORDER BY rowid DESC LIMIT ?')
+                res = self._db.execute(query, *values, n + 1)
+                res, resp.next_page_token = util.split_page(
+                    res, n, lambda tup: tup[3])
+                res = [tup[:3] for tup in res]
             else:
                 query = 'SELECT * FROM follows WHERE ' + filter_clause
                 valstr = ', '.join(str(v) for v in values)
                 self._logger.debug('Running query "%s" with values (%s)',
                                    query, valstr)
-                res = self._db.execute(query, *values)
-        except sqlite3.Error as e:
+                db = self._bulk_db if is_full_scan(req) else self._db
+                res = db.execute(query, *values)
+        except (sqlite3.Error, util.InvalidPageToken) as e:
             self._logger.warning('Got error reading DB: ' + str(e))
             resp.result_type = database_pb2.DbFollowResponse.ERROR
             resp.error = str(e)
@@ -114,7 +162,8 @@ class FollowDatabaseServicer:
             query = 'UPDATE follows SET state = ? WHERE ' + filter_clause
             valstr = str(req.entry.state) + ", " + ', '.join(str(v)
                                                              for v in values)
-            count = self._db.execute_count(query, req.entry.state, *values)
+            count = self._db.write(lambda tx: tx.execute_count(
+                query, req.entry.state, *values))
         except sqlite3.Error as e:
             self._logger.warning('Got error writing to DB: ' + str(e))
             resp.result_type = database_pb2.DbFollowResponse.ERROR
@@ -135,7 +184,7 @@ class FollowDatabaseServicer:
             filter_clause, values = util.equivalent_filter(req.match)
             query = 'DELETE FROM follows WHERE ' + filter_clause
             # TODO(iandioch): Count affected rows.
-            self._db.execute(query, *values)
+            self._db.write(lambda tx: tx.execute(query, *values))
         except sqlite3.Error as e:
             self._logger.error(str(e))
             resp.result_type = database_pb2.DbFollowResponse.ERROR
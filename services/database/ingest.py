@@ -0,0 +1,122 @@
+import collections
+import sqlite3
+import threading
+import time
+
+# What BufferedInserter.add does when the queue is full.
+DROP_NEWEST = 'newest'  # Discard the row being added.
+DROP_OLDEST = 'oldest'  # Discard the longest queued row to make room.
+BLOCK = 'block'  # Wait for the next flush to make room.
+DROP_POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK)
+
+# The most rows held in memory waiting to be written.
+DEFAULT_QUEUE_SIZE = 10000
+# Rows are written once this many are queued...
+DEFAULT_FLUSH_ROWS = 500
+# ...or this many milliseconds after the first of them was queued.
+DEFAULT_FLUSH_MS = 200
+
+
+class BufferedInserter:
+    """
+    BufferedInserter batches inserts for writes nobody waits on, such as
+    page views and client logs.
+
+    Rows passed to add are queued in memory and a background thread inserts
+    them with one multi-row DB.write every flush_rows rows or flush_ms
+    milliseconds, whichever comes first. This keeps telemetry from taking a
+    place in the writer queue per row. Rows still queued when the process
+    dies are lost, and when the queue is full drop_policy decides what gives.
+    """
+
+    def __init__(self, db, logger, name, statement,
+                 queue_size=DEFAULT_QUEUE_SIZE,
+                 flush_rows=DEFAULT_FLUSH_ROWS,
+                 flush_ms=DEFAULT_FLUSH_MS,
+                 drop_policy=DROP_NEWEST):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError('Unknown drop policy: ' + str(drop_policy))
+        self._db = db
+        self._logger = logger
+        self._name = name
+        self._statement = statement
+        self._queue_size = queue_size
+        self._flush_rows = flush_rows
+        self._flush_s = flush_ms / 1000
+        self._drop_policy = drop_policy
+        self._rows = collections.deque()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self.queued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self._thread = threading.Thread(
+            target=self._run, name='ingest-' + name, daemon=True)
+        self._thread.start()
+
+    def add(self, row):
+        """
+        add queues a row of statement parameters to be inserted.
+
+        Returns:
+          False if the row was dropped, otherwise True.
+        """
+        with self._cond:
+            if self._stopping:
+                self.dropped += 1
+                return False
+            if len(self._rows) >= self._queue_size:
+                if self._drop_policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self._drop_policy == DROP_OLDEST:
+                    self._rows.popleft()
+                    self.dropped += 1
+                else:
+                    while (len(self._rows) >= self._queue_size and
+                           not self._stopping):
+                        self._cond.wait()
+            self._rows.append(row)
+            self.queued += 1
+            n = len(self._rows)
+            if n == 1 or n >= self._flush_rows:
+                self._cond.notify_all()
+        return True
+
+    def close(self):
+        """close writes out every queued row and stops the flush thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._rows and not self._stopping:
+                    self._cond.wait()
+                if not self._rows:
+                    return
+                deadline = time.monotonic() + self._flush_s
+                while (len(self._rows) < self._flush_rows and
+                       not self._stopping):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                n = min(len(self._rows), self._flush_rows)
+                batch = [self._rows.popleft() for _ in range(n)]
+                # Wake any callers blocked on a full queue.
+                self._cond.notify_all()
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            self._db.write(
+                lambda tx: tx.execute_many(self._statement, batch))
+            self.written += len(batch)
+        except sqlite3.Error as e:
+            self.failed += len(batch)
+            self._logger.error('Writing %d %s failed: %s',
+                               len(batch), self._name, str(e))
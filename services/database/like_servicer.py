@@ -1,5 +1,7 @@
 import sqlite3
 
+import counters
+
 from services.proto import database_pb2 as db_pb
 
 
@@ -60,21 +62,18 @@ class LikeDatabaseServicer:
         response = db_pb.DBLikeResponse(
             result_type=db_pb.DBLikeResponse.OK
         )
-        try:
-            self._db.execute(
+
+        def add_like(tx):
+            tx.execute(
                 'INSERT INTO likes (user_id, article_id) '
                 'VALUES (?, ?)',
                 req.user_id,
                 req.article_id,
-                commit=False
-            )
-            self._db.execute(
-                'UPDATE posts SET likes_count = likes_count + 1 '
-                'WHERE global_id=?',
-                req.article_id
             )
+            tx.execute(counters.ADD_LIKE, req.article_id)
+        try:
+            self._db.write(add_like)
         except sqlite3.Error as e:
-            self._db.discard_cursor()
             self._logger.error("AddLike error: %s", str(e))
             response.result_type = db_pb.DBLikeResponse.ERROR
             response.error = str(e)
@@ -87,20 +86,17 @@ class LikeDatabaseServicer:
         response = db_pb.DBLikeResponse(
             result_type=db_pb.DBLikeResponse.OK
         )
-        try:
-            self._db.execute(
+
+        def remove_like(tx):
+            tx.execute(
                 'DELETE FROM likes WHERE user_id=? AND article_id=?',
-                req.user_id, req.article_id, commit=False)
-            self._db.execute(
-                'UPDATE posts SET likes_count = likes_count - 1 '
-                'WHERE global_id=?',
-                req.article_id,
-                commit=True
-            )
+                req.user_id, req.article_id)
+            tx.execute(counters.REMOVE_LIKE, req.article_id)
+        try:
+            self._db.write(remove_like)
         except sqlite3.Error as e:
-            self._db.discard_cursor()
             self._logger.error("RemoveLike error %s", str(e))
-            response.result_type = db_ob.DBLikeResponse.ERROR
+            response.result_type = db_pb.DBLikeResponse.ERROR
             response.error = str(e)
         return response
 
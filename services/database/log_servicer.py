@@ -1,13 +1,17 @@
-import sqlite3
-
 from services.proto import database_pb2 as db_pb
 
+import ingest
+
 
 class LogDatabaseServicer:
 
-    def __init__(self, db, logger):
+    def __init__(self, db, logger, **ingest_options):
         self._db = db
         self._logger = logger
+        self._logs = ingest.BufferedInserter(
+            db, logger, 'logs',
+            'INSERT INTO logs (user_id, message, datetime) VALUES (?, ?, ?)',
+            **ingest_options)
 
     def AddLog(self, req, context):
         self._logger.debug(
@@ -15,14 +19,9 @@ class LogDatabaseServicer:
             req.message.strip(), req.user
         )
         response = db_pb.AddLogResponse()
-        try:
-            self._db.execute(
-                'INSERT INTO logs (user_id, message, datetime) '
-                'VALUES (?, ?, ?)',
-                req.user,
-                req.message,
-                req.datetime.seconds
-            )
-        except sqlite3.Error as e:
-            self._logger.error("AddLog error: %s", str(e))
+        if not self._logs.add((req.user, req.message, req.datetime.seconds)):
+            self._logger.debug("AddLog: queue full, log dropped")
         return response
+
+    def close(self):
+        self._logs.close()
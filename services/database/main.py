@@ -1,15 +1,27 @@
 #!/usr/bin/env python3
 from concurrent import futures
 import argparse
+import asyncio
 import grpc
 import time
 
 from utils.logger import get_logger
 from database import build_database
+import aio_server
+import counters
+import ingest
+import maintenance
+import rollup
+import snapshots
+import stats
+import usercache
 from database_servicer import DatabaseServicer
 from services.proto import database_pb2_grpc
 
 
+ADDRESS = '0.0.0.0:1798'
+
+
 def get_args():
     parser = argparse.ArgumentParser('Run the Rabble database microservice')
     parser.add_argument(
@@ -18,30 +30,147 @@ def get_args():
     parser.add_argument(
         '--db_path', default='rabble.db',
         help='The path to the sqlite database file')
+    parser.add_argument(
+        '--workers', default=10, type=int,
+        help='The number of threads serving database requests.')
+    parser.add_argument(
+        '--aio', action='store_true',
+        help='Serve with grpc.aio, running requests on separate thread '
+        'pools for reads, writes and whole-table scans instead of one '
+        'thread per request. --workers is not used.')
+    parser.add_argument(
+        '--aio_readers', default=aio_server.DEFAULT_READERS, type=int,
+        help='With --aio, the number of threads serving reads.')
+    parser.add_argument(
+        '--aio_write_waiters', default=aio_server.DEFAULT_WRITE_WAITERS,
+        type=int,
+        help='With --aio, the number of threads waiting on writes.')
+    parser.add_argument(
+        '--aio_bulk_workers', default=aio_server.DEFAULT_BULK_WORKERS,
+        type=int,
+        help='With --aio, the number of threads serving streams and '
+        'whole-table reads.')
+    parser.add_argument(
+        '--ingest_queue_size', default=ingest.DEFAULT_QUEUE_SIZE, type=int,
+        help='The most views or logs buffered before some are dropped.')
+    parser.add_argument(
+        '--ingest_flush_rows', default=ingest.DEFAULT_FLUSH_ROWS, type=int,
+        help='Write buffered views and logs once this many are queued.')
+    parser.add_argument(
+        '--ingest_flush_ms', default=ingest.DEFAULT_FLUSH_MS, type=int,
+        help='Write buffered views and logs at least this often.')
+    parser.add_argument(
+        '--ingest_drop_policy', default=ingest.DROP_NEWEST,
+        choices=ingest.DROP_POLICIES,
+        help='What to drop when the view or log buffer is full.')
+    parser.add_argument(
+        '--rollup_interval', default=rollup.DEFAULT_INTERVAL, type=int,
+        help='Seconds between rolling up views and logs.')
+    parser.add_argument(
+        '--raw_retention_days', default=rollup.DEFAULT_RAW_RETENTION_DAYS,
+        type=int,
+        help='Days to keep individual views and logs after rolling them up.')
+    parser.add_argument(
+        '--hourly_retention_days',
+        default=rollup.DEFAULT_HOURLY_RETENTION_DAYS, type=int,
+        help='Days to keep hourly view and log counts. Daily counts are kept.')
+    parser.add_argument(
+        '--counter_fold_interval', default=counters.DEFAULT_FOLD_INTERVAL,
+        type=int,
+        help='Seconds between folding like and share counts into posts.')
+    parser.add_argument(
+        '--maintenance_tick', default=maintenance.DEFAULT_TICK, type=int,
+        help='Seconds between checks for due FTS and SQLite maintenance.')
+    parser.add_argument(
+        '--timeline_length', default=maintenance.DEFAULT_TIMELINE_LENGTH,
+        type=int,
+        help='Posts kept in each home timeline. Longer timelines are cut '
+        'down by the timeline_trim maintenance task.')
+    parser.add_argument(
+        '--slow_query_ms', default=stats.DEFAULT_SLOW_QUERY_MS, type=float,
+        help='Log SQL statements slower than this with their query plan.')
+    parser.add_argument(
+        '--snapshot_interval', default=snapshots.DEFAULT_INTERVAL, type=int,
+        help='Seconds between snapshots of the database, which whole-table '
+        'reads for the recommenders are served from. 0 serves them from '
+        'the live database.')
+    parser.add_argument(
+        '--user_cache_size', default=usercache.DEFAULT_SIZE, type=int,
+        help='Users kept in memory for lookups by id or handle. 0 disables '
+        'the cache.')
     parser.add_argument(
         '-v', default='WARNING', action='store_const', const='DEBUG',
         help='Log more verbosely.')
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.snapshot_interval > 0 and not snapshots.SUPPORTED:
+        parser.error('--snapshot_interval needs Python 3.7 or newer; pass 0 '
+                     'to read from the live database instead')
+    return args
+
+
+def serve(servicer, logger, workers, db_stats):
+    logger.info("Creating server with %d workers", workers)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers),
+                         interceptors=(stats.StatsInterceptor(db_stats),))
+    database_pb2_grpc.add_DatabaseServicer_to_server(servicer, server)
+    server.add_insecure_port(ADDRESS)
+    logger.info("Starting database service on %s", ADDRESS)
+    server.start()
+    try:
+        while True:
+            time.sleep(60 * 60 * 24)  # One day
+    finally:
+        server.stop(None)
 
 
 def main():
     args = get_args()
     logger = get_logger("database_service", args.v)
     logger.info("Creating DB with path: " + args.db_path)
-    database = build_database(logger, args.schema, args.db_path)
-    logger.info("Creating server")
-    # TODO(CianLR): Work out why we've to single thread the DB
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
-    database_pb2_grpc.add_DatabaseServicer_to_server(
-        DatabaseServicer(database, logger), server)
-    server.add_insecure_port('0.0.0.0:1798')
-    logger.info("Starting database service on port 1798")
-    server.start()
+    db_stats = stats.Stats(logger, args.slow_query_ms)
+    database = build_database(logger, args.schema, args.db_path,
+                              stats=db_stats)
+    scheduler = maintenance.Scheduler(
+        database, logger,
+        tasks=maintenance.default_tasks(args.timeline_length))
+    db_snapshots = None
+    if args.snapshot_interval > 0:
+        db_snapshots = snapshots.Snapshots(database, logger, db_stats)
+    servicer = DatabaseServicer(database, logger, ingest_options={
+        'queue_size': args.ingest_queue_size,
+        'flush_rows': args.ingest_flush_rows,
+        'flush_ms': args.ingest_flush_ms,
+        'drop_policy': args.ingest_drop_policy,
+    }, scheduler=scheduler, stats=db_stats,
+        user_cache_size=args.user_cache_size, snapshots=db_snapshots)
+    rollups = rollup.Rollups(database, logger,
+                             raw_retention_days=args.raw_retention_days,
+                             hourly_retention_days=args.hourly_retention_days)
+    rollups.start(args.rollup_interval)
+    folder = counters.CounterFolder(database, logger)
+    folder.start(args.counter_fold_interval)
+    scheduler.start(args.maintenance_tick)
+    if db_snapshots is not None:
+        db_snapshots.start(args.snapshot_interval)
     try:
-        while True:
-            time.sleep(60 * 60 * 24)  # One day
+        if args.aio:
+            asyncio.run(aio_server.serve(
+                servicer, logger, ADDRESS,
+                readers=args.aio_readers,
+                write_waiters=args.aio_write_waiters,
+                bulk_workers=args.aio_bulk_workers,
+                stats=db_stats))
+        else:
+            serve(servicer, logger, args.workers, db_stats)
     except KeyboardInterrupt:
         pass
+    scheduler.stop()
+    if db_snapshots is not None:
+        db_snapshots.stop()
+    rollups.stop()
+    folder.stop()
+    servicer.close()
+    database.close()
 
 if __name__ == '__main__':
     main()
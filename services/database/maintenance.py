@@ -0,0 +1,226 @@
+import sqlite3
+import threading
+import time
+
+HOUR = 60 * 60
+
+# Seconds between scheduler ticks. Each due task does one bounded step of
+# work per tick, so a task with a lot to do is spread over several ticks.
+DEFAULT_TICK = 30
+# Ticks are skipped while more writes than this are waiting on the writer,
+# so maintenance only runs when the service is quiet.
+DEFAULT_MAX_PENDING_WRITES = 0
+# FTS leaf pages written per merge step.
+FTS_MERGE_PAGES = 500
+# Rows ANALYZE samples per index, which bounds the cost of a statistics run.
+ANALYSIS_LIMIT = 1000
+# Free pages returned to the file system per incremental vacuum step.
+VACUUM_PAGES = 1000
+# Posts kept in each home timeline, see the timeline migration.
+DEFAULT_TIMELINE_LENGTH = 800
+# Local users whose timelines are trimmed per step.
+TIMELINE_TRIM_USERS = 200
+
+
+def _fts_merge(table):
+    def step(tx):
+        if not tx.execute("SELECT 1 FROM sqlite_master "
+                          "WHERE type = 'table' AND name = ?", table):
+            return False, 'no index'
+        before = tx.execute('SELECT total_changes()')[0][0]
+        # A negative page count merges every level, like 'optimize', but
+        # stops after roughly that many pages.
+        tx.execute("INSERT INTO {t} ({t}, rank) VALUES ('merge', ?)".format(
+            t=table), -FTS_MERGE_PAGES)
+        # FTS5 changes fewer than two rows when there was nothing to merge.
+        if tx.execute('SELECT total_changes()')[0][0] - before < 2:
+            return False, 'nothing to merge'
+        return True, 'merged up to {} pages'.format(FTS_MERGE_PAGES)
+    return step
+
+
+def _analyze(tx):
+    tx.execute('PRAGMA analysis_limit = {}'.format(ANALYSIS_LIMIT))
+    tx.execute('ANALYZE')
+    return False, 'analyzed'
+
+
+def _incremental_vacuum(tx):
+    if tx.execute('PRAGMA auto_vacuum')[0][0] != 2:
+        return False, 'auto_vacuum is not incremental'
+    free = tx.execute('PRAGMA freelist_count')[0][0]
+    if not free:
+        return False, 'no free pages'
+    pages = min(free, VACUUM_PAGES)
+    # sqlite3 steps statements that return no rows only once, and each step
+    # of incremental_vacuum frees a single page.
+    for _ in range(pages):
+        tx.execute('PRAGMA incremental_vacuum')
+    return free > pages, 'freed {} pages'.format(pages)
+
+
+def _trim_timelines(length):
+    # Each step trims the timelines of the next TIMELINE_TRIM_USERS local
+    # users after this id, and a full pass starts again from 0.
+    after = 0
+
+    def step(tx):
+        nonlocal after
+        users = tx.execute('SELECT global_id FROM users '
+                           'WHERE host IS NULL AND global_id > ? '
+                           'ORDER BY global_id LIMIT ?',
+                           after, TIMELINE_TRIM_USERS)
+        removed = 0
+        for (user_id,) in users:
+            # Everything older than the length-th newest item goes.
+            removed += tx.execute_count(
+                'DELETE FROM timeline WHERE user_id = ? AND (ts, post_id) < '
+                '(SELECT ts, post_id FROM timeline WHERE user_id = ? '
+                'ORDER BY ts DESC, post_id DESC LIMIT 1 OFFSET ?)',
+                user_id, user_id, length - 1)
+        more = len(users) == TIMELINE_TRIM_USERS
+        after = users[-1][0] if more else 0
+        return more, 'removed {} items from {} timelines'.format(
+            removed, len(users))
+    return step
+
+
+def default_tasks(timeline_length=DEFAULT_TIMELINE_LENGTH):
+    """
+    default_tasks returns the name, step and interval in seconds of each
+    maintenance task. A step takes a Transaction and returns whether it has
+    more work left and a short description of what it did.
+    """
+    return (
+        ('posts_idx_merge', _fts_merge('posts_idx'), HOUR),
+        ('users_idx_merge', _fts_merge('users_idx'), HOUR),
+        ('analyze', _analyze, 6 * HOUR),
+        ('incremental_vacuum', _incremental_vacuum, HOUR),
+        ('timeline_trim', _trim_timelines(max(timeline_length, 1)), HOUR),
+    )
+
+
+class Task:
+
+    def __init__(self, name, step, interval):
+        self.name = name
+        self.step = step
+        self.interval = interval
+        self.runs = 0
+        self.last_run = None
+        self.last_duration = 0.0
+        self.last_error = ''
+        self.detail = ''
+        # True while the task has work left to continue on the next tick.
+        self.pending = False
+        self.next_run = 0
+
+
+class Scheduler:
+    """
+    Scheduler runs SQLite and full text index maintenance in the background.
+
+    Nothing else merges FTS segments, refreshes planner statistics or gives
+    free pages back, and without that queries slow down over months of
+    uptime. Each task is a small bounded write, and a task with more to do
+    continues on the following ticks rather than holding the writer.
+    """
+
+    def __init__(self, db, logger,
+                 max_pending_writes=DEFAULT_MAX_PENDING_WRITES,
+                 tasks=None):
+        self._db = db
+        self._logger = logger
+        self._max_pending_writes = max_pending_writes
+        if tasks is None:
+            tasks = default_tasks()
+        self._tasks = [Task(*t) for t in tasks]
+        # Steps run one at a time, whether from the scheduler thread or a
+        # manual run.
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def tasks(self, name=''):
+        """
+        tasks returns the named task, or every task if name is empty.
+
+        Raises:
+          KeyError if there is no task with that name.
+        """
+        if not name:
+            return list(self._tasks)
+        for task in self._tasks:
+            if task.name == name:
+                return [task]
+        raise KeyError(name)
+
+    def busy(self):
+        return self._db.pending_writes() > self._max_pending_writes
+
+    def tick(self, now=None):
+        """
+        tick runs one step of each task that is due, unless the database
+        is busy.
+
+        Returns:
+          The number of steps run.
+        """
+        if now is None:
+            now = time.time()
+        steps = 0
+        for task in self._tasks:
+            if self.busy():
+                break
+            if task.pending or now >= task.next_run:
+                self._run_step(task, now)
+                steps += 1
+        return steps
+
+    def run(self, name=''):
+        """
+        run runs the named task, or every task, until it has no work left,
+        whatever the load.
+
+        Raises:
+          KeyError if there is no task with that name.
+        """
+        for task in self.tasks(name):
+            while True:
+                self._run_step(task, time.time())
+                if not task.pending:
+                    break
+
+    def _run_step(self, task, now):
+        with self._lock:
+            start = time.perf_counter()
+            try:
+                task.pending, task.detail = self._db.write(task.step)
+                task.last_error = ''
+            except sqlite3.Error as e:
+                self._logger.error('Maintenance task %s failed: %s',
+                                   task.name, str(e))
+                task.pending = False
+                task.detail = ''
+                task.last_error = str(e)
+            task.last_duration = time.perf_counter() - start
+            task.last_run = now
+            task.runs += 1
+            if not task.pending:
+                task.next_run = now + task.interval
+            self._logger.debug('Maintenance task %s: %s', task.name,
+                               task.detail or task.last_error)
+
+    def start(self, interval=DEFAULT_TICK):
+        """start runs a tick every interval seconds in the background."""
+        def loop():
+            while not self._stop.wait(interval):
+                self.tick()
+        self._thread = threading.Thread(
+            target=loop, name='maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,47 @@
+from services.proto import database_pb2
+
+
+class MaintenanceDatabaseServicer:
+
+    def __init__(self, db, logger, scheduler):
+        self._db = db
+        self._logger = logger
+        self._scheduler = scheduler
+
+    def _status(self, name, resp):
+        try:
+            tasks = self._scheduler.tasks(name)
+        except KeyError:
+            resp.result_type = database_pb2.MaintenanceResponse.ERROR
+            resp.error = 'Unknown maintenance task: ' + name
+            return resp
+        for task in tasks:
+            entry = resp.tasks.add(
+                name=task.name,
+                interval_seconds=int(task.interval),
+                last_duration_ms=int(task.last_duration * 1000),
+                last_error=task.last_error,
+                detail=task.detail,
+                runs=task.runs,
+                pending=task.pending,
+            )
+            if task.last_run is not None:
+                entry.last_run.seconds = int(task.last_run)
+        return resp
+
+    def MaintenanceStatus(self, req, context):
+        return self._status(req.task, database_pb2.MaintenanceResponse())
+
+    def RunMaintenance(self, req, context):
+        self._logger.info('Running maintenance task %s', req.task or 'all')
+        try:
+            self._scheduler.run(req.task)
+        except KeyError:
+            pass  # Reported by _status.
+        resp = self._status(req.task, database_pb2.MaintenanceResponse())
+        errors = ['{}: {}'.format(t.name, t.last_error)
+                  for t in resp.tasks if t.last_error]
+        if errors:
+            resp.result_type = database_pb2.MaintenanceResponse.ERROR
+            resp.error = '; '.join(errors)
+        return resp
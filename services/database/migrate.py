@@ -0,0 +1,79 @@
+import os
+import re
+import sqlite3
+
+# Migration scripts are named like "0001_add_some_index.sql". The number is
+# the schema version the script upgrades the database to.
+MIGRATION_RE = re.compile(r'^(\d+)_([a-z0-9_]+)\.sql$')
+
+
+class MigrationError(Exception):
+    pass
+
+
+def find_migrations(migrations_dir):
+    """
+    find_migrations lists the migration scripts in migrations_dir.
+
+    Returns:
+      A list of (version, name, path) tuples sorted by version.
+    """
+    migrations = []
+    for filename in os.listdir(migrations_dir):
+        m = MIGRATION_RE.match(filename)
+        if m is None:
+            continue
+        migrations.append((int(m.group(1)), m.group(2),
+                           os.path.join(migrations_dir, filename)))
+    migrations.sort()
+    versions = [v for v, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise MigrationError(
+            'Duplicate migration versions in ' + migrations_dir)
+    return migrations
+
+
+def current_version(db):
+    res = db.execute('SELECT MAX(version) FROM schema_version')
+    return res[0][0] or 0
+
+
+def apply_migrations(logger, db, migrations_dir):
+    """
+    apply_migrations brings the database up to the newest schema version.
+
+    Every script in migrations_dir with a version higher than the one
+    recorded in the schema_version table is run in order. Each script runs
+    in its own transaction together with the schema_version row recording
+    it, so a failing migration leaves the database at the previous version.
+    This is run at startup before the service takes requests.
+
+    Returns:
+      The schema version of the database after migrating.
+    """
+    version = current_version(db)
+    for m_version, name, path in find_migrations(migrations_dir):
+        if m_version <= version:
+            continue
+        logger.info('Applying migration %d (%s)', m_version, name)
+        with open(path) as f:
+            script = f.read()
+        # executescript can't run inside an explicit transaction, so the
+        # transaction is part of the script.
+        script = (
+            'BEGIN IMMEDIATE;\n' + script + '\n' +
+            'INSERT INTO schema_version (version, name, applied_datetime) '
+            "VALUES ({}, '{}', strftime('%s', 'now'));\n".format(
+                m_version, name) +
+            'COMMIT;\n'
+        )
+        try:
+            db.execute_script(script)
+        except sqlite3.Error as e:
+            db.rollback()
+            logger.error('Migration %d (%s) failed: %s', m_version, name,
+                         str(e))
+            raise MigrationError(
+                'Migration {} ({}) failed: {}'.format(m_version, name, e))
+        version = m_version
+    return version
@@ -0,0 +1,41 @@
+/*
+  Older databases can hold the same foreign article more than once. Keep the
+  earliest copy of each, move likes and shares over to it and drop the rest so
+  that the unique index on ap_id can be built.
+*/
+CREATE TEMP TABLE duplicate_posts AS
+  SELECT p.global_id AS duplicate_id, k.keep_id AS keep_id
+  FROM posts p
+  INNER JOIN (
+    SELECT ap_id, MIN(global_id) AS keep_id
+    FROM posts
+    WHERE ap_id != ''
+    GROUP BY ap_id
+    HAVING COUNT(*) > 1
+  ) k ON p.ap_id = k.ap_id AND p.global_id != k.keep_id;
+
+UPDATE OR IGNORE likes
+  SET article_id = (SELECT keep_id FROM duplicate_posts
+                    WHERE duplicate_id = likes.article_id)
+  WHERE article_id IN (SELECT duplicate_id FROM duplicate_posts);
+DELETE FROM likes
+  WHERE article_id IN (SELECT duplicate_id FROM duplicate_posts);
+
+UPDATE OR IGNORE shares
+  SET article_id = (SELECT keep_id FROM duplicate_posts
+                    WHERE duplicate_id = shares.article_id)
+  WHERE article_id IN (SELECT duplicate_id FROM duplicate_posts);
+DELETE FROM shares
+  WHERE article_id IN (SELECT duplicate_id FROM duplicate_posts);
+
+DELETE FROM posts
+  WHERE global_id IN (SELECT duplicate_id FROM duplicate_posts);
+
+UPDATE posts
+  SET likes_count = (SELECT COUNT(*) FROM likes
+                     WHERE likes.article_id = posts.global_id),
+      shares_count = (SELECT COUNT(*) FROM shares
+                      WHERE shares.article_id = posts.global_id)
+  WHERE global_id IN (SELECT keep_id FROM duplicate_posts);
+
+DROP TABLE duplicate_posts;
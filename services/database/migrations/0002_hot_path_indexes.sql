@@ -0,0 +1,30 @@
+/*
+  Secondary indexes for the lookups made on every request.
+
+  The users table needs nothing extra for (handle, host) lookups, the
+  UNIQUE (handle, host) constraint already provides that index.
+*/
+
+/*
+  Local posts are inserted with an empty ap_id which is filled in once the
+  Create activity is built, so only non-empty ap_ids are unique. Queries must
+  include "ap_id != ''" for SQLite to pick this index.
+*/
+CREATE UNIQUE INDEX IF NOT EXISTS posts_ap_id_idx
+  ON posts (ap_id) WHERE ap_id != '';
+
+CREATE INDEX IF NOT EXISTS posts_author_id_idx ON posts (author_id);
+
+/* Followers of a user, get_follower_list and PendingFollows. */
+CREATE INDEX IF NOT EXISTS follows_followed_state_idx
+  ON follows (followed, state);
+
+/* LikesCollection, the primary key only covers lookups by user_id. */
+CREATE INDEX IF NOT EXISTS likes_article_id_idx ON likes (article_id);
+
+/* GetSharersOfPost, the primary key only covers lookups by user_id. */
+CREATE INDEX IF NOT EXISTS shares_article_id_idx ON shares (article_id);
+
+/* Authors whose posts appear in the InstanceFeed. */
+CREATE INDEX IF NOT EXISTS users_local_public_idx
+  ON users (global_id) WHERE host IS NULL AND private = 0;
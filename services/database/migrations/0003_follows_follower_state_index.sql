@@ -0,0 +1,7 @@
+/*
+  Paged follow listings are ordered by rowid. Together with
+  follows_followed_state_idx this lets both the following and followers
+  listings seek straight to the start of each page.
+*/
+CREATE INDEX IF NOT EXISTS follows_follower_state_idx
+  ON follows (follower, state);
@@ -0,0 +1,62 @@
+/*
+  Hourly and daily rollups of the views and logs tables, see rollup.py.
+
+  views and logs are rebuilt with an explicit id column. Rollups remember
+  the last id they have counted, and the implicit rowid these tables had
+  before may be renumbered by VACUUM. The ids are AUTOINCREMENT, as without
+  it SQLite hands out ids again once the rows holding the highest ones are
+  pruned, and rows given an id below last_id would never be counted.
+*/
+CREATE TABLE views_new (
+  id               integer PRIMARY KEY AUTOINCREMENT,
+  path             text    NOT NULL,
+  user_id          integer NOT NULL,
+  datetime         integer NOT NULL
+);
+INSERT INTO views_new (path, user_id, datetime)
+  SELECT path, user_id, datetime FROM views ORDER BY rowid;
+DROP TABLE views;
+ALTER TABLE views_new RENAME TO views;
+
+CREATE TABLE logs_new (
+  id               integer PRIMARY KEY AUTOINCREMENT,
+  message          text    NOT NULL,
+  user_id          integer NOT NULL,
+  datetime         integer NOT NULL
+);
+INSERT INTO logs_new (message, user_id, datetime)
+  SELECT message, user_id, datetime FROM logs ORDER BY rowid;
+DROP TABLE logs;
+ALTER TABLE logs_new RENAME TO logs;
+
+/* The retention job deletes raw rows by age. */
+CREATE INDEX IF NOT EXISTS views_datetime_idx ON views (datetime);
+CREATE INDEX IF NOT EXISTS logs_datetime_idx ON logs (datetime);
+
+/*
+  bucket_size is the bucket length in seconds and bucket_start the unix time
+  the bucket starts at.
+*/
+CREATE TABLE IF NOT EXISTS view_rollups (
+  bucket_size      integer NOT NULL,
+  bucket_start     integer NOT NULL,
+  path             text    NOT NULL,
+  user_id          integer NOT NULL,
+  count            integer NOT NULL,
+  PRIMARY KEY (bucket_size, bucket_start, path, user_id)
+) WITHOUT ROWID;
+
+/* Logs have no path, they are only counted per user. */
+CREATE TABLE IF NOT EXISTS log_rollups (
+  bucket_size      integer NOT NULL,
+  bucket_start     integer NOT NULL,
+  user_id          integer NOT NULL,
+  count            integer NOT NULL,
+  PRIMARY KEY (bucket_size, bucket_start, user_id)
+) WITHOUT ROWID;
+
+/* The highest id of each raw table that has been counted in the rollups. */
+CREATE TABLE IF NOT EXISTS rollup_progress (
+  source           text    PRIMARY KEY,
+  last_id          integer NOT NULL
+);
@@ -0,0 +1,10 @@
+/*
+  Changes to posts.likes_count and posts.shares_count not yet folded into
+  posts, see counters.py. A post's counts are the posts columns plus its
+  row here, if any.
+*/
+CREATE TABLE IF NOT EXISTS post_counter_deltas (
+  post_id          integer PRIMARY KEY,
+  likes            integer NOT NULL DEFAULT 0,
+  shares           integer NOT NULL DEFAULT 0
+);
@@ -0,0 +1,45 @@
+/*
+  Full text index used by SearchArticles.
+
+  This replaces the title and body index that CreatePostsIndex used to
+  build. Summary and tags are indexed too, results are ranked with bm25
+  weighting title matches highest, and prefixes of 2 and 3 characters are
+  indexed since every search term is a prefix query.
+
+  The old update trigger removed the new rather than the old values from
+  the index, leaving stale terms behind, so the index is rebuilt from posts.
+  The update trigger now only fires for the indexed columns, so like and
+  share count changes don't touch the index.
+*/
+DROP TRIGGER IF EXISTS posts_ai;
+DROP TRIGGER IF EXISTS posts_ad;
+DROP TRIGGER IF EXISTS posts_au;
+DROP TABLE IF EXISTS posts_idx;
+
+CREATE VIRTUAL TABLE posts_idx USING fts5(
+  title, summary, tags, body,
+  content=posts, content_rowid=global_id, prefix='2 3'
+);
+INSERT INTO posts_idx (posts_idx, rank)
+  VALUES ('rank', 'bm25(10.0, 5.0, 4.0, 1.0)');
+INSERT INTO posts_idx (posts_idx) VALUES ('rebuild');
+
+CREATE TRIGGER posts_ai AFTER INSERT ON posts BEGIN
+  INSERT INTO posts_idx (rowid, title, summary, tags, body)
+    VALUES (new.global_id, new.title, new.summary, new.tags, new.body);
+END;
+
+CREATE TRIGGER posts_ad AFTER DELETE ON posts BEGIN
+  INSERT INTO posts_idx (posts_idx, rowid, title, summary, tags, body)
+    VALUES ('delete', old.global_id, old.title, old.summary, old.tags,
+            old.body);
+END;
+
+CREATE TRIGGER posts_au AFTER UPDATE OF title, summary, tags, body ON posts
+BEGIN
+  INSERT INTO posts_idx (posts_idx, rowid, title, summary, tags, body)
+    VALUES ('delete', old.global_id, old.title, old.summary, old.tags,
+            old.body);
+  INSERT INTO posts_idx (rowid, title, summary, tags, body)
+    VALUES (new.global_id, new.title, new.summary, new.tags, new.body);
+END;
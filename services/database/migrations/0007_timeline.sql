@@ -0,0 +1,206 @@
+/*
+  Home timeline of each local user: the posts written or shared by the users
+  they follow, read newest first by UserTimeline.
+
+  Rows are added when posts and shares are written (fan-out on write) by the
+  triggers below, so reading a page is one range scan of
+  timeline_user_ts_idx however many users someone follows. Only local
+  followers with an ACTIVE follow get rows. The maintenance task
+  timeline_trim cuts each timeline down to a fixed length.
+
+  reason is the TimelineItem.Reason in database.proto: 0 if actor_id wrote
+  the post, 1 if actor_id shared it. ts is when they did so. A post is in a
+  timeline at most once; sharing a post that is already there moves it up to
+  the time of the share.
+*/
+CREATE TABLE timeline (
+  user_id   integer NOT NULL,
+  post_id   integer NOT NULL,
+  reason    integer NOT NULL,
+  actor_id  integer NOT NULL,
+  ts        integer NOT NULL,
+  PRIMARY KEY (user_id, post_id)
+) WITHOUT ROWID;
+
+CREATE INDEX timeline_user_ts_idx ON timeline (user_id, ts, post_id);
+/* Removing a post from every timeline it is in. */
+CREATE INDEX timeline_post_idx ON timeline (post_id);
+
+CREATE TRIGGER timeline_posts_ai AFTER INSERT ON posts BEGIN
+  INSERT INTO timeline (user_id, post_id, reason, actor_id, ts)
+    SELECT f.follower, new.global_id, 0, new.author_id,
+           new.creation_datetime
+    FROM follows f INNER JOIN users u ON u.global_id = f.follower
+    WHERE f.followed = new.author_id AND f.state = 0 AND u.host IS NULL
+  ON CONFLICT DO NOTHING;
+END;
+
+CREATE TRIGGER timeline_shares_ai AFTER INSERT ON shares BEGIN
+  INSERT INTO timeline (user_id, post_id, reason, actor_id, ts)
+    SELECT f.follower, new.article_id, 1, new.user_id,
+           new.announce_datetime
+    FROM follows f INNER JOIN users u ON u.global_id = f.follower
+    WHERE f.followed = new.user_id AND f.state = 0 AND u.host IS NULL
+  ON CONFLICT (user_id, post_id) DO UPDATE
+    SET reason = 1, actor_id = excluded.actor_id, ts = excluded.ts
+    WHERE excluded.ts > timeline.ts;
+END;
+
+CREATE TRIGGER timeline_posts_ad AFTER DELETE ON posts BEGIN
+  DELETE FROM timeline WHERE post_id = old.global_id;
+END;
+
+/*
+  When the share or follow that put a post in a timeline goes, the post stays
+  if another followed user still wrote or shared it, with the newest of
+  those, as HomeFeed would show it. It is only deleted if none is left.
+*/
+CREATE TRIGGER timeline_shares_ad AFTER DELETE ON shares BEGIN
+  INSERT INTO timeline (user_id, post_id, reason, actor_id, ts)
+    SELECT user_id, post_id, reason, actor_id, MAX(ts) FROM (
+      SELECT t.user_id, t.post_id, 0 AS reason, p.author_id AS actor_id,
+             p.creation_datetime AS ts
+      FROM timeline t
+      INNER JOIN posts p ON p.global_id = t.post_id
+      INNER JOIN follows f ON f.follower = t.user_id
+        AND f.followed = p.author_id AND f.state = 0
+      WHERE t.post_id = old.article_id AND t.reason = 1
+        AND t.actor_id = old.user_id
+      UNION ALL
+      SELECT t.user_id, t.post_id, 1, s.user_id, s.announce_datetime
+      FROM timeline t
+      INNER JOIN shares s ON s.article_id = t.post_id
+      INNER JOIN follows f ON f.follower = t.user_id
+        AND f.followed = s.user_id AND f.state = 0
+      WHERE t.post_id = old.article_id AND t.reason = 1
+        AND t.actor_id = old.user_id
+    ) GROUP BY user_id, post_id
+  ON CONFLICT (user_id, post_id) DO UPDATE
+    SET reason = excluded.reason, actor_id = excluded.actor_id,
+        ts = excluded.ts;
+  DELETE FROM timeline
+    WHERE post_id = old.article_id AND reason = 1 AND actor_id = old.user_id;
+END;
+
+/*
+  A new ACTIVE follow brings in the 50 newest posts and shares of the
+  followed user, so the timeline isn't empty until they next post. Ending a
+  follow takes out what it brought in, as above.
+*/
+CREATE TRIGGER timeline_follows_ai AFTER INSERT ON follows
+WHEN new.state = 0 BEGIN
+  INSERT INTO timeline (user_id, post_id, reason, actor_id, ts)
+    SELECT new.follower, p.global_id, 0, p.author_id, p.creation_datetime
+    FROM posts p
+    WHERE p.author_id = new.followed AND EXISTS (
+      SELECT 1 FROM users WHERE global_id = new.follower AND host IS NULL)
+    ORDER BY p.global_id DESC LIMIT 50
+  ON CONFLICT DO NOTHING;
+  INSERT INTO timeline (user_id, post_id, reason, actor_id, ts)
+    SELECT new.follower, s.article_id, 1, s.user_id, s.announce_datetime
+    FROM shares s
+    WHERE s.user_id = new.followed AND EXISTS (
+      SELECT 1 FROM users WHERE global_id = new.follower AND host IS NULL)
+    ORDER BY s.announce_datetime DESC LIMIT 50
+  ON CONFLICT (user_id, post_id) DO UPDATE
+    SET reason = 1, actor_id = excluded.actor_id, ts = excluded.ts
+    WHERE excluded.ts > timeline.ts;
+END;
+
+CREATE TRIGGER timeline_follows_accepted AFTER UPDATE OF state ON follows
+WHEN old.state != 0 AND new.state = 0 BEGIN
+  INSERT INTO timeline (user_id, post_id, reason, actor_id, ts)
+    SELECT new.follower, p.global_id, 0, p.author_id, p.creation_datetime
+    FROM posts p
+    WHERE p.author_id = new.followed AND EXISTS (
+      SELECT 1 FROM users WHERE global_id = new.follower AND host IS NULL)
+    ORDER BY p.global_id DESC LIMIT 50
+  ON CONFLICT DO NOTHING;
+  INSERT INTO timeline (user_id, post_id, reason, actor_id, ts)
+    SELECT new.follower, s.article_id, 1, s.user_id, s.announce_datetime
+    FROM shares s
+    WHERE s.user_id = new.followed AND EXISTS (
+      SELECT 1 FROM users WHERE global_id = new.follower AND host IS NULL)
+    ORDER BY s.announce_datetime DESC LIMIT 50
+  ON CONFLICT (user_id, post_id) DO UPDATE
+    SET reason = 1, actor_id = excluded.actor_id, ts = excluded.ts
+    WHERE excluded.ts > timeline.ts;
+END;
+
+CREATE TRIGGER timeline_follows_ended AFTER UPDATE OF state ON follows
+WHEN old.state = 0 AND new.state != 0 BEGIN
+  INSERT INTO timeline (user_id, post_id, reason, actor_id, ts)
+    SELECT user_id, post_id, reason, actor_id, MAX(ts) FROM (
+      SELECT t.user_id, t.post_id, 0 AS reason, p.author_id AS actor_id,
+             p.creation_datetime AS ts
+      FROM timeline t
+      INNER JOIN posts p ON p.global_id = t.post_id
+      INNER JOIN follows f ON f.follower = t.user_id
+        AND f.followed = p.author_id AND f.state = 0
+      WHERE t.user_id = old.follower AND t.actor_id = old.followed
+      UNION ALL
+      SELECT t.user_id, t.post_id, 1, s.user_id, s.announce_datetime
+      FROM timeline t
+      INNER JOIN shares s ON s.article_id = t.post_id
+      INNER JOIN follows f ON f.follower = t.user_id
+        AND f.followed = s.user_id AND f.state = 0
+      WHERE t.user_id = old.follower AND t.actor_id = old.followed
+    ) GROUP BY user_id, post_id
+  ON CONFLICT (user_id, post_id) DO UPDATE
+    SET reason = excluded.reason, actor_id = excluded.actor_id,
+        ts = excluded.ts;
+  DELETE FROM timeline
+    WHERE user_id = old.follower AND actor_id = old.followed;
+END;
+
+CREATE TRIGGER timeline_follows_ad AFTER DELETE ON follows
+WHEN old.state = 0 BEGIN
+  INSERT INTO timeline (user_id, post_id, reason, actor_id, ts)
+    SELECT user_id, post_id, reason, actor_id, MAX(ts) FROM (
+      SELECT t.user_id, t.post_id, 0 AS reason, p.author_id AS actor_id,
+             p.creation_datetime AS ts
+      FROM timeline t
+      INNER JOIN posts p ON p.global_id = t.post_id
+      INNER JOIN follows f ON f.follower = t.user_id
+        AND f.followed = p.author_id AND f.state = 0
+      WHERE t.user_id = old.follower AND t.actor_id = old.followed
+      UNION ALL
+      SELECT t.user_id, t.post_id, 1, s.user_id, s.announce_datetime
+      FROM timeline t
+      INNER JOIN shares s ON s.article_id = t.post_id
+      INNER JOIN follows f ON f.follower = t.user_id
+        AND f.followed = s.user_id AND f.state = 0
+      WHERE t.user_id = old.follower AND t.actor_id = old.followed
+    ) GROUP BY user_id, post_id
+  ON CONFLICT (user_id, post_id) DO UPDATE
+    SET reason = excluded.reason, actor_id = excluded.actor_id,
+        ts = excluded.ts;
+  DELETE FROM timeline
+    WHERE user_id = old.follower AND actor_id = old.followed;
+END;
+
+/* Fill the timelines of existing follows the same way. */
+INSERT INTO timeline (user_id, post_id, reason, actor_id, ts)
+  SELECT follower, global_id, 0, author_id, creation_datetime FROM (
+    SELECT f.follower, p.global_id, p.author_id, p.creation_datetime,
+           ROW_NUMBER() OVER (PARTITION BY f.follower, f.followed
+                              ORDER BY p.global_id DESC) AS n
+    FROM follows f
+    INNER JOIN users u ON u.global_id = f.follower
+    INNER JOIN posts p ON p.author_id = f.followed
+    WHERE f.state = 0 AND u.host IS NULL
+  ) WHERE n <= 50
+ON CONFLICT DO NOTHING;
+INSERT INTO timeline (user_id, post_id, reason, actor_id, ts)
+  SELECT follower, article_id, 1, user_id, announce_datetime FROM (
+    SELECT f.follower, s.article_id, s.user_id, s.announce_datetime,
+           ROW_NUMBER() OVER (PARTITION BY f.follower, f.followed
+                              ORDER BY s.announce_datetime DESC) AS n
+    FROM follows f
+    INNER JOIN users u ON u.global_id = f.follower
+    INNER JOIN shares s ON s.user_id = f.followed
+    WHERE f.state = 0 AND u.host IS NULL
+  ) WHERE n <= 50
+ON CONFLICT (user_id, post_id) DO UPDATE
+  SET reason = 1, actor_id = excluded.actor_id, ts = excluded.ts
+  WHERE excluded.ts > timeline.ts;
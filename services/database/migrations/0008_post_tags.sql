@@ -0,0 +1,130 @@
+/*
+  The tags of each post, as rows rather than the "|" separated string in
+  posts.tags, so posts can be found by tag with an index.
+
+  tags holds each tag name once, with the number of posts that have it.
+  post_tags holds a row for each tag of each post. Names are stored decoded:
+  a "|" in a tag is written as "%7C" in posts.tags, see
+  convert_to_tags_string in services/utils/articles.py.
+
+  The triggers below keep both tables in step with posts.tags, which stays
+  the source of truth. Tags no longer used by any post are kept, with a
+  post_count of 0.
+*/
+CREATE TABLE tags (
+  tag_id      integer PRIMARY KEY,
+  name        text    NOT NULL UNIQUE,
+  post_count  integer NOT NULL DEFAULT 0
+);
+
+/* For TagStats, the most used tags first. */
+CREATE INDEX tags_post_count_idx ON tags (post_count);
+
+CREATE TABLE post_tags (
+  tag_id   integer NOT NULL,
+  post_id  integer NOT NULL,
+  PRIMARY KEY (tag_id, post_id)
+) WITHOUT ROWID;
+
+/* The tags of a post, to remove them and for StreamPostTags. */
+CREATE INDEX post_tags_post_idx ON post_tags (post_id, tag_id);
+
+/* Fill both tables from the existing posts. */
+WITH RECURSIVE split (post_id, name, rest) AS (
+  SELECT global_id, '', tags || '|' FROM posts
+  WHERE tags IS NOT NULL AND tags != ''
+  UNION ALL
+  SELECT post_id, substr(rest, 1, instr(rest, '|') - 1),
+         substr(rest, instr(rest, '|') + 1)
+  FROM split WHERE rest != ''
+)
+INSERT INTO tags (name)
+  SELECT DISTINCT replace(name, '%7C', '|') FROM split WHERE name != ''
+ON CONFLICT DO NOTHING;
+
+WITH RECURSIVE split (post_id, name, rest) AS (
+  SELECT global_id, '', tags || '|' FROM posts
+  WHERE tags IS NOT NULL AND tags != ''
+  UNION ALL
+  SELECT post_id, substr(rest, 1, instr(rest, '|') - 1),
+         substr(rest, instr(rest, '|') + 1)
+  FROM split WHERE rest != ''
+)
+INSERT INTO post_tags (tag_id, post_id)
+  SELECT t.tag_id, s.post_id
+  FROM split s INNER JOIN tags t ON t.name = replace(s.name, '%7C', '|')
+  WHERE s.name != ''
+ON CONFLICT DO NOTHING;
+
+UPDATE tags SET post_count = (
+  SELECT COUNT(*) FROM post_tags WHERE post_tags.tag_id = tags.tag_id);
+
+CREATE TRIGGER post_tags_ai AFTER INSERT ON post_tags BEGIN
+  UPDATE tags SET post_count = post_count + 1 WHERE tag_id = new.tag_id;
+END;
+
+CREATE TRIGGER post_tags_ad AFTER DELETE ON post_tags BEGIN
+  UPDATE tags SET post_count = post_count - 1 WHERE tag_id = old.tag_id;
+END;
+
+/*
+  Triggers can't start with a WITH clause, so the split is a subquery. It
+  is repeated as the names have to be in tags before post_tags can refer to
+  them.
+*/
+CREATE TRIGGER post_tags_posts_ai AFTER INSERT ON posts
+WHEN new.tags IS NOT NULL AND new.tags != '' BEGIN
+  INSERT INTO tags (name)
+    SELECT DISTINCT replace(name, '%7C', '|') FROM (
+      WITH RECURSIVE split (name, rest) AS (
+        SELECT '', new.tags || '|'
+        UNION ALL
+        SELECT substr(rest, 1, instr(rest, '|') - 1),
+               substr(rest, instr(rest, '|') + 1)
+        FROM split WHERE rest != ''
+      ) SELECT name FROM split
+    ) WHERE name != ''
+  ON CONFLICT DO NOTHING;
+  INSERT INTO post_tags (tag_id, post_id)
+    SELECT tag_id, new.global_id FROM tags WHERE name IN (
+      WITH RECURSIVE split (name, rest) AS (
+        SELECT '', new.tags || '|'
+        UNION ALL
+        SELECT substr(rest, 1, instr(rest, '|') - 1),
+               substr(rest, instr(rest, '|') + 1)
+        FROM split WHERE rest != ''
+      ) SELECT replace(name, '%7C', '|') FROM split WHERE name != ''
+    )
+  ON CONFLICT DO NOTHING;
+END;
+
+CREATE TRIGGER post_tags_posts_ad AFTER DELETE ON posts BEGIN
+  DELETE FROM post_tags WHERE post_id = old.global_id;
+END;
+
+CREATE TRIGGER post_tags_posts_au AFTER UPDATE OF tags ON posts
+WHEN old.tags IS NOT new.tags BEGIN
+  DELETE FROM post_tags WHERE post_id = old.global_id;
+  INSERT INTO tags (name)
+    SELECT DISTINCT replace(name, '%7C', '|') FROM (
+      WITH RECURSIVE split (name, rest) AS (
+        SELECT '', IFNULL(new.tags, '') || '|'
+        UNION ALL
+        SELECT substr(rest, 1, instr(rest, '|') - 1),
+               substr(rest, instr(rest, '|') + 1)
+        FROM split WHERE rest != ''
+      ) SELECT name FROM split
+    ) WHERE name != ''
+  ON CONFLICT DO NOTHING;
+  INSERT INTO post_tags (tag_id, post_id)
+    SELECT tag_id, new.global_id FROM tags WHERE name IN (
+      WITH RECURSIVE split (name, rest) AS (
+        SELECT '', IFNULL(new.tags, '') || '|'
+        UNION ALL
+        SELECT substr(rest, 1, instr(rest, '|') - 1),
+               substr(rest, instr(rest, '|') + 1)
+        FROM split WHERE rest != ''
+      ) SELECT replace(name, '%7C', '|') FROM split WHERE name != ''
+    )
+  ON CONFLICT DO NOTHING;
+END;
@@ -1,6 +1,10 @@
+import random
+import re
 import sqlite3
 
+import counters
 import util
+import viewer
 
 from services.proto import database_pb2
 from services.proto import database_pb2_grpc
@@ -8,35 +12,101 @@ from google.protobuf.timestamp_pb2 import Timestamp
 
 
 DEFAULT_NUM_POSTS = 50
+DEFAULT_TIMELINE_PAGE = 20
+# RandomPosts draws this many candidate ids for every post still wanted, to
+# allow for gaps in the id range and posts the user can't be shown.
+RANDOM_OVERSAMPLE = 3
+# Sampling rounds before RandomPosts falls back to a full table scan.
+RANDOM_MAX_ROUNDS = 4
+# The most words in each SearchArticles snippet.
+SNIPPET_TOKENS = 32
 CONVERT_ERROR = "Error converting tuple to PostsEntry: "
+TAGGED_POSTS_SQL = (
+    'SELECT '
+    'p.global_id, p.author_id, p.tags '
+    'FROM posts p LEFT OUTER JOIN users u ON '
+    'p.author_id = u.global_id '
+    'WHERE p.tags is not NULL OR p.tags = "" AND u.private = 0 '
+)
+# The tags of each post from the post_tags index, one row per tag, with the
+# rows of each post together.
+POST_TAGS_SQL = (
+    'SELECT pt.post_id, p.author_id, pt.tag_id FROM post_tags pt '
+    'INNER JOIN posts p ON p.global_id = pt.post_id '
+    'ORDER BY pt.post_id, pt.tag_id'
+)
+TAG_STATS_SQL = 'SELECT tag_id, name, post_count FROM tags '
+# If new columns are added to the database, this query must be changed.
+# Change also PostsDatabaseServicer._select_base and _insert_values.
+INSERT_POST_SQL = (
+    'INSERT INTO posts '
+    '(author_id, title, body, creation_datetime, '
+    'md_body, ap_id, likes_count, tags, summary) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+)
+# The posts written or shared by the users someone follows, each once, at
+# the time of its newest write or share by one of them, as the CTE newest.
+# Takes the follower's id.
+HOME_FEED_CTE = (
+    'WITH followed (id) AS ('
+    'SELECT followed FROM follows WHERE follower = ? AND state = {active}), '
+    'items (post_id, reason, actor_id, ts) AS ('
+    'SELECT global_id, {posted}, author_id, creation_datetime FROM posts '
+    'WHERE author_id IN followed '
+    'UNION ALL '
+    'SELECT article_id, {shared}, user_id, announce_datetime FROM shares '
+    'WHERE user_id IN followed), '
+    'newest AS ('
+    # SQLite takes reason and actor_id from the row with the MAX(ts).
+    'SELECT post_id, reason, actor_id, MAX(ts) AS ts FROM items '
+    'GROUP BY post_id) '
+).format(active=database_pb2.Follow.ACTIVE,
+         posted=database_pb2.TimelineItem.POSTED,
+         shared=database_pb2.TimelineItem.SHARED)
+# Skips posts whose non-empty ap_id is already known, through the partial
+# unique index on ap_id, see the posts_ap_id_idx migration. INSERT OR IGNORE
+# and changes() rather than an upsert with RETURNING, which needs SQLite
+# 3.35.
+INSERT_NEW_POST_SQL = INSERT_POST_SQL.replace(
+    'INSERT INTO', 'INSERT OR IGNORE INTO', 1)
 
 
 class PostsDatabaseServicer:
 
-    def __init__(self, db, logger):
+    def __init__(self, db, logger, bulk_db=None):
         self._db = db
         self._logger = logger
+        # Whole-table reads go to bulk_db, a snapshots.Snapshots or the DB
+        # itself.
+        self._bulk_db = bulk_db or db
         # If new columns are added to the database, this query must be
-        # changed. Change also _handle_insert & SearchArticles.
-        self._select_base = (
-            "SELECT "
+        # changed. Change also INSERT_POST_SQL & SearchArticles.
+        # Whether the reader liked or shared the post or follows its author
+        # is looked up separately, see viewer.lookup.
+        self._select_columns = (
             "p.global_id, p.author_id, p.title, p.body, "
-            "p.creation_datetime, p.md_body, p.ap_id, p.likes_count, "
-            "l.user_id IS NOT NULL, f.follower IS NOT NULL, "
-            "s.user_id IS NOT NULL, p.shares_count, p.tags, p.summary "
-            "FROM posts p LEFT OUTER JOIN likes l ON "
-            "l.article_id=p.global_id AND l.user_id=? "
-            "LEFT OUTER JOIN shares s ON "
-            "s.article_id=p.global_id AND s.user_id=? "
-            "LEFT OUTER JOIN follows f ON "
-            "f.followed=p.author_id AND f.follower=? "
+            "p.creation_datetime, p.md_body, p.ap_id, " +
+            counters.LIKES_COUNT + ", " + counters.SHARES_COUNT + ", "
+            "p.tags, p.summary "
         )
+        self._select_from = "FROM posts p " + counters.JOIN_DELTAS
+        self._select_base = (
+            "SELECT " + self._select_columns + self._select_from)
         self._type_handlers = {
             database_pb2.PostsRequest.INSERT: self._handle_insert,
             database_pb2.PostsRequest.FIND: self._handle_find,
             database_pb2.PostsRequest.DELETE: self._handle_delete,
             database_pb2.PostsRequest.UPDATE: self._handle_update,
         }
+        self._filter_defer = {
+            'ap_id': self._ap_id_to_filter,
+        }
+        self._random = random.Random()
+
+    def _ap_id_to_filter(self, entry, comp):
+        # The ap_id index only covers non-empty ap_ids, see the
+        # posts_ap_id_idx migration.
+        return "ap_id" + comp + " AND ap_id != ''", entry.ap_id
 
     def Posts(self, request, context):
         response = database_pb2.PostsResponse()
@@ -53,16 +123,23 @@ class PostsDatabaseServicer:
             user_id = request.user_global_id.value
         self._logger.info('Reading {} posts for instance feed'.format(n))
         try:
+            filter_clause, values = util.keyset_filter(
+                'u.host IS NULL AND u.private = 0', [],
+                'p.global_id', request.page_token)
             res = self._db.execute(self._select_base +
                                    'INNER JOIN users u '
                                    'ON p.author_id = u.global_id '
-                                   'WHERE u.host IS NULL AND u.private = 0 '
+                                   'WHERE ' + filter_clause + ' '
                                    'ORDER BY p.global_id DESC '
-                                   'LIMIT ?', user_id, user_id, user_id, n)
+                                   'LIMIT ?', *values, n + 1)
+            res, resp.next_page_token = util.split_page(
+                res, n, lambda tup: tup[0])
+            flags = viewer.lookup(self._db, user_id, res)
             for tup in res:
-                if not self._db_tuple_to_entry(tup, resp.results.add()):
+                if not self._db_tuple_to_entry(tup, resp.results.add(),
+                                               flags):
                     del resp.results[-1]
-        except sqlite3.Error as e:
+        except (sqlite3.Error, util.InvalidPageToken) as e:
             resp.result_type = database_pb2.PostsResponse.ERROR
             resp.error = str(e)
             return resp
@@ -74,14 +151,10 @@ class PostsDatabaseServicer:
         user_id = request.user_id
         self._logger.info('Reading {} random posts'.format(n))
         try:
-            res = self._db.execute(self._select_base +
-                                   'WHERE l.user_id is not ? AND s.user_id is not ? '
-                                   'AND p.author_id is not ?'
-                                   'ORDER BY random() '
-                                   'LIMIT ?', user_id, user_id, user_id,
-                                   user_id, user_id, user_id, n)
-            for tup in res:
-                if not self._db_tuple_to_entry(tup, resp.results.add()):
+            rows, flags = self._sample_posts(n, user_id)
+            for tup in rows:
+                if not self._db_tuple_to_entry(tup, resp.results.add(),
+                                               flags):
                     del resp.results[-1]
         except sqlite3.Error as e:
             resp.result_type = database_pb2.PostsResponse.ERROR
@@ -89,16 +162,80 @@ class PostsDatabaseServicer:
             return resp
         return resp
 
+    def _sample_posts(self, n, user_id):
+        # Rather than sorting the whole table by random(), draw random ids
+        # from the range of post ids and look them up by primary key. Ids
+        # that have been deleted or point at posts the user liked, shared or
+        # wrote are rejected and more are drawn. Returns the posts and the
+        # user's flags for them.
+        flags = viewer.ViewerFlags()
+        if n <= 0:
+            return [], flags
+        # SQLite only answers MIN or MAX from the index when it is the sole
+        # aggregate in the query, hence the subqueries.
+        lo, hi = self._db.execute(
+            'SELECT (SELECT MIN(global_id) FROM posts), '
+            '(SELECT MAX(global_id) FROM posts)')[0]
+        if lo is None:
+            return [], flags
+        tried = set()
+        found = []
+        for _ in range(RANDOM_MAX_ROUNDS):
+            untried = hi - lo + 1 - len(tried)
+            if untried <= 0:
+                return found, flags
+            k = min((n - len(found)) * RANDOM_OVERSAMPLE, untried)
+            if untried <= 2 * k:
+                # Few ids are left, so pick from them directly rather than
+                # drawing until we hit them.
+                ids = set(self._random.sample(
+                    [i for i in range(lo, hi + 1) if i not in tried], k))
+            else:
+                ids = set()
+                while len(ids) < k:
+                    i = self._random.randint(lo, hi)
+                    if i not in tried:
+                        ids.add(i)
+            tried |= ids
+            for chunk in util.chunked(ids, util.MAX_BATCH_KEYS):
+                res = self._db.execute(
+                    self._select_base + 'WHERE p.global_id IN (' +
+                    util.placeholders(len(chunk)) + ')', *chunk)
+                chunk_flags = viewer.lookup(self._db, user_id, res)
+                flags.update(chunk_flags)
+                for tup in res:
+                    if (tup[0] in chunk_flags.liked or
+                            tup[0] in chunk_flags.shared or
+                            tup[1] == user_id):
+                        continue
+                    found.append(tup)
+                    if len(found) == n:
+                        self._random.shuffle(found)
+                        return found, flags
+        # Most of the table is excluded for this user; scan for the rest.
+        self._logger.info('Falling back to scan for random posts')
+        res = self._db.execute(
+            self._select_base +
+            'WHERE NOT EXISTS (SELECT 1 FROM likes '
+            'WHERE user_id = ? AND article_id = p.global_id) '
+            'AND NOT EXISTS (SELECT 1 FROM shares '
+            'WHERE user_id = ? AND article_id = p.global_id) '
+            'AND p.author_id IS NOT ? '
+            'AND p.global_id NOT IN (' +
+            util.placeholders(len(found)) + ') '
+            'ORDER BY random() '
+            'LIMIT ?', user_id, user_id, user_id,
+            *[tup[0] for tup in found], n - len(found))
+        flags.update(viewer.lookup(self._db, user_id, res))
+        found.extend(res)
+        self._random.shuffle(found)
+        return found, flags
+
     def TaggedPosts(self, request, context):
         resp = database_pb2.PostsResponse()
         self._logger.info('Reading all posts with tags')
         try:
-            res = self._db.execute('SELECT '
-                                   'p.global_id, p.author_id, p.tags '
-                                   'FROM posts p LEFT OUTER JOIN users u ON '
-                                   'p.author_id = u.global_id '
-                                   'WHERE p.tags is not NULL OR p.tags = "" AND u.private = 0 '
-                                   )
+            res = self._bulk_db.execute(TAGGED_POSTS_SQL)
             for tup in res:
                 entry = resp.results.add()
                 if len(tup) != 3:
@@ -123,6 +260,267 @@ class PostsDatabaseServicer:
             return resp
         return resp
 
+    def StreamTaggedPosts(self, request, context):
+        n = request.chunk_size or util.DEFAULT_CHUNK_SIZE
+        self._logger.info('Streaming all posts with tags')
+        try:
+            for rows in self._bulk_db.execute_chunks(n, TAGGED_POSTS_SQL):
+                yield database_pb2.PostsResponse(
+                    result_type=database_pb2.PostsResponse.OK,
+                    results=[database_pb2.PostsEntry(
+                        global_id=tup[0],
+                        author_id=tup[1],
+                        tags=tup[2],
+                    ) for tup in rows],
+                )
+        except sqlite3.Error as e:
+            yield database_pb2.PostsResponse(
+                result_type=database_pb2.PostsResponse.ERROR,
+                error=str(e),
+            )
+
+    def BatchGetPosts(self, request, context):
+        resp = database_pb2.PostsResponse()
+        user_id = -1
+        if request.HasField("user_global_id"):
+            user_id = request.user_global_id.value
+        self._logger.info('Batch reading %d posts by id and %d by ap_id',
+                          len(request.global_ids), len(request.ap_ids))
+        queries = []
+        for ids in util.chunked(request.global_ids, util.MAX_BATCH_KEYS):
+            queries.append(('p.global_id IN (' +
+                            util.placeholders(len(ids)) + ')', ids))
+        ap_ids = [a for a in request.ap_ids if a]
+        for ids in util.chunked(ap_ids, util.MAX_BATCH_KEYS):
+            queries.append(('p.ap_id IN (' + util.placeholders(len(ids)) +
+                            ") AND p.ap_id != ''", ids))
+        rows = {}
+        try:
+            for where, values in queries:
+                res = self._db.execute(self._select_base + 'WHERE ' + where,
+                                       *values)
+                for tup in res:
+                    rows.setdefault(tup[0], tup)
+            rows = list(rows.values())
+            flags = viewer.lookup(self._db, user_id, rows)
+        except sqlite3.Error as e:
+            resp.result_type = database_pb2.PostsResponse.ERROR
+            resp.error = str(e)
+            return resp
+        for tup in rows:
+            if not self._db_tuple_to_entry(tup, resp.results.add(), flags):
+                del resp.results[-1]
+        return resp
+
+    def BatchInsertPosts(self, request, context):
+        resp = database_pb2.BatchInsertPostsResponse()
+        self._logger.info('Batch inserting %d posts', len(request.entries))
+
+        def insert_posts(tx):
+            ids = []
+            for entry in request.entries:
+                tx.execute(INSERT_NEW_POST_SQL, *self._insert_values(entry))
+                inserted, global_id = tx.execute(
+                    'SELECT changes(), last_insert_rowid()')[0]
+                if inserted:
+                    ids.append((global_id, True))
+                    continue
+                # Only a known ap_id can conflict, including one inserted
+                # earlier in this batch.
+                res = tx.execute('SELECT global_id FROM posts '
+                                 "WHERE ap_id = ? AND ap_id != ''",
+                                 entry.ap_id)
+                ids.append((res[0][0], False))
+            return ids
+        try:
+            ids = self._db.write(insert_posts)
+        except sqlite3.Error as e:
+            self._logger.error('Batch insert of posts failed: %s', str(e))
+            resp.result_type = database_pb2.BatchInsertPostsResponse.ERROR
+            resp.error = str(e)
+            return resp
+        resp.result_type = database_pb2.BatchInsertPostsResponse.OK
+        for global_id, inserted in ids:
+            resp.global_ids.append(global_id)
+            resp.inserted.append(inserted)
+        return resp
+
+    def UserTimeline(self, request, context):
+        resp = database_pb2.UserTimelineResponse()
+        n = request.page_size or DEFAULT_TIMELINE_PAGE
+        user_id = request.user_id
+        self._logger.info('Reading %d timeline items for user %d', n, user_id)
+        try:
+            where = 'user_id = ?'
+            values = [user_id]
+            if request.page_token:
+                ts, last_id = util.decode_time_token(request.page_token)
+                where += ' AND (ts, post_id) < (?, ?)'
+                values += [ts, last_id]
+            items = self._db.execute(
+                'SELECT post_id, reason, actor_id, ts FROM timeline '
+                'WHERE ' + where + ' ORDER BY ts DESC, post_id DESC LIMIT ?',
+                *values, n + 1)
+            if len(items) > n:
+                items = items[:n]
+                resp.next_page_token = util.encode_time_token(
+                    items[-1][3], items[-1][0])
+            if not items:
+                return resp
+            res = self._db.execute(
+                self._select_base + 'WHERE p.global_id IN (' +
+                util.placeholders(len(items)) + ')', *[i[0] for i in items])
+            flags = viewer.lookup(self._db, user_id, res)
+        except (sqlite3.Error, util.InvalidPageToken) as e:
+            self._logger.error('Error reading timeline: %s', str(e))
+            resp.result_type = database_pb2.UserTimelineResponse.ERROR
+            resp.error = str(e)
+            return resp
+        rows = {tup[0]: tup for tup in res}
+        for post_id, reason, actor_id, ts in items:
+            tup = rows.get(post_id)
+            if tup is None:
+                continue
+            item = resp.items.add(reason=reason, actor_id=actor_id)
+            item.timestamp.seconds = ts
+            if not self._db_tuple_to_entry(tup, item.post, flags):
+                del resp.items[-1]
+        return resp
+
+    def HomeFeed(self, request, context):
+        resp = database_pb2.UserTimelineResponse()
+        n = request.page_size or DEFAULT_TIMELINE_PAGE
+        user_id = request.user_id
+        self._logger.info('Reading %d home feed items for user %d', n, user_id)
+        try:
+            where = ''
+            values = []
+            if request.page_token:
+                ts, last_id = util.decode_time_token(request.page_token)
+                where = 'WHERE (ts, post_id) < (?, ?) '
+                values = [ts, last_id]
+            # The page is picked before joining in the posts, so only the
+            # posts on it are read.
+            res = self._db.execute(
+                HOME_FEED_CTE + ', page AS ('
+                'SELECT * FROM newest ' + where +
+                'ORDER BY ts DESC, post_id DESC LIMIT ?) '
+                'SELECT ' + self._select_columns +
+                ', i.reason, i.actor_id, i.ts ' + self._select_from +
+                'INNER JOIN page i ON i.post_id = p.global_id '
+                'ORDER BY i.ts DESC, i.post_id DESC',
+                user_id, *values, n + 1)
+            if len(res) > n:
+                res = res[:n]
+                resp.next_page_token = util.encode_time_token(
+                    res[-1][-1], res[-1][0])
+            flags = viewer.lookup(self._db, user_id, res)
+        except (sqlite3.Error, util.InvalidPageToken) as e:
+            self._logger.error('Error reading home feed: %s', str(e))
+            resp.result_type = database_pb2.UserTimelineResponse.ERROR
+            resp.error = str(e)
+            return resp
+        for tup in res:
+            reason, actor_id, ts = tup[-3:]
+            item = resp.items.add(reason=reason, actor_id=actor_id)
+            item.timestamp.seconds = ts
+            if not self._db_tuple_to_entry(tup[:-3], item.post, flags):
+                del resp.items[-1]
+        return resp
+
+    def PostsByTag(self, request, context):
+        resp = database_pb2.PostsResponse()
+        n = request.page_size or util.DEFAULT_PAGE_SIZE
+        user_id = -1
+        if request.HasField("user_global_id"):
+            user_id = request.user_global_id.value
+        self._logger.info('Reading %d posts tagged %s', n, request.tag)
+        try:
+            filter_clause, values = util.keyset_filter(
+                't.name = ? AND u.private = 0', [request.tag],
+                'pt.post_id', request.page_token)
+            # The page is picked from post_tags before joining in the posts,
+            # so only the posts on it are read in full.
+            res = self._db.execute(
+                'WITH page (post_id) AS ('
+                'SELECT pt.post_id FROM tags t '
+                'INNER JOIN post_tags pt ON pt.tag_id = t.tag_id '
+                'INNER JOIN posts q ON q.global_id = pt.post_id '
+                'INNER JOIN users u ON u.global_id = q.author_id '
+                'WHERE ' + filter_clause + ' '
+                'ORDER BY pt.post_id DESC LIMIT ?) ' +
+                self._select_base +
+                'WHERE p.global_id IN page ORDER BY p.global_id DESC',
+                *values, n + 1)
+            res, resp.next_page_token = util.split_page(
+                res, n, lambda tup: tup[0])
+            flags = viewer.lookup(self._db, user_id, res)
+        except (sqlite3.Error, util.InvalidPageToken) as e:
+            self._logger.error('Error reading posts by tag: %s', str(e))
+            resp.result_type = database_pb2.PostsResponse.ERROR
+            resp.error = str(e)
+            return resp
+        for tup in res:
+            if not self._db_tuple_to_entry(tup, resp.results.add(), flags):
+                del resp.results[-1]
+        return resp
+
+    def TagStats(self, request, context):
+        resp = database_pb2.TagStatsResponse()
+        try:
+            if request.names:
+                res = []
+                for names in util.chunked(request.names, util.MAX_BATCH_KEYS):
+                    res.extend(self._db.execute(
+                        TAG_STATS_SQL + 'WHERE post_count > 0 AND name IN (' +
+                        util.placeholders(len(names)) + ')', *names))
+                res.sort(key=lambda tup: (-tup[2], -tup[0]))
+            else:
+                # A LIMIT of -1 is no limit.
+                res = self._db.execute(
+                    TAG_STATS_SQL + 'WHERE post_count > 0 '
+                    'ORDER BY post_count DESC, tag_id DESC LIMIT ?',
+                    request.num_tags or -1)
+        except sqlite3.Error as e:
+            self._logger.error('Error reading tag stats: %s', str(e))
+            resp.result_type = database_pb2.TagStatsResponse.ERROR
+            resp.error = str(e)
+            return resp
+        for tag_id, name, post_count in res:
+            resp.tags.add(tag_id=tag_id, name=name, post_count=post_count)
+        return resp
+
+    def StreamPostTags(self, request, context):
+        n = request.chunk_size or util.DEFAULT_CHUNK_SIZE
+        self._logger.info('Streaming the tags of all posts')
+        results = []
+        try:
+            for rows in self._bulk_db.execute_chunks(n, POST_TAGS_SQL):
+                for post_id, author_id, tag_id in rows:
+                    # The rows of a post can be split between chunks, so a
+                    # response is only sent once the next post starts.
+                    if not results or results[-1].post_id != post_id:
+                        if len(results) == n:
+                            yield database_pb2.PostTagsResponse(
+                                result_type=database_pb2.PostTagsResponse.OK,
+                                results=results,
+                            )
+                            results = []
+                        results.append(database_pb2.PostTags(
+                            post_id=post_id, author_id=author_id))
+                    results[-1].tag_ids.append(tag_id)
+        except sqlite3.Error as e:
+            yield database_pb2.PostTagsResponse(
+                result_type=database_pb2.PostTagsResponse.ERROR,
+                error=str(e),
+            )
+            return
+        if results:
+            yield database_pb2.PostTagsResponse(
+                result_type=database_pb2.PostTagsResponse.OK,
+                results=results,
+            )
+
     def SearchArticles(self, request, context):
         self._logger.info('Search query' + request.query)
         resp = database_pb2.PostsResponse()
@@ -134,80 +532,86 @@ class PostsDatabaseServicer:
             user_id = request.user_global_id.value
         self._logger.info(
             'Reading up to {} posts for search articles'.format(n))
+        # Every word of the query must match the start of a word in the
+        # post. Quoting the words keeps FTS5 query syntax in the user's
+        # query from being interpreted.
+        words = re.findall(r'\w+', request.query)
+        if not words:
+            return resp
+        query = ' '.join('"{}"*'.format(w) for w in words)
         try:
-            res = self._db.execute(self._select_base +
-                                   'WHERE global_id IN ' +
-                                   '(SELECT rowid FROM posts_idx WHERE posts_idx '
-                                   "MATCH ? LIMIT ?)", user_id, user_id, user_id, request.query + "*", n)
-            for tup in res:
-                if not self._db_tuple_to_entry(tup, resp.results.add()):
-                    del resp.results[-1]
-        except sqlite3.Error as e:
+            where = 'posts_idx MATCH ?'
+            values = [query]
+            if request.page_token:
+                rank, last_id = util.decode_rank_token(request.page_token)
+                where += ' AND (rank > ? OR (rank = ? AND rowid > ?))'
+                values += [rank, rank, last_id]
+            matches = self._db.execute(
+                'SELECT rowid, rank, '
+                "snippet(posts_idx, -1, '<b>', '</b>', '...', ?) "
+                'FROM posts_idx WHERE ' + where + ' '
+                'ORDER BY rank, rowid LIMIT ?',
+                SNIPPET_TOKENS, *values, n + 1)
+            if len(matches) > n:
+                matches = matches[:n]
+                resp.next_page_token = util.encode_rank_token(
+                    matches[-1][1], matches[-1][0])
+            if not matches:
+                return resp
+            res = self._db.execute(
+                self._select_base + 'WHERE p.global_id IN (' +
+                util.placeholders(len(matches)) + ')',
+                *[m[0] for m in matches])
+            flags = viewer.lookup(self._db, user_id, res)
+        except (sqlite3.Error, util.InvalidPageToken) as e:
             self._logger.info("Error searching for posts")
             self._logger.error(str(e))
             resp.result_type = database_pb2.PostsResponse.ERROR
             resp.error = str(e)
             return resp
+        rows = {tup[0]: tup for tup in res}
+        for global_id, _, snippet in matches:
+            if global_id not in rows:
+                continue
+            entry = resp.results.add()
+            if not self._db_tuple_to_entry(rows[global_id], entry, flags):
+                del resp.results[-1]
+                continue
+            entry.body = snippet
+            entry.md_body = ''
         return resp
 
     def CreatePostsIndex(self, request, context):
-        self._logger.info('Creating Post Index')
+        # The index and the triggers keeping it up to date are created by
+        # the posts_search_index migration. This only checks it is there.
+        self._logger.info('Checking Post Index')
         resp = database_pb2.PostsResponse()
         try:
             res = self._db.execute(
-                'CREATE VIRTUAL TABLE IF NOT EXISTS posts_idx USING ' +
-                'fts5(title, body, content=posts, content_rowid=global_id)')
-            res = self._db.execute(
-                "insert into posts_idx(posts_idx) values('rebuild')")
-            self._logger.info('Adding Triggers')
-            res = self._db.execute(
-                'CREATE TRIGGER IF NOT EXISTS posts_ai AFTER INSERT ON posts BEGIN\n' +
-                '  INSERT INTO posts_idx(rowid, title, body) ' +
-                'VALUES (new.global_id, new.title, new.body); \n' +
-                'END;')
-            res = self._db.execute(
-                'CREATE TRIGGER IF NOT EXISTS posts_ad AFTER DELETE ON posts BEGIN\n' +
-                '  INSERT INTO posts_idx(posts_idx, rowid, title, body) ' +
-                "VALUES ('delete', old.global_id, old.title, old.body); \n" +
-                'END;')
-            res = self._db.execute(
-                'CREATE TRIGGER IF NOT EXISTS posts_au AFTER UPDATE ON posts BEGIN\n' +
-                '  INSERT INTO posts_idx(posts_idx, rowid, title, body) ' +
-                "VALUES ('delete', new.global_id, new.title, new.body);\n" +
-                '  INSERT INTO posts_idx(rowid, title, body) ' +
-                'VALUES (new.global_id, new.title, new.body);\n' +
-                'END;')
-            resp.result_type = database_pb2.PostsResponse.OK
+                "SELECT 1 FROM sqlite_master WHERE name = 'posts_idx'")
         except sqlite3.Error as e:
-            self._logger.info("Error creating posts index")
             self._logger.error(str(e))
             resp.result_type = database_pb2.PostsResponse.ERROR
             resp.error = str(e)
             return resp
+        if not res:
+            resp.result_type = database_pb2.PostsResponse.ERROR
+            resp.error = 'posts_idx is missing, migrations have not run'
         return resp
 
+    def _insert_values(self, entry):
+        return (entry.author_id, entry.title, entry.body,
+                entry.creation_datetime.seconds, entry.md_body, entry.ap_id,
+                entry.likes_count, entry.tags, entry.summary)
+
     def _handle_insert(self, req, resp):
-        try:
-            # If new columns are added to the database, this query must be
-            # changed. Change also _select_base.
-            self._db.execute(
-                'INSERT INTO posts '
-                '(author_id, title, body, creation_datetime, '
-                'md_body, ap_id, likes_count, tags, summary) '
-                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                req.entry.author_id, req.entry.title,
-                req.entry.body,
-                req.entry.creation_datetime.seconds,
-                req.entry.md_body,
-                req.entry.ap_id,
-                req.entry.likes_count,
-                req.entry.tags,
-                req.entry.summary,
-                commit=False)
-            res = self._db.execute(
+        def insert_post(tx):
+            tx.execute(INSERT_POST_SQL, *self._insert_values(req.entry))
+            return tx.execute(
                 'SELECT last_insert_rowid() FROM posts LIMIT 1')
+        try:
+            res = self._db.write(insert_post)
         except sqlite3.Error as e:
-            self._db.commit()
             resp.result_type = database_pb2.PostsResponse.ERROR
             resp.error = str(e)
             return
@@ -220,8 +624,8 @@ class PostsDatabaseServicer:
         resp.result_type = database_pb2.PostsResponse.OK
         resp.global_id = res[0][0]
 
-    def _db_tuple_to_entry(self, tup, entry):
-        if len(tup) != 14:
+    def _db_tuple_to_entry(self, tup, entry, flags):
+        if len(tup) != 11:
             self._logger.warning(
                 CONVERT_ERROR + "Wrong number of elements " + str(tup))
             return False
@@ -235,50 +639,74 @@ class PostsDatabaseServicer:
             entry.md_body = tup[5]
             entry.ap_id = tup[6]
             entry.likes_count = tup[7]
-            entry.is_liked = tup[8]
-            entry.is_followed = tup[9]
-            entry.is_shared = tup[10]
-            entry.shares_count = tup[11]
-            entry.tags = tup[12]
-            entry.summary = tup[13]
+            entry.shares_count = tup[8]
+            entry.tags = tup[9]
+            entry.summary = tup[10]
+            flags.apply(entry)
         except Exception as e:
             self._logger.warning(CONVERT_ERROR + str(e))
             return False
         return True
 
     def _handle_find(self, req, resp):
-        filter_clause, values = util.equivalent_filter(req.match)
+        filter_clause, values = util.equivalent_filter(
+            req.match, deferred=self._filter_defer)
         user_id = -1
         if req.HasField("user_global_id"):
             user_id = req.user_global_id.value
+        if req.page_size or req.page_token:
+            self._find_page(req, resp, filter_clause, values, user_id)
+            return
         try:
             if not filter_clause:
-                res = self._db.execute(
-                    self._select_base, user_id, user_id, user_id)
+                res = self._db.execute(self._select_base)
             else:
                 res = self._db.execute(
                     self._select_base +
                     "WHERE " + filter_clause +
                     " ORDER BY p.global_id DESC",
-                    *([user_id, user_id, user_id] + values))
+                    *values)
+            flags = viewer.lookup(self._db, user_id, res)
         except sqlite3.Error as e:
             resp.result_type = database_pb2.PostsResponse.ERROR
             resp.error = str(e)
             return
         resp.result_type = database_pb2.PostsResponse.OK
         for tup in res:
-            if not self._db_tuple_to_entry(tup, resp.results.add()):
+            if not self._db_tuple_to_entry(tup, resp.results.add(), flags):
+                del resp.results[-1]
+
+    def _find_page(self, req, resp, filter_clause, values, user_id):
+        n = req.page_size or util.DEFAULT_PAGE_SIZE
+        try:
+            filter_clause, values = util.keyset_filter(
+                filter_clause, values, 'p.global_id', req.page_token)
+            where = "WHERE " + filter_clause + " " if filter_clause else ""
+            res = self._db.execute(
+                self._select_base + where +
+                "ORDER BY p.global_id DESC LIMIT ?", *values, n + 1)
+            res, resp.next_page_token = util.split_page(
+                res, n, lambda tup: tup[0])
+            flags = viewer.lookup(self._db, user_id, res)
+        except (sqlite3.Error, util.InvalidPageToken) as e:
+            resp.result_type = database_pb2.PostsResponse.ERROR
+            resp.error = str(e)
+            return
+        resp.result_type = database_pb2.PostsResponse.OK
+        for tup in res:
+            if not self._db_tuple_to_entry(tup, resp.results.add(), flags):
                 del resp.results[-1]
 
     def _handle_delete(self, req, resp):
-        filter_clause, values = util.equivalent_filter(req.match)
+        filter_clause, values = util.equivalent_filter(
+            req.match, deferred=self._filter_defer)
         try:
             if not filter_clause:
-                res = self._db.execute('DELETE FROM posts')
+                self._db.write(lambda tx: tx.execute('DELETE FROM posts'))
             else:
-                res = self._db.execute(
+                self._db.write(lambda tx: tx.execute(
                     'DELETE FROM posts WHERE ' + filter_clause,
-                    *values)
+                    *values))
         except sqlite3.Error as e:
             resp.result_type = database_pb2.PostsResponse.ERROR
             resp.error = str(e)
@@ -294,7 +722,7 @@ class PostsDatabaseServicer:
         match_sql = ''
         match_val = None
         if req.match.ap_id:
-            match_sql = 'ap_id = ?'
+            match_sql = "ap_id = ? AND ap_id != ''"
             match_val = req.match.ap_id
         else:
             match_sql = 'global_id = ?'
@@ -303,7 +731,7 @@ class PostsDatabaseServicer:
         sql = 'UPDATE posts SET ' + update_clause + ' WHERE ' + match_sql
         self._logger.info(sql)
         try:
-            self._db.execute(sql, *u_values, match_val)
+            self._db.write(lambda tx: tx.execute(sql, *u_values, match_val))
         except sqlite3.Error as e:
             resp.result_type = database_pb2.PostsResponse.ERROR
             resp.error = str(e)
@@ -319,7 +747,7 @@ class PostsDatabaseServicer:
         match_sql = ''
         match_val = None
         if req.ap_id:
-            match_sql = 'posts.ap_id = ?'
+            match_sql = "posts.ap_id = ? AND posts.ap_id != ''"
             match_val = req.ap_id
         else:
             match_sql = 'posts.global_id = ?'
@@ -337,12 +765,14 @@ class PostsDatabaseServicer:
             match_sql + ')'
         )
         posts_sql = 'DELETE FROM posts WHERE ' + match_sql
+
+        def remove_post(tx):
+            tx.execute(likes_sql, match_val)
+            tx.execute(shares_sql, match_val)
+            tx.execute(posts_sql, match_val)
         try:
-            self._db.execute(likes_sql, match_val, commit=False)
-            self._db.execute(shares_sql, match_val, commit=False)
-            self._db.execute(posts_sql, match_val)
+            self._db.write(remove_post)
         except sqlite3.Error as e:
-            self._db.discard_cursor()
             return database_pb2.PostsResponse(
                 result_type=database_pb2.PostsResponse.ERROR,
                 error=str(e),
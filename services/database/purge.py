@@ -0,0 +1,172 @@
+import counters
+import util
+
+# Rows of one table deleted per write, so that purging a large account
+# doesn't hold up other writers in one long transaction. Each batch of keys
+# fits in a single IN list.
+DEFAULT_BATCH_ROWS = util.MAX_BATCH_KEYS
+
+
+class Progress:
+    """
+    Progress counts the rows a purge has deleted so far.
+    """
+
+    def __init__(self):
+        self.users = 0
+        self.posts = 0
+        self.likes = 0
+        self.shares = 0
+        self.follows = 0
+
+    def add(self, counts):
+        for name, n in counts.items():
+            setattr(self, name, getattr(self, name) + n)
+
+
+class Purger:
+    """
+    Purger deletes users along with everything they did: their posts, likes,
+    shares and follows, the likes and shares of their posts and the follows
+    of them.
+
+    The rows go in batches of at most batch_rows rows of a table, each
+    batch its own write, so other writes get in between. Triggers take the
+    deleted posts out of the search index, timelines and post_tags in the
+    same write. The like and share counts of other users' posts are
+    corrected through post_counter_deltas, as RemoveLike does. The user row
+    is deleted last, so a purge that fails part way can be run again.
+    """
+
+    def __init__(self, db, logger, user_cache=None,
+                 batch_rows=DEFAULT_BATCH_ROWS):
+        self._db = db
+        self._logger = logger
+        # The usercache.UserCache to drop purged users from, if any.
+        self._user_cache = user_cache
+        self._batch_rows = batch_rows
+
+    def purge_user(self, user_id, progress=None):
+        """
+        purge_user deletes the user with the given global_id.
+
+        Yields:
+          progress, or a new Progress, after each batch.
+        """
+        if progress is None:
+            progress = Progress()
+        self._logger.info('Purging user %d', user_id)
+        # Follows go before posts, so the follow triggers take the user's
+        # posts out of their followers' timelines a timeline at a time
+        # rather than a post at a time.
+        for step in (self._likes, self._shares, self._follows,
+                     self._post_likes, self._post_shares, self._posts,
+                     self._timeline):
+            while True:
+                rows, counts = self._db.write(
+                    lambda tx: step(tx, user_id))
+                progress.add(counts)
+                if rows:
+                    yield progress
+                if rows < self._batch_rows:
+                    break
+        n = self._db.write(lambda tx: tx.execute_count(
+            'DELETE FROM users WHERE global_id = ?', user_id))
+        if self._user_cache is not None:
+            self._user_cache.invalidate(global_ids=[user_id])
+        progress.add({'users': n})
+        yield progress
+
+    def purge_host(self, host):
+        """
+        purge_host deletes every user from host, one after another.
+
+        Yields:
+          A Progress over all of the users after each batch.
+        """
+        progress = Progress()
+        users = self._db.execute(
+            'SELECT global_id FROM users WHERE host = ?', host)
+        self._logger.info('Purging %d users from %s', len(users), host)
+        for (user_id,) in users:
+            yield from self.purge_user(user_id, progress)
+
+    # Each step deletes one batch of rows and returns how many it found,
+    # which is below batch_rows once there are no more, and the counts to
+    # add to the Progress.
+
+    def _likes(self, tx, user_id):
+        ids = [tup[0] for tup in tx.execute(
+            'SELECT article_id FROM likes WHERE user_id = ? LIMIT ?',
+            user_id, self._batch_rows)]
+        if ids:
+            tx.execute('DELETE FROM likes WHERE user_id = ? AND article_id '
+                       'IN (' + util.placeholders(len(ids)) + ')',
+                       user_id, *ids)
+            tx.execute_many(counters.REMOVE_LIKE, [(i,) for i in ids])
+        return len(ids), {'likes': len(ids)}
+
+    def _shares(self, tx, user_id):
+        ids = [tup[0] for tup in tx.execute(
+            'SELECT article_id FROM shares WHERE user_id = ? LIMIT ?',
+            user_id, self._batch_rows)]
+        if ids:
+            tx.execute('DELETE FROM shares WHERE user_id = ? AND article_id '
+                       'IN (' + util.placeholders(len(ids)) + ')',
+                       user_id, *ids)
+            tx.execute_many(counters.REMOVE_SHARE, [(i,) for i in ids])
+        return len(ids), {'shares': len(ids)}
+
+    def _post_likes(self, tx, user_id):
+        return self._of_posts(tx, user_id, 'likes')
+
+    def _post_shares(self, tx, user_id):
+        return self._of_posts(tx, user_id, 'shares')
+
+    def _of_posts(self, tx, user_id, table):
+        # The likes or shares of the user's posts. The counts of the posts go
+        # with them, so nothing is corrected.
+        n = tx.execute_count(
+            'DELETE FROM {t} WHERE rowid IN ('
+            'SELECT t.rowid FROM posts p '
+            'JOIN {t} t ON t.article_id = p.global_id '
+            'WHERE p.author_id = ? LIMIT ?)'.format(t=table),
+            user_id, self._batch_rows)
+        return n, {table: n}
+
+    def _posts(self, tx, user_id):
+        ids = [tup[0] for tup in tx.execute(
+            'SELECT global_id FROM posts WHERE author_id = ? LIMIT ?',
+            user_id, self._batch_rows)]
+        if not ids:
+            return 0, {}
+        # Only likes and shares added since _post_likes and _post_shares ran
+        # are left to delete here.
+        in_ids = 'IN (' + util.placeholders(len(ids)) + ')'
+        likes = tx.execute_count(
+            'DELETE FROM likes WHERE article_id ' + in_ids, *ids)
+        shares = tx.execute_count(
+            'DELETE FROM shares WHERE article_id ' + in_ids, *ids)
+        tx.execute('DELETE FROM post_counter_deltas WHERE post_id ' + in_ids,
+                   *ids)
+        posts = tx.execute_count(
+            'DELETE FROM posts WHERE global_id ' + in_ids, *ids)
+        return len(ids), {'posts': posts, 'likes': likes, 'shares': shares}
+
+    def _follows(self, tx, user_id):
+        n = 0
+        for column in ('follower', 'followed'):
+            n += tx.execute_count(
+                'DELETE FROM follows WHERE rowid IN ('
+                'SELECT rowid FROM follows WHERE ' + column + ' = ? '
+                'LIMIT ?)', user_id, self._batch_rows - n)
+        return n, {'follows': n}
+
+    def _timeline(self, tx, user_id):
+        # The user's own timeline. Their posts and shares have already left
+        # other timelines through the triggers.
+        n = tx.execute_count(
+            'DELETE FROM timeline WHERE user_id = ? AND post_id IN ('
+            'SELECT post_id FROM timeline WHERE user_id = ? LIMIT ?)',
+            user_id, user_id, self._batch_rows)
+        return n, {}
@@ -0,0 +1,64 @@
+import sqlite3
+
+import purge
+
+from services.proto import database_pb2
+
+
+class PurgeDatabaseServicer:
+
+    def __init__(self, db, logger, user_cache=None,
+                 batch_rows=purge.DEFAULT_BATCH_ROWS):
+        self._db = db
+        self._logger = logger
+        self._purger = purge.Purger(db, logger, user_cache, batch_rows)
+
+    def PurgeUser(self, req, context):
+        if not req.user_id:
+            yield database_pb2.PurgeResponse(
+                result_type=database_pb2.PurgeResponse.ERROR,
+                error='user_id is required',
+            )
+            return
+        yield from self._stream(self._purger.purge_user(req.user_id))
+
+    def PurgeHost(self, req, context):
+        if not req.host:
+            yield database_pb2.PurgeResponse(
+                result_type=database_pb2.PurgeResponse.ERROR,
+                error='host is required',
+            )
+            return
+        yield from self._stream(self._purger.purge_host(req.host))
+
+    def _stream(self, purging):
+        # Each response is held back until the next batch is done, so the
+        # last one can be marked done.
+        last = None
+        try:
+            for progress in purging:
+                if last is not None:
+                    yield last
+                last = self._response(progress)
+        except sqlite3.Error as e:
+            self._logger.error('Purge failed: %s', str(e))
+            if last is None:
+                last = self._response(purge.Progress())
+            last.result_type = database_pb2.PurgeResponse.ERROR
+            last.error = str(e)
+            yield last
+            return
+        if last is None:
+            last = self._response(purge.Progress())
+        last.done = True
+        yield last
+
+    def _response(self, progress):
+        return database_pb2.PurgeResponse(
+            result_type=database_pb2.PurgeResponse.OK,
+            users=progress.users,
+            posts=progress.posts,
+            likes=progress.likes,
+            shares=progress.shares,
+            follows=progress.follows,
+        )
@@ -101,4 +101,16 @@ CREATE TABLE IF NOT EXISTS shares (
   PRIMARY KEY (user_id, article_id)
 );
 
+/*
+  schema_version records the migrations from the migrations/ directory that
+  have been applied to this database, see migrate.py.
+  Indexes and any changes to existing tables belong in a new migration rather
+  than in this file, so that existing databases are upgraded too.
+*/
+CREATE TABLE IF NOT EXISTS schema_version (
+  version           integer PRIMARY KEY,
+  name              text    NOT NULL,
+  applied_datetime  integer NOT NULL
+);
+
 /* Add other tables here */
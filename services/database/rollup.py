@@ -0,0 +1,139 @@
+import sqlite3
+import threading
+import time
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+BUCKET_SIZES = (HOUR, DAY)
+
+# Raw views and logs older than this are deleted once they are rolled up.
+DEFAULT_RAW_RETENTION_DAYS = 30
+# Hourly buckets older than this are deleted. Daily buckets are kept.
+DEFAULT_HOURLY_RETENTION_DAYS = 90
+# Seconds between rollup runs.
+DEFAULT_INTERVAL = 5 * 60
+# Raw rows counted or deleted per write, so that a large backlog doesn't
+# hold up other writers in one long transaction.
+BATCH_ROWS = 10000
+
+
+class _Source:
+
+    def __init__(self, table, rollup_table, columns):
+        self.table = table
+        self.rollup_table = rollup_table
+        # The columns a rollup bucket is keyed on besides its start time.
+        self.columns = columns
+
+
+SOURCES = (
+    _Source('views', 'view_rollups', 'path, user_id'),
+    _Source('logs', 'log_rollups', 'user_id'),
+)
+
+
+class Rollups:
+    """
+    Rollups keeps hourly and daily counts of views and logs and prunes the
+    raw rows they were counted from.
+
+    Each run counts the rows added since the previous run into view_rollups
+    and log_rollups, then deletes raw rows older than the raw retention
+    window and hourly buckets older than the hourly retention window. Raw
+    rows are only deleted once they have been counted.
+    """
+
+    def __init__(self, db, logger,
+                 raw_retention_days=DEFAULT_RAW_RETENTION_DAYS,
+                 hourly_retention_days=DEFAULT_HOURLY_RETENTION_DAYS):
+        self._db = db
+        self._logger = logger
+        self._raw_retention = raw_retention_days * DAY
+        self._hourly_retention = hourly_retention_days * DAY
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run(self, now=None):
+        """
+        run rolls up new rows and applies retention once.
+
+        Returns:
+          The number of raw rows rolled up and the number deleted.
+        """
+        if now is None:
+            now = int(time.time())
+        rolled = pruned = 0
+        try:
+            for source in SOURCES:
+                rolled += self._roll_up(source)
+                pruned += self._prune(source, now)
+        except sqlite3.Error as e:
+            self._logger.error('Rolling up views and logs failed: %s', str(e))
+        self._logger.info('Rolled up %d rows, pruned %d rows', rolled, pruned)
+        return rolled, pruned
+
+    def _roll_up(self, source):
+        total = 0
+        while True:
+            n = self._db.write(
+                lambda tx: self._roll_up_batch(tx, source))
+            total += n
+            if n < BATCH_ROWS:
+                return total
+
+    def _roll_up_batch(self, tx, source):
+        res = tx.execute('SELECT last_id FROM rollup_progress '
+                         'WHERE source = ?', source.table)
+        last_id = res[0][0] if res else 0
+        res = tx.execute('SELECT COUNT(*), MAX(id) FROM '
+                         '(SELECT id FROM {} WHERE id > ? '
+                         'ORDER BY id LIMIT ?)'.format(source.table),
+                         last_id, BATCH_ROWS)
+        n, upto = res[0]
+        if not n:
+            return 0
+        for size in BUCKET_SIZES:
+            tx.execute(
+                'INSERT INTO {r} (bucket_size, bucket_start, {c}, count) '
+                'SELECT ?, datetime - datetime % ?, {c}, COUNT(*) '
+                'FROM {t} WHERE id > ? AND id <= ? '
+                'GROUP BY 2, {c} '
+                'ON CONFLICT (bucket_size, bucket_start, {c}) '
+                'DO UPDATE SET count = count + excluded.count'.format(
+                    r=source.rollup_table, t=source.table, c=source.columns),
+                size, size, last_id, upto)
+        tx.execute('INSERT OR REPLACE INTO rollup_progress (source, last_id) '
+                   'VALUES (?, ?)', source.table, upto)
+        return n
+
+    def _prune(self, source, now):
+        total = 0
+        while True:
+            n = self._db.write(lambda tx: tx.execute_count(
+                'DELETE FROM {t} WHERE id IN '
+                '(SELECT id FROM {t} WHERE datetime < ? AND id <= '
+                '(SELECT last_id FROM rollup_progress WHERE source = ?) '
+                'LIMIT ?)'.format(t=source.table),
+                now - self._raw_retention, source.table, BATCH_ROWS))
+            total += n
+            if n < BATCH_ROWS:
+                break
+        self._db.write(lambda tx: tx.execute(
+            'DELETE FROM {} WHERE bucket_size = ? AND bucket_start < ?'.format(
+                source.rollup_table),
+            HOUR, now - self._hourly_retention))
+        return total
+
+    def start(self, interval=DEFAULT_INTERVAL):
+        """start runs the rollups every interval seconds in the background."""
+        def loop():
+            while not self._stop.wait(interval):
+                self.run()
+        self._thread = threading.Thread(
+            target=loop, name='rollups', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,48 @@
+import sqlite3
+
+import rollup
+
+from services.proto import database_pb2
+
+
+class RollupDatabaseServicer:
+
+    def __init__(self, db, logger):
+        self._db = db
+        self._logger = logger
+
+    def Rollups(self, req, context):
+        resp = database_pb2.RollupsResponse()
+        size = rollup.HOUR
+        if req.bucket == database_pb2.RollupsRequest.DAY:
+            size = rollup.DAY
+        if req.source == database_pb2.RollupsRequest.LOGS:
+            sql = ("SELECT bucket_start, '', user_id, count FROM log_rollups "
+                   "WHERE bucket_size = ? AND bucket_start >= ?")
+        else:
+            sql = ("SELECT bucket_start, path, user_id, count "
+                   "FROM view_rollups "
+                   "WHERE bucket_size = ? AND bucket_start >= ?")
+        values = [size, req.start.seconds]
+        if req.HasField("end"):
+            sql += " AND bucket_start < ?"
+            values.append(req.end.seconds)
+        if req.path and req.source == database_pb2.RollupsRequest.VIEWS:
+            sql += " AND path = ?"
+            values.append(req.path)
+        if req.HasField("user_id"):
+            sql += " AND user_id = ?"
+            values.append(req.user_id.value)
+        sql += " ORDER BY 1, 2, 3"
+        try:
+            res = self._db.execute(sql, *values)
+        except sqlite3.Error as e:
+            self._logger.error("Rollups error: %s", str(e))
+            resp.result_type = database_pb2.RollupsResponse.ERROR
+            resp.error = str(e)
+            return resp
+        for bucket_start, path, user_id, count in res:
+            entry = resp.results.add(
+                path=path, user_id=user_id, count=count)
+            entry.bucket_start.seconds = bucket_start
+        return resp
@@ -1,5 +1,9 @@
 import sqlite3
 
+import counters
+import util
+import viewer
+
 from services.proto import database_pb2 as db_pb
 
 
@@ -10,17 +14,14 @@ class ShareDatabaseServicer:
     def __init__(self, db, logger):
         self._db = db
         self._logger = logger
+        # The reader's flags are looked up separately, see viewer.lookup.
         self._select_base = (
             "SELECT "
             "p.global_id, p.author_id, p.title, p.body, "
-            "p.creation_datetime, p.md_body, p.ap_id, p.likes_count, "
-            "l.user_id IS NOT NULL, f.follower IS NOT NULL, "
-            "s.user_id = ?, s.announce_datetime, "
-            "s.user_id, p.shares_count, p.tags, p.summary "
-            "FROM posts p LEFT OUTER JOIN likes l ON "
-            "l.article_id=p.global_id AND l.user_id=? "
-            "LEFT OUTER JOIN follows f ON "
-            "f.followed=p.author_id AND f.follower=? "
+            "p.creation_datetime, p.md_body, p.ap_id, " +
+            counters.LIKES_COUNT + ", s.announce_datetime, "
+            "s.user_id, " + counters.SHARES_COUNT + ", p.tags, p.summary "
+            "FROM posts p " + counters.JOIN_DELTAS
         )
 
     def SharedPosts(self, request, context):
@@ -36,22 +37,30 @@ class ShareDatabaseServicer:
             user_id = request.user_global_id.value
         self._logger.info('Reading {} shared posts for user feed'.format(n))
         try:
+            filter_clause, values = util.keyset_filter(
+                '', [], 's.article_id', request.page_token)
+            where = 'WHERE ' + filter_clause + ' ' if filter_clause else ''
             res = self._db.execute(self._select_base +
                                    'INNER JOIN shares s ON '
                                    'p.global_id = s.article_id AND s.user_id = ? '
+                                   + where +
                                    'ORDER BY p.global_id DESC '
-                                   'LIMIT ?', sharer_id, user_id, user_id, sharer_id, n)
+                                   'LIMIT ?', sharer_id, *values, n + 1)
+            res, resp.next_page_token = util.split_page(
+                res, n, lambda tup: tup[0])
+            flags = viewer.lookup(self._db, user_id, res)
             for tup in res:
-                if not self._db_tuple_to_entry(tup, resp.results.add()):
+                if not self._db_tuple_to_entry(tup, resp.results.add(),
+                                               flags):
                     del resp.results[-1]
-        except sqlite3.Error as e:
+        except (sqlite3.Error, util.InvalidPageToken) as e:
             resp.result_type = db_pb.SharesResponse.ERROR
             resp.error = str(e)
             return resp
         return resp
 
-    def _db_tuple_to_entry(self, tup, entry):
-        if len(tup) != 16:
+    def _db_tuple_to_entry(self, tup, entry, flags):
+        if len(tup) != 13:
             self._logger.warning(
                 "Error converting tuple to SharesEntry: " +
                 "Wrong number of elements " + str(tup))
@@ -66,14 +75,12 @@ class ShareDatabaseServicer:
             entry.md_body = tup[5]
             entry.ap_id = tup[6]
             entry.likes_count = tup[7]
-            entry.is_liked = tup[8]
-            entry.is_followed = tup[9]
-            entry.is_shared = tup[10]
-            entry.announce_datetime.seconds = tup[11]
-            entry.sharer_id = tup[12]
-            entry.shares_count = tup[13]
-            entry.tags = tup[14]
-            entry.summary = tup[15]
+            entry.announce_datetime.seconds = tup[8]
+            entry.sharer_id = tup[9]
+            entry.shares_count = tup[10]
+            entry.tags = tup[11]
+            entry.summary = tup[12]
+            flags.apply(entry)
         except Exception as e:
             self._logger.warning(
                 "Error converting tuple to SharesEntry: " +
@@ -89,22 +96,20 @@ class ShareDatabaseServicer:
         response = db_pb.SharesResponse(
             result_type=db_pb.SharesResponse.OK
         )
-        try:
-            self._db.execute(
-                'INSERT INTO shares (user_id, article_id, announce_datetime) '
+
+        def add_share(tx):
+            tx.execute(
+                'INSERT INTO shares '
+                '(user_id, article_id, announce_datetime) '
                 'VALUES (?, ?, ?)',
                 req.user_id,
                 req.article_id,
                 req.announce_datetime.seconds,
-                commit=False
-            )
-            self._db.execute(
-                'UPDATE posts SET shares_count = shares_count + 1 '
-                'WHERE global_id=?',
-                req.article_id
             )
+            tx.execute(counters.ADD_SHARE, req.article_id)
+        try:
+            self._db.write(add_share)
         except sqlite3.Error as e:
-            self._db.discard_cursor()
             self._logger.error("AddShare error: %s", str(e))
             response.result_type = db_pb.AddShareResponse.ERROR
             response.error = str(e)
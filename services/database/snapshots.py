@@ -0,0 +1,205 @@
+import contextlib
+import glob
+import os
+import sqlite3
+import threading
+import time
+
+# Seconds between snapshots. Bulk readers see data at most about this old.
+DEFAULT_INTERVAL = 5 * 60
+# Snapshots are taken with sqlite3's backup, which is new in Python 3.7.
+SUPPORTED = hasattr(sqlite3.Connection, 'backup')
+
+
+class _Snapshot:
+
+    def __init__(self, path, generation, taken):
+        self.path = path
+        self.generation = generation
+        self.taken = taken
+        # Reads in progress. The file is removed once it has been replaced
+        # and the last of them finishes.
+        self.readers = 0
+
+
+class Snapshots:
+    """
+    Snapshots keeps a read-only copy of the database for whole-table reads.
+
+    The recommenders read every user, like, follow and tagged post when
+    they recompute. Run against the live database those scans compete with
+    interactive traffic for the page cache, and a long read stops the WAL
+    from being checkpointed while it lasts, so the WAL and every commit
+    grow. Reading them from a copy that is refreshed every few minutes
+    avoids both, at the cost of the copy being slightly stale.
+
+    A snapshot is taken with SQLite's online backup API in one step, which
+    reads the database in a single transaction, so the copy is consistent
+    without stopping the writer. Readers open the copy as immutable, so
+    they take no locks at all. A replaced copy is deleted once the last
+    read of it has finished.
+
+    Snapshots has the execute and execute_chunks methods of DB, so a
+    servicer can be handed one in place of the DB for its bulk reads. Until
+    the first snapshot is taken they read the live database.
+    """
+
+    def __init__(self, db, logger, stats=None):
+        self._db = db
+        self._logger = logger
+        self._stats = stats
+        self._prefix = db.filename + '.snapshot-'
+        self._lock = threading.Lock()
+        # Only one snapshot is taken at a time.
+        self._take_lock = threading.Lock()
+        self._current = None
+        self._generation = 0
+        self._stop = threading.Event()
+        self._thread = None
+        # Left behind if the service did not shut down cleanly.
+        for path in glob.glob(glob.escape(self._prefix) + '*'):
+            self._remove(path)
+
+    def take(self):
+        """
+        take copies the database into a new snapshot and makes it current.
+
+        Returns:
+          The age in seconds of the snapshot readers see after the call,
+          or None if there is none because every attempt failed.
+        """
+        with self._take_lock:
+            self._generation += 1
+            path = self._prefix + str(self._generation)
+            start = time.time()
+            try:
+                dst = sqlite3.connect(path)
+                try:
+                    self._db.backup(dst)
+                    # The copy is only ever read, so it needs no WAL.
+                    dst.execute('PRAGMA journal_mode=DELETE')
+                finally:
+                    dst.close()
+            except sqlite3.Error as e:
+                self._logger.error('Taking a database snapshot failed: %s',
+                                   str(e))
+                self._remove(path)
+                return self.age()
+            self._logger.info('Took database snapshot %s in %.3fs', path,
+                              time.time() - start)
+            self._replace(_Snapshot(path, self._generation, start))
+        return self.age()
+
+    def age(self):
+        """age is the age in seconds of the current snapshot, or None."""
+        snap = self._current
+        if snap is None:
+            return None
+        return time.time() - snap.taken
+
+    def _replace(self, snap):
+        with self._lock:
+            old, self._current = self._current, snap
+            remove = old is not None and old.readers == 0
+        if remove:
+            self._remove(old.path)
+
+    def _remove(self, path):
+        for p in (path, path + '-journal'):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self._logger.warning('Could not remove snapshot %s: %s',
+                                     p, str(e))
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        _connect yields a connection to the current snapshot, or None if
+        there is none yet, and holds on to the snapshot until it exits.
+        """
+        with self._lock:
+            snap = self._current
+            if snap is not None:
+                snap.readers += 1
+        if snap is None:
+            yield None
+            return
+        try:
+            conn = sqlite3.connect(
+                'file:{}?mode=ro&immutable=1'.format(snap.path), uri=True)
+            try:
+                yield conn
+            finally:
+                conn.close()
+        finally:
+            with self._lock:
+                snap.readers -= 1
+                remove = snap is not self._current and snap.readers == 0
+            if remove:
+                self._remove(snap.path)
+
+    def _record(self, conn, statement, params, elapsed, rows):
+        if self._stats is not None:
+            self._stats.record_statement(conn, statement, params, elapsed,
+                                         rows)
+
+    def execute(self, statement, *params):
+        with self._connect() as conn:
+            if conn is None:
+                return self._db.execute(statement, *params)
+            start = time.perf_counter()
+            res = conn.execute(statement, params).fetchall()
+            self._record(conn, statement, params,
+                         time.perf_counter() - start, len(res))
+            return res
+
+    def execute_chunks(self, chunk_size, statement, *params):
+        """
+        execute_chunks is DB.execute_chunks on the snapshot. The snapshot
+        is kept until the generator is exhausted or closed.
+        """
+        with self._connect() as conn:
+            if conn is None:
+                yield from self._db.execute_chunks(
+                    chunk_size, statement, *params)
+                return
+            cursor = conn.cursor()
+            rows_read = 0
+            elapsed = 0
+            try:
+                start = time.perf_counter()
+                cursor.execute(statement, params)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    elapsed += time.perf_counter() - start
+                    if not rows:
+                        return
+                    rows_read += len(rows)
+                    yield rows
+                    start = time.perf_counter()
+            finally:
+                cursor.close()
+                self._record(conn, statement, params, elapsed, rows_read)
+
+    def start(self, interval=DEFAULT_INTERVAL):
+        """start takes a snapshot now and then every interval seconds."""
+        def loop():
+            self.take()
+            while not self._stop.wait(interval):
+                self.take()
+        self._thread = threading.Thread(
+            target=loop, name='snapshots', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            old, self._current = self._current, None
+            remove = old is not None and old.readers == 0
+        if remove:
+            self._remove(old.path)
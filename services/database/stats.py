@@ -0,0 +1,265 @@
+import bisect
+import contextlib
+import copy
+import functools
+import re
+import sqlite3
+import threading
+import time
+
+import grpc
+
+# Upper bounds of the latency histogram buckets in milliseconds. Anything
+# slower goes in a final unbounded bucket.
+LATENCY_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100,
+                      250, 500, 1000, 2500, 5000, 10000)
+# Upper bounds of the statements-per-RPC histogram buckets.
+STATEMENT_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# Statements slower than this are logged with their query plan.
+DEFAULT_SLOW_QUERY_MS = 100
+# Statements tracked separately. Further distinct statements are only
+# counted towards their RPC, which bounds memory if a caller builds SQL
+# with inlined values.
+MAX_STATEMENTS = 1000
+
+# IN lists built by util.placeholders differ only in their length.
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=4 * MAX_STATEMENTS)
+def normalize(statement):
+    """normalize is the key statistics for statement are kept under."""
+    statement = _WHITESPACE.sub(' ', statement.strip())
+    return _PLACEHOLDER_LIST.sub('?, ...', statement)
+
+
+class Histogram:
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self._bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, p):
+        """
+        percentile estimates the pth percentile as the upper bound of the
+        bucket it falls in, or the maximum if that is lower.
+        """
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                if i < len(self._bounds):
+                    return min(self._bounds[i], self.max)
+                break
+        return self.max
+
+
+class RpcStats:
+
+    def __init__(self):
+        self.errors = 0
+        self.latency = Histogram()
+        # Statements run per call. A call running as many statements as it
+        # returns rows is an N+1 query.
+        self.statements = Histogram(STATEMENT_COUNT_BUCKETS)
+        self.rows = 0
+
+
+class StatementStats:
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.rows = 0
+        self.slow = 0
+
+
+class _Call:
+
+    def __init__(self, name):
+        self.name = name
+        self.statements = 0
+        self.rows = 0
+
+
+class Stats:
+    """
+    Stats keeps latency histograms of the service's RPCs and SQL statements.
+
+    RPCs are timed by StatsInterceptor, and statements by the DB the Stats
+    is passed to. Statements are attributed to the RPC running on the same
+    thread, or for writes, to the RPC that submitted them.
+    """
+
+    def __init__(self, logger, slow_query_ms=DEFAULT_SLOW_QUERY_MS):
+        self._logger = logger
+        self._slow = slow_query_ms
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._rpcs = {}
+        self._statements = {}
+
+    def current(self):
+        """current is the call running on this thread, if any."""
+        return getattr(self._local, 'call', None)
+
+    @contextlib.contextmanager
+    def bind(self, call):
+        """bind attributes statements run in the block to call."""
+        previous = self.current()
+        self._local.call = call
+        try:
+            yield
+        finally:
+            self._local.call = previous
+
+    def begin_rpc(self, name):
+        call = _Call(name)
+        self._local.call = call
+        return call
+
+    def end_rpc(self, call, elapsed, error):
+        self._local.call = None
+        with self._lock:
+            rpc = self._rpcs.get(call.name)
+            if rpc is None:
+                rpc = self._rpcs[call.name] = RpcStats()
+            rpc.latency.add(elapsed * 1000)
+            rpc.statements.add(call.statements)
+            rpc.rows += call.rows
+            if error:
+                rpc.errors += 1
+
+    def record_statement(self, conn, statement, params, elapsed, rows):
+        """
+        record_statement records a statement run on conn. rows is the number
+        of rows it returned or changed, which sqlite3 reports as -1 for
+        statements that do neither.
+        """
+        rows = max(rows, 0)
+        ms = elapsed * 1000
+        slow = ms >= self._slow
+        call = self.current()
+        if call is not None:
+            call.statements += 1
+            call.rows += rows
+        key = normalize(statement)
+        with self._lock:
+            st = self._statements.get(key)
+            if st is None and len(self._statements) < MAX_STATEMENTS:
+                st = self._statements[key] = StatementStats()
+            if st is not None:
+                st.latency.add(ms)
+                st.rows += rows
+                st.slow += slow
+        if slow:
+            self._log_slow(conn, statement, params, ms, rows, call)
+
+    def _log_slow(self, conn, statement, params, ms, rows, call):
+        plan = ''
+        if params is not None:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('EXPLAIN QUERY PLAN ' + statement, params)
+                plan = format_plan(cursor.fetchall())
+            except sqlite3.Error as e:
+                plan = 'No query plan: ' + str(e)
+            finally:
+                cursor.close()
+        self._logger.warning('Slow query in %s (%.1fms, %d rows): %s\n%s',
+                             call.name if call else 'background', ms, rows,
+                             _WHITESPACE.sub(' ', statement.strip()), plan)
+
+    def snapshot(self, reset=False):
+        """
+        snapshot returns copies of the RPC and statement stats, keyed by
+        method and normalized statement. If reset is set they are cleared.
+        """
+        with self._lock:
+            rpcs, statements = self._rpcs, self._statements
+            if reset:
+                self._rpcs, self._statements = {}, {}
+            else:
+                rpcs, statements = copy.deepcopy((rpcs, statements))
+        return rpcs, statements
+
+
+def format_plan(rows):
+    """format_plan indents EXPLAIN QUERY PLAN rows like the sqlite3 shell."""
+    depth = {0: -1}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node] + detail)
+    return '\n'.join(lines)
+
+
+class StatsInterceptor(grpc.ServerInterceptor):
+    """StatsInterceptor times unary and server streaming RPCs."""
+
+    def __init__(self, stats):
+        self._stats = stats
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        name = handler_call_details.method.rsplit('/', 1)[-1]
+        if handler.unary_unary:
+            return grpc.unary_unary_rpc_method_handler(
+                self._unary(name, handler.unary_unary),
+                request_deserializer=handler.request_deserializer,
+                response_serializer=handler.response_serializer)
+        if handler.unary_stream:
+            return grpc.unary_stream_rpc_method_handler(
+                self._stream(name, handler.unary_stream),
+                request_deserializer=handler.request_deserializer,
+                response_serializer=handler.response_serializer)
+        return handler
+
+    def _unary(self, name, behavior):
+        def timed(request, context):
+            call = self._stats.begin_rpc(name)
+            start = time.perf_counter()
+            error = True
+            try:
+                resp = behavior(request, context)
+                error = is_error(resp)
+                return resp
+            finally:
+                self._stats.end_rpc(call, time.perf_counter() - start, error)
+        return timed
+
+    def _stream(self, name, behavior):
+        def timed(request, context):
+            call = self._stats.begin_rpc(name)
+            start = time.perf_counter()
+            error = False
+            try:
+                for resp in behavior(request, context):
+                    error = error or is_error(resp)
+                    yield resp
+            except BaseException:
+                error = True
+                raise
+            finally:
+                self._stats.end_rpc(call, time.perf_counter() - start, error)
+        return timed
+
+
+def is_error(resp):
+    # Every response's ResultType has OK = 0.
+    return getattr(resp, 'result_type', 0) != 0
@@ -0,0 +1,56 @@
+from services.proto import database_pb2
+
+PERCENTILES = (50, 95, 99)
+
+
+def _summary(hist, summary):
+    summary.count = hist.count
+    summary.mean_ms = hist.mean()
+    summary.p50_ms, summary.p95_ms, summary.p99_ms = (
+        hist.percentile(p) for p in PERCENTILES)
+    summary.max_ms = hist.max
+
+
+class StatsDatabaseServicer:
+
+    def __init__(self, db, logger, stats, caches=None):
+        self._db = db
+        self._logger = logger
+        self._stats = stats
+        # Caches to report hit rates for, by name.
+        self._caches = caches or {}
+
+    def DatabaseStats(self, req, context):
+        resp = database_pb2.DatabaseStatsResponse()
+        if self._stats is None:
+            resp.result_type = database_pb2.DatabaseStatsResponse.ERROR
+            resp.error = 'Stats are not being recorded'
+            return resp
+        rpcs, statements = self._stats.snapshot(reset=req.reset)
+        for method, rpc in sorted(rpcs.items(),
+                                  key=lambda i: -i[1].latency.total):
+            entry = resp.rpcs.add(
+                method=method,
+                errors=rpc.errors,
+                mean_statements=rpc.statements.mean(),
+                max_statements=rpc.statements.max,
+                rows=rpc.rows,
+            )
+            _summary(rpc.latency, entry.latency)
+        for statement, st in sorted(statements.items(),
+                                    key=lambda i: -i[1].latency.total):
+            entry = resp.statements.add(
+                statement=statement, rows=st.rows, slow=st.slow)
+            _summary(st.latency, entry.latency)
+        for name, cache in sorted(self._caches.items()):
+            lookups = cache.hits + cache.misses
+            resp.caches.add(
+                name=name,
+                hits=cache.hits,
+                misses=cache.misses,
+                hit_rate=cache.hits / lookups if lookups else 0,
+                evictions=cache.evictions,
+                invalidations=cache.invalidations,
+                size=len(cache),
+            )
+        return resp
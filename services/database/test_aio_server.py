@@ -0,0 +1,118 @@
+import unittest
+import asyncio
+import logging
+import os
+import sys
+
+import grpc
+
+import aio_server
+import database
+import stats
+from database_servicer import DatabaseServicer
+from services.proto import database_pb2
+from services.proto import database_pb2_grpc
+
+AIO_DB_PATH = "./testdb/aio.db"
+
+
+# IsolatedAsyncioTestCase is new in Python 3.8. The class still has to be
+# defined on older versions for the skip to be reported.
+_AsyncTestCase = getattr(unittest, 'IsolatedAsyncioTestCase',
+                         unittest.TestCase)
+
+
+@unittest.skipUnless(sys.version_info >= (3, 8),
+                     'the aio server tests need Python 3.8')
+class AioServerTest(_AsyncTestCase):
+
+    def setUp(self):
+        def clean_database():
+            os.remove(AIO_DB_PATH)
+
+        self.logger = logging.getLogger()
+        self.stats = stats.Stats(self.logger)
+        self.db = database.build_database(self.logger,
+                                          "rabble_schema.sql",
+                                          AIO_DB_PATH,
+                                          stats=self.stats)
+        self.addCleanup(clean_database)
+        self.addCleanup(self.db.close)
+        self.servicer = DatabaseServicer(self.db, self.logger)
+        self.addCleanup(self.servicer.close)
+
+    async def asyncSetUp(self):
+        self.aio_servicer = aio_server.AioDatabaseServicer(
+            self.servicer, self.logger, readers=2, write_waiters=4,
+            bulk_workers=1, stats=self.stats)
+        self.server = grpc.aio.server()
+        database_pb2_grpc.add_DatabaseServicer_to_server(
+            self.aio_servicer, self.server)
+        port = self.server.add_insecure_port('localhost:0')
+        await self.server.start()
+        self.channel = grpc.aio.insecure_channel('localhost:{}'.format(port))
+        self.stub = database_pb2_grpc.DatabaseStub(self.channel)
+
+    async def asyncTearDown(self):
+        await self.channel.close()
+        await self.server.stop(None)
+        self.aio_servicer.close()
+
+    async def add_user(self, handle):
+        res = await self.stub.Users(database_pb2.UsersRequest(
+            request_type=database_pb2.UsersRequest.INSERT,
+            entry=database_pb2.UsersEntry(handle=handle, host_is_null=True),
+        ))
+        self.assertEqual(res.result_type, database_pb2.UsersResponse.OK)
+        return res.global_id
+
+    async def test_concurrent_unary_calls(self):
+        ids = await asyncio.gather(
+            *(self.add_user('user{}'.format(i)) for i in range(50)))
+        self.assertEqual(sorted(ids), list(range(1, 51)))
+        found = await asyncio.gather(*(self.stub.Users(
+            database_pb2.UsersRequest(
+                request_type=database_pb2.UsersRequest.FIND,
+                match=database_pb2.UsersEntry(global_id=i)))
+            for i in ids))
+        self.assertEqual([r.results[0].global_id for r in found], ids)
+        rpcs, _ = self.stats.snapshot()
+        self.assertEqual(rpcs['Users'].latency.count, 100)
+
+    async def test_stream(self):
+        for i in range(5):
+            await self.add_user('user{}'.format(i))
+        got = []
+        async for res in self.stub.StreamAllUsers(
+                database_pb2.StreamRequest(chunk_size=2)):
+            self.assertEqual(res.result_type, database_pb2.UsersResponse.OK)
+            got.append([u.global_id for u in res.results])
+        self.assertEqual(got, [[1, 2], [3, 4], [5]])
+
+    async def test_cancelled_stream_releases_worker(self):
+        for i in range(20):
+            await self.add_user('user{}'.format(i))
+        call = self.stub.StreamAllUsers(
+            database_pb2.StreamRequest(chunk_size=1))
+        await call.read()
+        call.cancel()
+        # The single bulk worker has to be free again for this to finish.
+        res = await asyncio.wait_for(
+            self.stub.AllUsers(database_pb2.AllUsersRequest()), 5)
+        self.assertEqual(len(res.results), 20)
+
+    def test_pools(self):
+        servicer = self.aio_servicer
+        find = database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.FIND)
+        insert = database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.INSERT)
+        self.assertIs(servicer._pool('Posts', find),
+                      servicer._pools[aio_server.READ])
+        self.assertIs(servicer._pool('Posts', insert),
+                      servicer._pools[aio_server.WRITE])
+        self.assertIs(servicer._pool('AddLike', database_pb2.LikeEntry()),
+                      servicer._pools[aio_server.WRITE])
+        self.assertIs(servicer._pool('AllUsers',
+                                     database_pb2.AllUsersRequest()),
+                      servicer._pools[aio_server.BULK])
@@ -0,0 +1,71 @@
+import unittest
+import logging
+import os
+
+import counters
+import database
+import like_servicer
+import posts_servicer
+import share_servicer
+from services.proto import database_pb2
+
+COUNTERS_DB_PATH = "./testdb/counters.db"
+
+
+class CountersTest(unittest.TestCase):
+
+    def setUp(self):
+        def clean_database():
+            os.remove(COUNTERS_DB_PATH)
+
+        logger = logging.getLogger()
+        self.db = database.build_database(logger,
+                                          "rabble_schema.sql",
+                                          COUNTERS_DB_PATH)
+        self.addCleanup(clean_database)
+        self.addCleanup(self.db.close)
+        self.posts = posts_servicer.PostsDatabaseServicer(self.db, logger)
+        self.like = like_servicer.LikeDatabaseServicer(self.db, logger)
+        self.share = share_servicer.ShareDatabaseServicer(self.db, logger)
+        self.folder = counters.CounterFolder(self.db, logger)
+        self.posts.Posts(database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.INSERT,
+            entry=database_pb2.PostsEntry(author_id=1, title='viral'),
+        ), None)
+
+    def counts(self):
+        res = self.posts.Posts(database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.FIND,
+            match=database_pb2.PostsEntry(global_id=1),
+        ), None)
+        return res.results[0].likes_count, res.results[0].shares_count
+
+    def stored_counts(self):
+        return self.db.execute('SELECT likes_count, shares_count FROM posts '
+                               'WHERE global_id = 1')[0]
+
+    def test_reads_include_pending_deltas(self):
+        for user_id in range(1, 6):
+            self.like.AddLike(database_pb2.LikeEntry(
+                user_id=user_id, article_id=1), None)
+        self.like.RemoveLike(database_pb2.LikeEntry(
+            user_id=2, article_id=1), None)
+        self.share.AddShare(database_pb2.ShareEntry(
+            user_id=3, article_id=1), None)
+        self.assertEqual(self.counts(), (4, 1))
+        self.assertEqual(self.stored_counts(), (0, 0))
+
+        self.assertEqual(self.folder.fold(), 1)
+        self.assertEqual(self.stored_counts(), (4, 1))
+        self.assertEqual(self.counts(), (4, 1))
+        self.assertEqual(
+            self.db.execute('SELECT COUNT(*) FROM post_counter_deltas'),
+            [(0,)])
+
+    def test_fold_skips_deleted_posts(self):
+        self.like.AddLike(database_pb2.LikeEntry(
+            user_id=1, article_id=7), None)
+        self.assertEqual(self.folder.fold(), 1)
+        self.assertEqual(
+            self.db.execute('SELECT COUNT(*) FROM post_counter_deltas'),
+            [(0,)])
@@ -0,0 +1,134 @@
+import unittest
+import logging
+import os
+import sqlite3
+import threading
+
+import database
+
+DATABASE_DB_PATH = "./testdb/database.db"
+
+
+class DatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        def clean_database():
+            os.remove(DATABASE_DB_PATH)
+
+        logger = logging.getLogger()
+        self.db = database.build_database(logger,
+                                          "rabble_schema.sql",
+                                          DATABASE_DB_PATH)
+        self.addCleanup(clean_database)
+        self.addCleanup(self.db.close)
+
+    def count_likes(self):
+        return self.db.execute('SELECT COUNT(*) FROM likes')[0][0]
+
+    def test_transaction_commits(self):
+        with self.db.transaction() as tx:
+            tx.execute('INSERT INTO likes (user_id, article_id) '
+                       'VALUES (?, ?)', 1, 2)
+            tx.execute('INSERT INTO likes (user_id, article_id) '
+                       'VALUES (?, ?)', 1, 3)
+        self.assertEqual(self.count_likes(), 2)
+
+    def test_transaction_rolls_back_on_error(self):
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.db.transaction() as tx:
+                tx.execute('INSERT INTO likes (user_id, article_id) '
+                           'VALUES (?, ?)', 1, 2)
+                tx.execute('INSERT INTO likes (user_id, article_id) '
+                           'VALUES (?, ?)', 1, 2)
+        self.assertEqual(self.count_likes(), 0)
+        # The connection must be usable again after the rollback.
+        with self.db.transaction() as tx:
+            tx.execute('INSERT INTO likes (user_id, article_id) '
+                       'VALUES (?, ?)', 1, 2)
+        self.assertEqual(self.count_likes(), 1)
+
+    def test_connections_are_per_thread(self):
+        conns = []
+
+        def worker():
+            self.db.execute('SELECT 1')
+            conns.append(self.db._get_conn())
+
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.db.execute('SELECT 1')
+        # Repeated calls on one thread reuse the same connection.
+        self.assertIs(self.db._get_conn(), self.db._get_conn())
+        conns.append(self.db._get_conn())
+        self.assertEqual(len({id(c) for c in conns}), 4)
+
+    def test_concurrent_writers(self):
+        def worker(user_id):
+            for article_id in range(20):
+                with self.db.transaction() as tx:
+                    tx.execute('INSERT INTO likes (user_id, article_id) '
+                               'VALUES (?, ?)', user_id, article_id)
+
+        threads = [threading.Thread(target=worker, args=(u,))
+                   for u in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.count_likes(), 80)
+
+
+    def test_write_returns_result(self):
+        def insert(tx):
+            tx.execute('INSERT INTO likes (user_id, article_id) '
+                       'VALUES (?, ?)', 1, 2)
+            return tx.execute('SELECT COUNT(*) FROM likes')
+        self.assertEqual(self.db.write(insert), [(1,)])
+        self.assertEqual(self.count_likes(), 1)
+
+    def test_write_batches_concurrent_writes(self):
+        # Hold the writer so that the following writes queue up behind it
+        # and are committed together.
+        started = threading.Event()
+        release = threading.Event()
+
+        def block(tx):
+            started.set()
+            release.wait()
+
+        blocker = threading.Thread(target=self.db.write, args=(block,))
+        blocker.start()
+        started.wait()
+        batches_before = self.db._writer.batches
+
+        errors = []
+
+        def worker(user_id):
+            try:
+                self.db.write(lambda tx: tx.execute(
+                    'INSERT INTO likes (user_id, article_id) '
+                    'VALUES (?, ?)', user_id, 1))
+            except sqlite3.Error as e:
+                errors.append(e)
+
+        # User 0 is written twice, so one of those writes must fail without
+        # affecting the rest of its batch.
+        threads = [threading.Thread(target=worker, args=(u % 10,))
+                   for u in range(11)]
+        for t in threads:
+            t.start()
+        while self.db._writer._queue.qsize() < len(threads):
+            pass
+        release.set()
+        blocker.join()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], sqlite3.IntegrityError)
+        self.assertEqual(self.count_likes(), 10)
+        # The blocker's batch plus one batch for all of the queued writes.
+        self.assertEqual(self.db._writer.batches - batches_before, 2)
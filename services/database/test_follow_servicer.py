@@ -26,6 +26,7 @@ class FollowDatabaseHelper(unittest.TestCase):
                                           "rabble_schema.sql",
                                           FOLLOW_DB_PATH)
         self.addCleanup(clean_database)
+        self.addCleanup(self.db.close)
         self.service = follow_servicer.FollowDatabaseServicer(self.db, logger)
         self.ctx = fake_context()
 
@@ -267,6 +268,17 @@ class FollowFindAllDatabase(FollowDatabaseHelper):
         self.assertNotIn(do_not_want[1], find_res.results)
         self.assertEqual(len(find_res.results), 3)
 
+    def test_stream_all_follows(self):
+        for follower in range(1, 6):
+            self.add_follow(follower=follower, followed=10)
+        self.add_follow(follower=6, followed=10,
+                        state=database_pb2.Follow.REJECTED)
+        req = database_pb2.StreamRequest(chunk_size=2)
+        chunks = list(self.service.StreamAllFollows(req, self.ctx))
+        self.assertEqual([2, 2, 1], [len(c.results) for c in chunks])
+        streamed = [f for c in chunks for f in c.results]
+        self.assertEqual(streamed, list(self.find_follow().results))
+
 class TestDeleteDatabase(FollowDatabaseHelper):
 
     def test_delete_follow(self):
@@ -305,3 +317,26 @@ class TestDeleteDatabase(FollowDatabaseHelper):
         find_res = self.find_follow(followed=2)
         self.assertEqual(len(find_res.results), 1)
         self.assertEqual(find_res.results[0], want)
+
+    def test_find_pages(self):
+        for follower in range(1, 6):
+            self.add_follow(follower=follower, followed=10,
+                            state=database_pb2.Follow.ACTIVE)
+        self.add_follow(follower=6, followed=10,
+                        state=database_pb2.Follow.PENDING)
+
+        req = database_pb2.DbFollowRequest(
+            request_type=database_pb2.DbFollowRequest.FIND,
+            match=database_pb2.Follow(followed=10),
+            page_size=2,
+        )
+        pages = []
+        while True:
+            res = self.service.Follow(req, self.ctx)
+            self.assertNotEqual(res.result_type,
+                                database_pb2.DbFollowResponse.ERROR)
+            pages.append([f.follower for f in res.results])
+            if not res.next_page_token:
+                break
+            req.page_token = res.next_page_token
+        self.assertEqual(pages, [[5, 4], [3, 2], [1]])
@@ -0,0 +1,119 @@
+import unittest
+import logging
+import os
+import threading
+import time
+
+import database
+import ingest
+import view_servicer
+from services.proto import database_pb2
+
+INGEST_DB_PATH = "./testdb/ingest.db"
+INSERT_VIEW = 'INSERT INTO views (user_id, path, datetime) VALUES (?, ?, ?)'
+
+
+class BufferedInserterTest(unittest.TestCase):
+
+    def setUp(self):
+        def clean_database():
+            os.remove(INGEST_DB_PATH)
+
+        self.logger = logging.getLogger()
+        self.db = database.build_database(self.logger,
+                                          "rabble_schema.sql",
+                                          INGEST_DB_PATH)
+        self.addCleanup(clean_database)
+        self.addCleanup(self.db.close)
+
+    def inserter(self, **kwargs):
+        ins = ingest.BufferedInserter(
+            self.db, self.logger, 'views', INSERT_VIEW, **kwargs)
+        self.addCleanup(ins.close)
+        return ins
+
+    def count(self):
+        return self.db.execute('SELECT COUNT(*) FROM views')[0][0]
+
+    def wait_for(self, n):
+        deadline = time.monotonic() + 5
+        while self.count() < n and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.count()
+
+    def test_flushes_full_batches(self):
+        ins = self.inserter(flush_rows=10, flush_ms=60 * 1000)
+        for i in range(25):
+            self.assertTrue(ins.add((i, '/', 0)))
+        self.assertEqual(self.wait_for(20), 20)
+        ins.close()
+        self.assertEqual(self.count(), 25)
+        self.assertEqual(self.db._writer.batches, 3)
+
+    def test_flushes_after_interval(self):
+        ins = self.inserter(flush_rows=100, flush_ms=20)
+        ins.add((1, '/', 0))
+        self.assertEqual(self.wait_for(1), 1)
+        self.assertEqual(ins.written, 1)
+
+    def hold_writer(self):
+        # Keep the writer busy so rows pile up in the inserter's queue.
+        started = threading.Event()
+        release = threading.Event()
+
+        def block(tx):
+            started.set()
+            release.wait()
+        t = threading.Thread(target=self.db.write, args=(block,))
+        t.start()
+        started.wait()
+        return release, t
+
+    def fill(self, ins, n):
+        release, t = self.hold_writer()
+        # The first row is taken by the flush thread, which then waits on
+        # the writer, so the rest stay queued.
+        ins.add((0, '/first', 0))
+        deadline = time.monotonic() + 5
+        while ins._rows and time.monotonic() < deadline:
+            time.sleep(0.01)
+        results = [ins.add((i, '/', 0)) for i in range(1, n + 1)]
+        return results, release, t
+
+    def test_drop_newest(self):
+        ins = self.inserter(queue_size=2, flush_rows=1, flush_ms=0)
+        results, release, t = self.fill(ins, 3)
+        self.assertEqual(results, [True, True, False])
+        release.set()
+        t.join()
+        ins.close()
+        self.assertEqual(ins.dropped, 1)
+        users = [u for u, in self.db.execute(
+            'SELECT user_id FROM views ORDER BY user_id')]
+        self.assertEqual(users, [0, 1, 2])
+
+    def test_drop_oldest(self):
+        ins = self.inserter(queue_size=2, flush_rows=1, flush_ms=0,
+                            drop_policy=ingest.DROP_OLDEST)
+        results, release, t = self.fill(ins, 3)
+        self.assertEqual(results, [True, True, True])
+        release.set()
+        t.join()
+        ins.close()
+        self.assertEqual(ins.dropped, 1)
+        users = [u for u, in self.db.execute(
+            'SELECT user_id FROM views ORDER BY user_id')]
+        self.assertEqual(users, [0, 2, 3])
+
+    def test_bad_drop_policy(self):
+        with self.assertRaises(ValueError):
+            ingest.BufferedInserter(
+                self.db, self.logger, 'views', INSERT_VIEW,
+                drop_policy='sometimes')
+
+    def test_add_view(self):
+        views = view_servicer.ViewDatabaseServicer(self.db, self.logger)
+        views.AddView(database_pb2.View(user=3, path='#/about'), None)
+        views.close()
+        self.assertEqual(self.db.execute('SELECT user_id, path FROM views'),
+                         [(3, '#/about')])
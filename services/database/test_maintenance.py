@@ -0,0 +1,91 @@
+import unittest
+import logging
+import os
+
+import database
+import maintenance
+import maintenance_servicer
+import posts_servicer
+from services.proto import database_pb2
+
+MAINTENANCE_DB_PATH = "./testdb/maintenance.db"
+
+
+class MaintenanceTest(unittest.TestCase):
+
+    def setUp(self):
+        def clean_database():
+            os.remove(MAINTENANCE_DB_PATH)
+
+        self.logger = logging.getLogger()
+        self.db = database.build_database(self.logger,
+                                          "rabble_schema.sql",
+                                          MAINTENANCE_DB_PATH)
+        self.addCleanup(clean_database)
+        self.addCleanup(self.db.close)
+        self.scheduler = maintenance.Scheduler(self.db, self.logger)
+        self.posts = posts_servicer.PostsDatabaseServicer(self.db,
+                                                          self.logger)
+        self.servicer = maintenance_servicer.MaintenanceDatabaseServicer(
+            self.db, self.logger, self.scheduler)
+
+    def status(self, task=''):
+        res = self.servicer.MaintenanceStatus(
+            database_pb2.MaintenanceRequest(task=task), None)
+        self.assertEqual(res.result_type,
+                         database_pb2.MaintenanceResponse.OK)
+        return {t.name: t for t in res.tasks}
+
+    def test_tick_runs_due_tasks(self):
+        self.assertEqual(self.scheduler.tick(now=100),
+                         len(maintenance.default_tasks()))
+        status = self.status()
+        self.assertEqual(status['analyze'].runs, 1)
+        self.assertEqual(status['analyze'].last_run.seconds, 100)
+        self.assertEqual(status['users_idx_merge'].detail, 'no index')
+        self.assertEqual(self.scheduler.tick(now=101), 0)
+        self.assertEqual(self.scheduler.tick(now=100 + maintenance.HOUR), 4)
+
+    def test_busy_ticks_are_skipped(self):
+        scheduler = maintenance.Scheduler(self.db, self.logger,
+                                          max_pending_writes=-1)
+        self.assertEqual(scheduler.tick(), 0)
+
+    def test_merges_posts_index(self):
+        for i in range(50):
+            self.posts.Posts(database_pb2.PostsRequest(
+                request_type=database_pb2.PostsRequest.INSERT,
+                entry=database_pb2.PostsEntry(
+                    author_id=1, title='post %d' % i, body='some words'),
+            ), None)
+
+        def segments():
+            return self.db.execute(
+                'SELECT COUNT(*) FROM posts_idx_data')[0][0]
+        before = segments()
+        res = self.servicer.RunMaintenance(
+            database_pb2.MaintenanceRequest(task='posts_idx_merge'), None)
+        self.assertEqual(res.result_type,
+                         database_pb2.MaintenanceResponse.OK)
+        self.assertEqual(len(res.tasks), 1)
+        self.assertFalse(res.tasks[0].pending)
+        self.assertGreater(res.tasks[0].runs, 1)
+        self.assertLess(segments(), before)
+
+    def test_incremental_vacuum(self):
+        self.assertEqual(self.db.execute('PRAGMA auto_vacuum'), [(2,)])
+        self.db.execute('WITH RECURSIVE n(i) AS '
+                        '(SELECT 1 UNION ALL SELECT i + 1 FROM n '
+                        'WHERE i < 500) '
+                        'INSERT INTO logs (message, user_id, datetime) '
+                        'SELECT zeroblob(4000), 1, i FROM n')
+        self.db.execute('DELETE FROM logs')
+        self.assertGreater(self.db.execute('PRAGMA freelist_count')[0][0], 0)
+        self.scheduler.run('incremental_vacuum')
+        self.assertEqual(self.db.execute('PRAGMA freelist_count'), [(0,)])
+
+    def test_unknown_task(self):
+        res = self.servicer.RunMaintenance(
+            database_pb2.MaintenanceRequest(task='defrag'), None)
+        self.assertEqual(res.result_type,
+                         database_pb2.MaintenanceResponse.ERROR)
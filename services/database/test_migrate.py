@@ -0,0 +1,125 @@
+import unittest
+import logging
+import os
+import shutil
+import tempfile
+
+import database
+import migrate
+import posts_servicer
+from services.proto import database_pb2
+
+MIGRATE_DB_PATH = "./testdb/migrate.db"
+
+
+class MigrateTest(unittest.TestCase):
+
+    def setUp(self):
+        def clean_database():
+            os.remove(MIGRATE_DB_PATH)
+
+        self.logger = logging.getLogger()
+        self.addCleanup(clean_database)
+
+    def build(self, migrations_dir=None):
+        db = database.build_database(self.logger,
+                                     "rabble_schema.sql",
+                                     MIGRATE_DB_PATH,
+                                     migrations_dir=migrations_dir)
+        self.addCleanup(db.close)
+        return db
+
+    def plan(self, db, sql, *params):
+        res = db.execute('EXPLAIN QUERY PLAN ' + sql, *params)
+        return ' '.join(r[-1] for r in res)
+
+    def test_new_database_is_at_latest_version(self):
+        db = self.build()
+        latest = migrate.find_migrations('migrations')[-1][0]
+        self.assertEqual(migrate.current_version(db), latest)
+
+    def test_migrations_are_applied_once(self):
+        db = self.build()
+        db.close()
+        db = self.build()
+        versions = db.execute('SELECT version FROM schema_version')
+        self.assertEqual(len(versions), len({v for v, in versions}))
+
+    def test_existing_database_is_upgraded(self):
+        # Build an old database with none of the migrations applied and two
+        # copies of the same foreign article.
+        empty_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, empty_dir)
+        db = self.build(migrations_dir=empty_dir)
+        for _ in range(2):
+            db.execute('INSERT INTO posts (author_id, title, body, '
+                       'creation_datetime, md_body, ap_id, tags, summary) '
+                       'VALUES (1, "", "", 0, "", "https://a.b/1", "", "")')
+        db.execute('INSERT INTO likes (user_id, article_id) VALUES (1, 1)')
+        db.execute('INSERT INTO likes (user_id, article_id) VALUES (2, 2)')
+        db.execute('INSERT INTO likes (user_id, article_id) VALUES (1, 2)')
+        db.close()
+
+        db = self.build()
+        posts = db.execute('SELECT global_id, likes_count FROM posts')
+        self.assertEqual(posts, [(1, 2)])
+        likes = db.execute('SELECT user_id, article_id FROM likes '
+                           'ORDER BY user_id')
+        self.assertEqual(likes, [(1, 1), (2, 1)])
+
+    def test_hot_queries_use_indexes(self):
+        db = self.build()
+        self.assertIn('posts_ap_id_idx', self.plan(
+            db, "SELECT * FROM posts WHERE ap_id = ? AND ap_id != ''", 'x'))
+        self.assertIn('follows_followed_state_idx', self.plan(
+            db, 'SELECT * FROM follows WHERE followed = ? AND state = ?',
+            1, 0))
+        self.assertIn('likes_article_id_idx', self.plan(
+            db, 'SELECT user_id FROM likes WHERE article_id = ?', 1))
+        self.assertIn('shares_article_id_idx', self.plan(
+            db, 'SELECT user_id FROM shares WHERE article_id = ?', 1))
+        self.assertIn('posts_author_id_idx', self.plan(
+            db, 'SELECT * FROM posts WHERE author_id = ?', 1))
+
+    def test_find_by_ap_id(self):
+        db = self.build()
+        posts = posts_servicer.PostsDatabaseServicer(db, self.logger)
+        for ap_id in ('https://a.b/1', 'https://a.b/2', ''):
+            posts.Posts(database_pb2.PostsRequest(
+                request_type=database_pb2.PostsRequest.INSERT,
+                entry=database_pb2.PostsEntry(author_id=1, ap_id=ap_id),
+            ), None)
+        res = posts.Posts(database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.FIND,
+            match=database_pb2.PostsEntry(ap_id='https://a.b/2'),
+        ), None)
+        self.assertEqual(len(res.results), 1)
+        self.assertEqual(res.results[0].global_id, 2)
+        # A second copy of a foreign article is rejected.
+        res = posts.Posts(database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.INSERT,
+            entry=database_pb2.PostsEntry(author_id=1, ap_id='https://a.b/1'),
+        ), None)
+        self.assertEqual(res.result_type, database_pb2.PostsResponse.ERROR)
+
+    def test_old_search_index_is_replaced(self):
+        empty_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, empty_dir)
+        db = self.build(migrations_dir=empty_dir)
+        # The index CreatePostsIndex used to create.
+        db.execute_script(
+            'CREATE VIRTUAL TABLE posts_idx USING '
+            'fts5(title, body, content=posts, content_rowid=global_id);'
+            'CREATE TRIGGER posts_ai AFTER INSERT ON posts BEGIN '
+            'INSERT INTO posts_idx(rowid, title, body) '
+            'VALUES (new.global_id, new.title, new.body); END;')
+        db.execute('INSERT INTO posts (author_id, title, body, '
+                   'creation_datetime, md_body, ap_id, tags, summary) '
+                   'VALUES (1, "", "", 0, "", "", "hats", "")')
+        db.close()
+
+        db = self.build()
+        posts = posts_servicer.PostsDatabaseServicer(db, self.logger)
+        res = posts.SearchArticles(
+            database_pb2.DatabaseSearchRequest(query='hats'), None)
+        self.assertEqual([p.global_id for p in res.results], [1])
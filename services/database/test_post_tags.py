@@ -0,0 +1,112 @@
+import unittest
+import logging
+import os
+
+import database
+import posts_servicer
+import users_servicer
+from services.proto import database_pb2
+
+POST_TAGS_DB_PATH = "./testdb/post_tags.db"
+
+
+class PostTagsTest(unittest.TestCase):
+
+    def setUp(self):
+        def clean_database():
+            os.remove(POST_TAGS_DB_PATH)
+
+        self.logger = logging.getLogger()
+        self.db = database.build_database(self.logger,
+                                          "rabble_schema.sql",
+                                          POST_TAGS_DB_PATH)
+        self.addCleanup(clean_database)
+        self.addCleanup(self.db.close)
+        self.posts = posts_servicer.PostsDatabaseServicer(
+            self.db, self.logger)
+        self.users = users_servicer.UsersDatabaseServicer(
+            self.db, self.logger)
+        # User 2 is private.
+        for handle, private in (('open', False), ('hidden', True)):
+            entry = database_pb2.UsersEntry(handle=handle, host_is_null=True)
+            entry.private.value = private
+            self.users.Users(database_pb2.UsersRequest(
+                request_type=database_pb2.UsersRequest.INSERT, entry=entry,
+            ), None)
+
+    def post(self, tags, author_id=1):
+        res = self.posts.Posts(database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.INSERT,
+            entry=database_pb2.PostsEntry(author_id=author_id, tags=tags),
+        ), None)
+        self.assertEqual(res.result_type, database_pb2.PostsResponse.OK)
+        return res.global_id
+
+    def set_tags(self, global_id, tags):
+        res = self.posts.Posts(database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.UPDATE,
+            match=database_pb2.PostsEntry(global_id=global_id),
+            entry=database_pb2.PostsEntry(tags=tags),
+        ), None)
+        self.assertEqual(res.result_type, database_pb2.PostsResponse.OK)
+
+    def stats(self, names=(), num_tags=0):
+        res = self.posts.TagStats(database_pb2.TagStatsRequest(
+            names=names, num_tags=num_tags), None)
+        self.assertEqual(res.result_type, database_pb2.TagStatsResponse.OK)
+        return [(t.name, t.post_count) for t in res.tags]
+
+    def by_tag(self, tag, page_size=0, page_token=''):
+        res = self.posts.PostsByTag(database_pb2.PostsByTagRequest(
+            tag=tag, page_size=page_size, page_token=page_token), None)
+        self.assertEqual(res.result_type, database_pb2.PostsResponse.OK)
+        return res
+
+    def test_tags_follow_posts(self):
+        first = self.post('cats|dogs|a%7Cb')
+        second = self.post('dogs|dogs')
+        self.post('')
+        self.assertEqual(self.stats(),
+                         [('dogs', 2), ('a|b', 1), ('cats', 1)])
+        self.set_tags(first, 'cats')
+        self.assertEqual(self.stats(), [('dogs', 1), ('cats', 1)])
+        self.posts.SafeRemovePost(
+            database_pb2.PostsEntry(global_id=second), None)
+        self.assertEqual(self.stats(), [('cats', 1)])
+
+    def test_tag_stats(self):
+        for tags in ('a|b|c', 'b|c', 'c'):
+            self.post(tags)
+        self.assertEqual(self.stats(num_tags=2), [('c', 3), ('b', 2)])
+        self.assertEqual(self.stats(names=['a', 'c', 'nope']),
+                         [('c', 3), ('a', 1)])
+
+    def test_posts_by_tag(self):
+        ids = [self.post('cats') for _ in range(5)]
+        self.post('dogs')
+        self.post('cats', author_id=2)
+        seen = []
+        token = ''
+        while True:
+            res = self.by_tag('cats', page_size=2, page_token=token)
+            seen.extend(p.global_id for p in res.results)
+            token = res.next_page_token
+            if not token:
+                break
+        self.assertEqual(seen, list(reversed(ids)))
+        self.assertEqual(len(self.by_tag('nope').results), 0)
+
+    def test_stream_post_tags(self):
+        a = self.post('x|y|z')
+        b = self.post('y', author_id=2)
+        self.post('')
+        c = self.post('z|x')
+        names = {t.tag_id: t.name for t in self.posts.TagStats(
+            database_pb2.TagStatsRequest(), None).tags}
+        chunks = list(self.posts.StreamPostTags(
+            database_pb2.StreamRequest(chunk_size=2), None))
+        self.assertEqual([len(c.results) for c in chunks], [2, 1])
+        got = [(p.post_id, p.author_id, sorted(names[t] for t in p.tag_ids))
+               for c in chunks for p in c.results]
+        self.assertEqual(got, [(a, 1, ['x', 'y', 'z']), (b, 2, ['y']),
+                               (c, 1, ['x', 'z'])])
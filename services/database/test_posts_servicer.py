@@ -1,6 +1,7 @@
 import unittest
 import logging
 import os
+import sqlite3
 
 import posts_servicer
 import users_servicer
@@ -28,6 +29,7 @@ class PostsDatabaseHelper(unittest.TestCase):
                                           "rabble_schema.sql",
                                           POSTS_DB_PATH)
         self.addCleanup(clean_database)
+        self.addCleanup(self.db.close)
         self.posts = posts_servicer.PostsDatabaseServicer(self.db, logger)
         self.users = users_servicer.UsersDatabaseServicer(self.db, logger)
         self.like = like_servicer.LikeDatabaseServicer(self.db, logger)
@@ -307,3 +309,238 @@ class PostsDatabase(PostsDatabaseHelper):
         self.assertEqual(len(res.results), 2)
         self.assertIn(want0, res.results)
         self.assertIn(want1, res.results)
+
+    def test_instance_feed_pages(self):
+        self.add_user(handle='tayne', host=None)
+        for i in range(5):
+            self.add_post(author_id=1, title=str(i), body='for the boys')
+
+        req = database_pb2.InstanceFeedRequest(num_posts=2)
+        pages = []
+        while True:
+            res = self.posts.InstanceFeed(req, self.ctx)
+            self.assertNotEqual(res.result_type,
+                                database_pb2.PostsResponse.ERROR)
+            pages.append([p.global_id for p in res.results])
+            if not res.next_page_token:
+                break
+            req.page_token = res.next_page_token
+        self.assertEqual(pages, [[5, 4], [3, 2], [1]])
+
+    def test_find_pages(self):
+        self.add_user(handle='tayne', host=None)
+        self.add_user(handle='paul', host=None)
+        for i in range(5):
+            self.add_post(author_id=1 + i % 2, title=str(i), body='kissies')
+
+        req = database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.FIND,
+            match=database_pb2.PostsEntry(author_id=1),
+            page_size=2,
+        )
+        res = self.posts.Posts(req, self.ctx)
+        self.assertEqual([p.global_id for p in res.results], [5, 3])
+        self.assertNotEqual(res.next_page_token, '')
+        req.page_token = res.next_page_token
+        res = self.posts.Posts(req, self.ctx)
+        self.assertEqual([p.global_id for p in res.results], [1])
+        self.assertEqual(res.next_page_token, '')
+
+        # Without a filter every post is paged through.
+        req = database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.FIND,
+            page_size=4,
+        )
+        res = self.posts.Posts(req, self.ctx)
+        self.assertEqual([p.global_id for p in res.results], [5, 4, 3, 2])
+
+    def test_find_bad_page_token(self):
+        req = database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.FIND,
+            page_token='not a token',
+        )
+        res = self.posts.Posts(req, self.ctx)
+        self.assertEqual(res.result_type, database_pb2.PostsResponse.ERROR)
+
+    def test_stream_tagged_posts_matches_tagged_posts(self):
+        self.add_user(handle='tayne', host=None)
+        for i in range(5):
+            self.add_post(author_id=1, title=str(i), body='for the boys')
+        want = self.posts.TaggedPosts(database_pb2.PostsRequest(), self.ctx)
+        req = database_pb2.StreamRequest(chunk_size=2)
+        chunks = list(self.posts.StreamTaggedPosts(req, self.ctx))
+        self.assertEqual([2, 2, 1], [len(c.results) for c in chunks])
+        self.assertEqual(list(want.results),
+                         [p for c in chunks for p in c.results])
+
+    def test_batch_get_posts(self):
+        self.add_user(handle='tayne', host=None)
+        for i in range(3):
+            self.add_post(author_id=1, title=str(i), body='for the boys')
+        self.posts.Posts(database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.INSERT,
+            entry=database_pb2.PostsEntry(author_id=1, ap_id='https://a.b/1'),
+        ), self.ctx)
+        req = database_pb2.BatchGetPostsRequest(
+            global_ids=[3, 1, 99],
+            ap_ids=['https://a.b/1', ''],
+        )
+        res = self.posts.BatchGetPosts(req, self.ctx)
+        self.assertEqual(res.result_type, database_pb2.PostsResponse.OK)
+        self.assertEqual([1, 3, 4], sorted(p.global_id for p in res.results))
+
+    def test_batch_get_posts_flags(self):
+        self.add_user(handle='tayne', host=None)
+        self.add_user(handle='paul', host=None)
+        for i in range(3):
+            self.add_post(author_id=1 if i < 2 else 2, title=str(i))
+        self.add_like(liker_id=2, article_id=1)
+        self.db.execute('INSERT INTO shares (user_id, article_id, '
+                        'announce_datetime) VALUES (2, 2, 0)')
+        self.add_follow(2, 1)
+
+        def flags(user=None):
+            req = database_pb2.BatchGetPostsRequest(global_ids=[1, 2, 3])
+            if user is not None:
+                req.user_global_id.value = user
+            res = self.posts.BatchGetPosts(req, self.ctx)
+            self.assertEqual(res.result_type, database_pb2.PostsResponse.OK)
+            return sorted((p.global_id, p.is_liked, p.is_shared,
+                           p.is_followed) for p in res.results)
+        self.assertEqual(flags(2), [(1, True, False, True),
+                                    (2, False, True, True),
+                                    (3, False, False, False)])
+        self.assertEqual(flags(1), [(1, False, False, False),
+                                    (2, False, False, False),
+                                    (3, False, False, False)])
+        self.assertEqual(flags(), flags(1))
+
+    def test_batch_get_posts_flags_many_posts(self):
+        self.add_user(handle='tayne', host=None)
+        # More posts than fit in one flag query with three IN lists, each
+        # by a different author.
+        n = 400
+        for i in range(n):
+            self.add_post(author_id=i + 2, title=str(i))
+        self.add_like(liker_id=1, article_id=n)
+        self.add_follow(1, 2)
+        # Pin the 999-parameter limit of older SQLite builds, which
+        # util.MAX_BATCH_KEYS is sized for.
+        self.db._get_conn().setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER,
+                                     999)
+        req = database_pb2.BatchGetPostsRequest(
+            global_ids=range(1, n + 1))
+        req.user_global_id.value = 1
+        res = self.posts.BatchGetPosts(req, self.ctx)
+        self.assertEqual(res.result_type, database_pb2.PostsResponse.OK)
+        self.assertEqual(len(res.results), n)
+        self.assertEqual([p.global_id for p in res.results if p.is_liked],
+                         [n])
+        self.assertEqual([p.global_id for p in res.results if p.is_followed],
+                         [1])
+
+    def test_batch_insert_posts(self):
+        self.posts.Posts(database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.INSERT,
+            entry=database_pb2.PostsEntry(author_id=1, ap_id='https://a.b/1'),
+        ), self.ctx)
+        req = database_pb2.BatchInsertPostsRequest(entries=[
+            database_pb2.PostsEntry(author_id=2, title='new',
+                                    ap_id='https://a.b/2'),
+            database_pb2.PostsEntry(author_id=2, ap_id='https://a.b/1'),
+            database_pb2.PostsEntry(author_id=2, title='local'),
+            database_pb2.PostsEntry(author_id=2, title='also local'),
+            database_pb2.PostsEntry(author_id=2, ap_id='https://a.b/2'),
+        ])
+        res = self.posts.BatchInsertPosts(req, self.ctx)
+        self.assertEqual(res.result_type,
+                         database_pb2.BatchInsertPostsResponse.OK)
+        self.assertEqual(list(res.inserted),
+                         [True, False, True, True, False])
+        ids = list(res.global_ids)
+        # A skipped insert may still use up an id, so only the order of
+        # new ids is known.
+        self.assertEqual(ids[:2] + ids[4:], [2, 1, 2])
+        self.assertLess(2, ids[2])
+        self.assertLess(ids[2], ids[3])
+        found = self.posts.Posts(database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.FIND,
+            match=database_pb2.PostsEntry(global_id=2),
+        ), self.ctx)
+        self.assertEqual(found.results[0].title, 'new')
+        self.assertEqual(found.results[0].ap_id, 'https://a.b/2')
+
+    def random_posts(self, n, user_id):
+        res = self.posts.RandomPosts(database_pb2.RandomPostsRequest(
+            num_posts=n, user_id=user_id), self.ctx)
+        self.assertEqual(res.result_type, database_pb2.PostsResponse.OK)
+        return [p.global_id for p in res.results]
+
+    def test_random_posts_excludes_own_liked_and_shared(self):
+        self.add_user(handle='tayne', host=None)
+        self.add_user(handle='paul', host=None)
+        for i in range(10):
+            self.add_post(author_id=1 if i < 3 else 2, title=str(i))
+        self.posts.Posts(database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.DELETE,
+            match=database_pb2.PostsEntry(global_id=10),
+        ), self.ctx)
+        self.like.AddLike(database_pb2.LikeEntry(
+            user_id=1, article_id=4), self.ctx)
+        self.db.execute('INSERT INTO shares (user_id, article_id, '
+                        'announce_datetime) VALUES (1, 5, 0)')
+        for _ in range(5):
+            got = self.random_posts(3, 1)
+            self.assertEqual(len(got), 3)
+            self.assertEqual(len(set(got)), 3)
+            self.assertTrue(set(got) <= {6, 7, 8, 9})
+        self.assertEqual(sorted(self.random_posts(10, 1)), [6, 7, 8, 9])
+
+    def test_random_posts_empty_table(self):
+        self.assertEqual(self.random_posts(5, 1), [])
+
+    def search(self, query, **kwargs):
+        res = self.posts.SearchArticles(database_pb2.DatabaseSearchRequest(
+            query=query, **kwargs), self.ctx)
+        self.assertEqual(res.result_type, database_pb2.PostsResponse.OK)
+        return res
+
+    def test_search_ranks_title_matches_first(self):
+        self.add_user(handle='tayne', host=None)
+        self.add_post(author_id=1, title='other', body='a post about hats')
+        self.add_post(author_id=1, title='hats', body='nothing')
+        res = self.search('hat')
+        self.assertEqual([p.global_id for p in res.results], [2, 1])
+        self.assertEqual(res.results[1].body, 'a post about <b>hats</b>')
+        self.assertEqual(res.results[1].md_body, '')
+
+    def test_search_pages(self):
+        self.add_user(handle='tayne', host=None)
+        for i in range(5):
+            self.add_post(author_id=1, title=str(i), body='hats')
+        seen = []
+        req = {'num_responses': 2}
+        while True:
+            res = self.search('hats', **req)
+            seen += [p.global_id for p in res.results]
+            if not res.next_page_token:
+                break
+            req['page_token'] = res.next_page_token
+        self.assertEqual(sorted(seen), [1, 2, 3, 4, 5])
+
+    def test_search_index_follows_updates(self):
+        self.add_user(handle='tayne', host=None)
+        self.add_post(author_id=1, title='hats', body='')
+        self.posts.Posts(database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.UPDATE,
+            match=database_pb2.PostsEntry(global_id=1),
+            entry=database_pb2.PostsEntry(title='boots'),
+        ), self.ctx)
+        self.assertEqual(len(self.search('hats').results), 0)
+        self.assertEqual(len(self.search('boo').results), 1)
+
+    def test_search_ignores_query_syntax(self):
+        self.add_user(handle='tayne', host=None)
+        self.add_post(author_id=1, title='hats', body='')
+        self.assertEqual(len(self.search('hats" (').results), 1)
+        self.assertEqual(len(self.search('***').results), 0)
@@ -0,0 +1,138 @@
+import unittest
+import logging
+import os
+
+import database
+import follow_servicer
+import like_servicer
+import posts_servicer
+import purge
+import purge_servicer
+import share_servicer
+import users_servicer
+from services.proto import database_pb2
+
+PURGE_DB_PATH = "./testdb/purge.db"
+
+
+class PurgeTest(unittest.TestCase):
+
+    def setUp(self):
+        def clean_database():
+            os.remove(PURGE_DB_PATH)
+
+        logger = logging.getLogger()
+        self.db = database.build_database(logger,
+                                          "rabble_schema.sql",
+                                          PURGE_DB_PATH)
+        self.addCleanup(clean_database)
+        self.addCleanup(self.db.close)
+        self.posts = posts_servicer.PostsDatabaseServicer(self.db, logger)
+        self.users = users_servicer.UsersDatabaseServicer(self.db, logger)
+        self.likes = like_servicer.LikeDatabaseServicer(self.db, logger)
+        self.shares = share_servicer.ShareDatabaseServicer(self.db, logger)
+        self.follows = follow_servicer.FollowDatabaseServicer(
+            self.db, logger)
+        # Small batches, so every step takes more than one.
+        self.purge = purge_servicer.PurgeDatabaseServicer(
+            self.db, logger, self.users.cache, batch_rows=2)
+        # 1 and 3 are spammers on spam.example, 2 is local.
+        for handle, host in (('spam', 'spam.example'), ('local', None),
+                             ('more', 'spam.example')):
+            self.users.Users(database_pb2.UsersRequest(
+                request_type=database_pb2.UsersRequest.INSERT,
+                entry=database_pb2.UsersEntry(
+                    handle=handle, host=host or '',
+                    host_is_null=host is None),
+            ), None)
+        self.local_post = self.post(2, 'local words')
+        self.spam_posts = [self.post(1, 'spam words') for _ in range(5)]
+        self.post(3, 'more spam')
+        for user_id, article_id in ((2, self.spam_posts[0]),
+                                    (1, self.local_post)):
+            self.likes.AddLike(database_pb2.LikeEntry(
+                user_id=user_id, article_id=article_id), None)
+            self.shares.AddShare(database_pb2.ShareEntry(
+                user_id=user_id, article_id=article_id), None)
+        for follower, followed in ((1, 2), (2, 1), (3, 2)):
+            self.follows.Follow(database_pb2.DbFollowRequest(
+                request_type=database_pb2.DbFollowRequest.INSERT,
+                entry=database_pb2.Follow(follower=follower,
+                                          followed=followed),
+            ), None)
+
+    def post(self, author_id, title):
+        res = self.posts.Posts(database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.INSERT,
+            entry=database_pb2.PostsEntry(author_id=author_id, title=title,
+                                          tags='spam'),
+        ), None)
+        self.assertEqual(res.result_type, database_pb2.PostsResponse.OK)
+        return res.global_id
+
+    def count(self, sql, *params):
+        return self.db.execute('SELECT COUNT(*) ' + sql, *params)[0][0]
+
+    def find_user(self, global_id):
+        return self.users.Users(database_pb2.UsersRequest(
+            request_type=database_pb2.UsersRequest.FIND,
+            match=database_pb2.UsersEntry(global_id=global_id),
+        ), None).results
+
+    def test_purge_user(self):
+        self.assertEqual(len(self.find_user(1)), 1)
+        responses = list(self.purge.PurgeUser(
+            database_pb2.PurgeRequest(user_id=1), None))
+        self.assertGreater(len(responses), 5)
+        self.assertEqual([r.done for r in responses],
+                         [False] * (len(responses) - 1) + [True])
+        last = responses[-1]
+        self.assertEqual(last.result_type, database_pb2.PurgeResponse.OK)
+        self.assertEqual(
+            (last.users, last.posts, last.likes, last.shares, last.follows),
+            (1, 5, 2, 2, 2))
+        self.assertEqual(len(self.find_user(1)), 0)
+        self.assertEqual(self.count('FROM posts WHERE author_id = 1'), 0)
+        self.assertEqual(self.count('FROM likes'), 0)
+        self.assertEqual(self.count('FROM shares'), 0)
+        self.assertEqual(self.count('FROM follows'), 1)
+        self.assertEqual(self.count('FROM timeline'), 0)
+        local = self.posts.BatchGetPosts(database_pb2.BatchGetPostsRequest(
+            global_ids=[self.local_post]), None).results[0]
+        self.assertEqual((local.likes_count, local.shares_count), (0, 0))
+        stats = self.posts.TagStats(database_pb2.TagStatsRequest(), None)
+        self.assertEqual(stats.tags[0].post_count, 2)
+        found = self.posts.SearchArticles(
+            database_pb2.DatabaseSearchRequest(query='words'), None)
+        self.assertEqual([p.author_id for p in found.results], [2])
+
+    def test_purge_popular_post(self):
+        n = purge.DEFAULT_BATCH_ROWS + 100
+        self.db.write(lambda tx: tx.execute_many(
+            'INSERT INTO likes (user_id, article_id) VALUES (?, ?)',
+            [(100 + i, self.spam_posts[1]) for i in range(n)]))
+        servicer = purge_servicer.PurgeDatabaseServicer(
+            self.db, logging.getLogger(), self.users.cache)
+        responses = list(servicer.PurgeUser(
+            database_pb2.PurgeRequest(user_id=1), None))
+        self.assertEqual(responses[-1].likes, n + 2)
+        # No write deleted more than a batch of likes.
+        likes = [0] + [r.likes for r in responses]
+        self.assertLessEqual(max(b - a for a, b in zip(likes, likes[1:])),
+                             purge.DEFAULT_BATCH_ROWS)
+        self.assertEqual(self.count('FROM likes'), 0)
+
+    def test_purge_host(self):
+        responses = list(self.purge.PurgeHost(
+            database_pb2.PurgeRequest(host='spam.example'), None))
+        last = responses[-1]
+        self.assertTrue(last.done)
+        self.assertEqual((last.users, last.posts, last.follows), (2, 6, 3))
+        self.assertEqual(self.count('FROM users'), 1)
+        self.assertEqual(self.count('FROM posts'), 1)
+
+    def test_purge_needs_target(self):
+        for method in (self.purge.PurgeUser, self.purge.PurgeHost):
+            responses = list(method(database_pb2.PurgeRequest(), None))
+            self.assertEqual([r.result_type for r in responses],
+                             [database_pb2.PurgeResponse.ERROR])
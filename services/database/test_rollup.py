@@ -0,0 +1,95 @@
+import unittest
+import logging
+import os
+
+import database
+import rollup
+import rollup_servicer
+from services.proto import database_pb2
+
+ROLLUP_DB_PATH = "./testdb/rollup.db"
+NOW = 1000 * rollup.DAY
+
+
+class RollupTest(unittest.TestCase):
+
+    def setUp(self):
+        def clean_database():
+            os.remove(ROLLUP_DB_PATH)
+
+        self.logger = logging.getLogger()
+        self.db = database.build_database(self.logger,
+                                          "rabble_schema.sql",
+                                          ROLLUP_DB_PATH)
+        self.addCleanup(clean_database)
+        self.addCleanup(self.db.close)
+        self.rollups = rollup.Rollups(self.db, self.logger,
+                                      raw_retention_days=7,
+                                      hourly_retention_days=30)
+        self.servicer = rollup_servicer.RollupDatabaseServicer(
+            self.db, self.logger)
+
+    def add_view(self, path, user_id, datetime):
+        self.db.execute('INSERT INTO views (path, user_id, datetime) '
+                        'VALUES (?, ?, ?)', path, user_id, datetime)
+
+    def query(self, **kwargs):
+        res = self.servicer.Rollups(
+            database_pb2.RollupsRequest(**kwargs), None)
+        self.assertEqual(res.result_type, database_pb2.RollupsResponse.OK)
+        return [(r.bucket_start.seconds, r.path, r.user_id, r.count)
+                for r in res.results]
+
+    def test_views_are_bucketed(self):
+        self.add_view('/a', 1, NOW + 10)
+        self.add_view('/a', 1, NOW + 20)
+        self.add_view('/a', 2, NOW + rollup.HOUR + 5)
+        self.add_view('/b', 1, NOW + rollup.HOUR + 5)
+        self.assertEqual(self.rollups.run(NOW), (4, 0))
+        self.assertEqual(self.query(), [
+            (NOW, '/a', 1, 2),
+            (NOW + rollup.HOUR, '/a', 2, 1),
+            (NOW + rollup.HOUR, '/b', 1, 1),
+        ])
+        self.assertEqual(self.query(bucket=database_pb2.RollupsRequest.DAY,
+                                    path='/a'),
+                         [(NOW, '/a', 1, 2), (NOW, '/a', 2, 1)])
+
+    def test_runs_are_incremental(self):
+        self.add_view('/a', 1, NOW)
+        self.rollups.run(NOW)
+        self.add_view('/a', 1, NOW)
+        self.assertEqual(self.rollups.run(NOW), (1, 0))
+        self.assertEqual(self.query(), [(NOW, '/a', 1, 2)])
+
+    def test_retention(self):
+        old = NOW - 60 * rollup.DAY
+        self.add_view('/old', 1, old)
+        self.add_view('/new', 1, NOW)
+        self.db.execute('INSERT INTO logs (message, user_id, datetime) '
+                        'VALUES ("hi", 3, ?)', old)
+        self.assertEqual(self.rollups.run(NOW), (3, 2))
+        self.assertEqual(self.db.execute('SELECT path FROM views'),
+                         [('/new',)])
+        self.assertEqual(self.query(), [(NOW, '/new', 1, 1)])
+        self.assertEqual(self.query(bucket=database_pb2.RollupsRequest.DAY),
+                         [(old, '/old', 1, 1), (NOW, '/new', 1, 1)])
+        self.assertEqual(self.query(source=database_pb2.RollupsRequest.LOGS,
+                                    bucket=database_pb2.RollupsRequest.DAY,
+                                    user_id={'value': 3}),
+                         [(old, '', 3, 1)])
+
+    def test_rows_after_full_prune_are_rolled_up(self):
+        old = NOW - 60 * rollup.DAY
+        self.add_view('/a', 1, old)
+        self.add_view('/a', 1, old)
+        self.assertEqual(self.rollups.run(NOW), (2, 2))
+        self.assertEqual(self.db.execute('SELECT COUNT(*) FROM views'),
+                         [(0,)])
+        # New ids must still be above the last one rolled up.
+        self.add_view('/a', 1, old)
+        self.add_view('/b', 1, NOW)
+        self.assertEqual(self.rollups.run(NOW), (2, 1))
+        self.assertEqual(self.rollups.run(NOW), (0, 0))
+        self.assertEqual(self.query(bucket=database_pb2.RollupsRequest.DAY),
+                         [(old, '/a', 1, 3), (NOW, '/b', 1, 1)])
@@ -0,0 +1,97 @@
+import unittest
+import glob
+import logging
+import os
+
+import database
+import follow_servicer
+import snapshots
+import users_servicer
+from services.proto import database_pb2
+
+SNAPSHOTS_DB_PATH = "./testdb/snapshots.db"
+
+
+@unittest.skipUnless(snapshots.SUPPORTED, 'snapshots need Python 3.7')
+class SnapshotsTest(unittest.TestCase):
+
+    def setUp(self):
+        def clean_database():
+            os.remove(SNAPSHOTS_DB_PATH)
+
+        logger = logging.getLogger()
+        self.db = database.build_database(logger,
+                                          "rabble_schema.sql",
+                                          SNAPSHOTS_DB_PATH)
+        self.addCleanup(clean_database)
+        self.addCleanup(self.db.close)
+        self.snapshots = snapshots.Snapshots(self.db, logger)
+        self.addCleanup(self.snapshots.stop)
+        self.users = users_servicer.UsersDatabaseServicer(
+            self.db, logger, bulk_db=self.snapshots)
+        self.follows = follow_servicer.FollowDatabaseServicer(
+            self.db, logger, bulk_db=self.snapshots)
+
+    def add_user(self, handle):
+        res = self.users.Users(database_pb2.UsersRequest(
+            request_type=database_pb2.UsersRequest.INSERT,
+            entry=database_pb2.UsersEntry(handle=handle, host_is_null=True),
+        ), None)
+        self.assertEqual(res.result_type, database_pb2.UsersResponse.OK)
+
+    def all_handles(self):
+        res = self.users.AllUsers(database_pb2.AllUsersRequest(), None)
+        self.assertEqual(res.result_type, database_pb2.UsersResponse.OK)
+        return [u.handle for u in res.results]
+
+    def snapshot_files(self):
+        return glob.glob(SNAPSHOTS_DB_PATH + '.snapshot-*')
+
+    def test_reads_live_database_before_first_snapshot(self):
+        self.add_user('alice')
+        self.assertIsNone(self.snapshots.age())
+        self.assertEqual(self.all_handles(), ['alice'])
+
+    def test_bulk_reads_see_snapshot(self):
+        self.add_user('alice')
+        self.assertIsNotNone(self.snapshots.take())
+        self.add_user('bob')
+        self.assertEqual(self.all_handles(), ['alice'])
+        self.snapshots.take()
+        self.assertEqual(self.all_handles(), ['alice', 'bob'])
+
+    def test_point_reads_see_live_database(self):
+        self.snapshots.take()
+        self.follows.Follow(database_pb2.DbFollowRequest(
+            request_type=database_pb2.DbFollowRequest.INSERT,
+            entry=database_pb2.Follow(follower=1, followed=2),
+        ), None)
+        one = self.follows.Follow(database_pb2.DbFollowRequest(
+            request_type=database_pb2.DbFollowRequest.FIND,
+            match=database_pb2.Follow(follower=1),
+        ), None)
+        self.assertEqual(len(one.results), 1)
+        every = database_pb2.DbFollowRequest(
+            request_type=database_pb2.DbFollowRequest.FIND)
+        self.assertTrue(follow_servicer.is_full_scan(every))
+        self.assertEqual(len(self.follows.Follow(every, None).results), 0)
+
+    def test_replaced_snapshot_kept_until_read_finishes(self):
+        for i in range(5):
+            self.add_user('user{}'.format(i))
+        self.snapshots.take()
+        stream = self.users.StreamAllUsers(
+            database_pb2.StreamRequest(chunk_size=2), None)
+        first = next(stream)
+        self.snapshots.take()
+        self.assertEqual(len(self.snapshot_files()), 2)
+        rest = list(stream)
+        self.assertEqual(
+            sum(len(r.results) for r in [first] + rest), 5)
+        self.assertEqual(len(self.snapshot_files()), 1)
+
+    def test_stop_removes_snapshot(self):
+        self.snapshots.take()
+        self.assertEqual(len(self.snapshot_files()), 1)
+        self.snapshots.stop()
+        self.assertEqual(self.snapshot_files(), [])
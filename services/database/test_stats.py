@@ -0,0 +1,140 @@
+import unittest
+import collections
+import logging
+import os
+
+import grpc
+
+import database
+import stats
+import stats_servicer
+import usercache
+import util
+from services.proto import database_pb2
+
+STATS_DB_PATH = "./testdb/stats.db"
+
+HandlerCallDetails = collections.namedtuple(
+    'HandlerCallDetails', ('method', 'invocation_metadata'))
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_percentiles(self):
+        hist = stats.Histogram()
+        for ms in [0.3] * 90 + [7] * 9 + [300]:
+            hist.add(ms)
+        self.assertEqual(hist.count, 100)
+        # Estimates are the upper bound of the bucket.
+        self.assertEqual(hist.percentile(50), 0.5)
+        self.assertEqual(hist.percentile(95), 10)
+        self.assertEqual(hist.percentile(99), 10)
+        self.assertEqual(hist.percentile(100), 300)
+        self.assertEqual(hist.max, 300)
+
+    def test_empty(self):
+        self.assertEqual(stats.Histogram().percentile(99), 0)
+
+    def test_normalize(self):
+        self.assertEqual(
+            stats.normalize('SELECT  *\n FROM posts WHERE id IN (?, ?,?)'),
+            'SELECT * FROM posts WHERE id IN (?, ...)')
+
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self):
+        def clean_database():
+            os.remove(STATS_DB_PATH)
+
+        self.logger = logging.getLogger()
+        self.stats = stats.Stats(self.logger, slow_query_ms=1000)
+        self.db = database.build_database(self.logger,
+                                          "rabble_schema.sql",
+                                          STATS_DB_PATH,
+                                          stats=self.stats)
+        self.addCleanup(clean_database)
+        self.addCleanup(self.db.close)
+        self.servicer = stats_servicer.StatsDatabaseServicer(
+            self.db, self.logger, self.stats)
+        self.interceptor = stats.StatsInterceptor(self.stats)
+
+    def intercept(self, method, behavior):
+        handler = self.interceptor.intercept_service(
+            lambda details: grpc.unary_unary_rpc_method_handler(behavior),
+            HandlerCallDetails('/database.Database/' + method, ()))
+        return handler.unary_unary
+
+    def get_stats(self):
+        res = self.servicer.DatabaseStats(
+            database_pb2.DatabaseStatsRequest(reset=True), None)
+        self.assertEqual(res.result_type,
+                         database_pb2.DatabaseStatsResponse.OK)
+        return res
+
+    def test_statements_are_attributed_to_rpcs(self):
+        self.get_stats()
+
+        def add_logs(req, context):
+            for message in ('a', 'b', 'c'):
+                self.db.write(lambda tx: tx.execute_count(
+                    'INSERT INTO logs (message, user_id, datetime) '
+                    'VALUES (?, 1, 0)', message))
+            self.db.execute('SELECT * FROM logs WHERE id IN ({})'
+                            .format(util.placeholders(2)), 1, 2)
+            self.db.execute('SELECT * FROM logs WHERE id IN ({})'
+                            .format(util.placeholders(3)), 1, 2, 3)
+            return database_pb2.AddLogResponse()
+        self.intercept('AddLogs', add_logs)(None, None)
+
+        res = self.get_stats()
+        self.assertEqual(len(res.rpcs), 1)
+        rpc = res.rpcs[0]
+        self.assertEqual(rpc.method, 'AddLogs')
+        self.assertEqual(rpc.latency.count, 1)
+        self.assertEqual(rpc.errors, 0)
+        self.assertEqual(rpc.max_statements, 5)
+        self.assertEqual(rpc.rows, 3 + 2 + 3)
+        statements = {s.statement: s for s in res.statements}
+        select = statements['SELECT * FROM logs WHERE id IN (?, ...)']
+        self.assertEqual(select.latency.count, 2)
+        self.assertEqual(select.rows, 5)
+
+    def test_errors_are_counted(self):
+        self.get_stats()
+
+        def fail(req, context):
+            return database_pb2.UsersResponse(
+                result_type=database_pb2.UsersResponse.ERROR)
+        self.intercept('Users', fail)(None, None)
+        self.assertEqual(self.get_stats().rpcs[0].errors, 1)
+
+    def test_slow_queries_are_logged_with_plan(self):
+        self.stats = stats.Stats(self.logger, slow_query_ms=0)
+        self.db._stats = self.stats
+        with self.assertLogs(self.logger, logging.WARNING) as logs:
+            self.db.execute('SELECT * FROM users WHERE handle = ?', 'a')
+        self.assertIn('Slow query in background', logs.output[0])
+        self.assertIn('SEARCH users', logs.output[0])
+
+    def test_cache_hit_rate(self):
+        cache = usercache.UserCache()
+        cache.put((1, 'a', None), cache.token())
+        for global_id in (1, 1, 1, 2):
+            cache.get_by_id(global_id)
+        servicer = stats_servicer.StatsDatabaseServicer(
+            self.db, self.logger, self.stats, caches={'users': cache})
+        res = servicer.DatabaseStats(database_pb2.DatabaseStatsRequest(),
+                                     None)
+        self.assertEqual(len(res.caches), 1)
+        self.assertEqual(res.caches[0].name, 'users')
+        self.assertEqual(res.caches[0].hit_rate, 0.75)
+        self.assertEqual(res.caches[0].size, 1)
+
+    def test_not_recording(self):
+        servicer = stats_servicer.StatsDatabaseServicer(
+            self.db, self.logger, None)
+        res = servicer.DatabaseStats(database_pb2.DatabaseStatsRequest(),
+                                     None)
+        self.assertEqual(res.result_type,
+                         database_pb2.DatabaseStatsResponse.ERROR)
@@ -0,0 +1,242 @@
+import unittest
+import logging
+import os
+
+import database
+import follow_servicer
+import maintenance
+import posts_servicer
+import share_servicer
+import users_servicer
+from services.proto import database_pb2
+
+TIMELINE_DB_PATH = "./testdb/timeline.db"
+
+
+class TimelineTest(unittest.TestCase):
+
+    def setUp(self):
+        def clean_database():
+            os.remove(TIMELINE_DB_PATH)
+
+        self.logger = logging.getLogger()
+        self.db = database.build_database(self.logger,
+                                          "rabble_schema.sql",
+                                          TIMELINE_DB_PATH)
+        self.addCleanup(clean_database)
+        self.addCleanup(self.db.close)
+        self.posts = posts_servicer.PostsDatabaseServicer(
+            self.db, self.logger)
+        self.users = users_servicer.UsersDatabaseServicer(
+            self.db, self.logger)
+        self.follows = follow_servicer.FollowDatabaseServicer(
+            self.db, self.logger)
+        self.shares = share_servicer.ShareDatabaseServicer(
+            self.db, self.logger)
+        # 1 and 2 are local, 3 is on another instance.
+        for handle, host in (('reader', None), ('writer', None),
+                             ('remote', 'b.c')):
+            self.users.Users(database_pb2.UsersRequest(
+                request_type=database_pb2.UsersRequest.INSERT,
+                entry=database_pb2.UsersEntry(
+                    handle=handle, host=host or '',
+                    host_is_null=host is None),
+            ), None)
+
+    def follow(self, follower, followed, state=database_pb2.Follow.ACTIVE):
+        res = self.follows.Follow(database_pb2.DbFollowRequest(
+            request_type=database_pb2.DbFollowRequest.INSERT,
+            entry=database_pb2.Follow(follower=follower, followed=followed,
+                                      state=state),
+        ), None)
+        self.assertEqual(res.result_type, database_pb2.DbFollowResponse.OK)
+
+    def set_state(self, follower, followed, state):
+        res = self.follows.Follow(database_pb2.DbFollowRequest(
+            request_type=database_pb2.DbFollowRequest.UPDATE,
+            match=database_pb2.Follow(follower=follower, followed=followed),
+            entry=database_pb2.Follow(state=state),
+        ), None)
+        self.assertEqual(res.result_type, database_pb2.DbFollowResponse.OK)
+
+    def post(self, author_id, created):
+        entry = database_pb2.PostsEntry(author_id=author_id,
+                                        title='at {}'.format(created))
+        entry.creation_datetime.seconds = created
+        res = self.posts.Posts(database_pb2.PostsRequest(
+            request_type=database_pb2.PostsRequest.INSERT, entry=entry,
+        ), None)
+        self.assertEqual(res.result_type, database_pb2.PostsResponse.OK)
+        return res.global_id
+
+    def share(self, user_id, article_id, at):
+        entry = database_pb2.ShareEntry(user_id=user_id,
+                                        article_id=article_id)
+        entry.announce_datetime.seconds = at
+        self.shares.AddShare(entry, None)
+
+    def timeline(self, user_id, page_size=0, page_token=''):
+        res = self.posts.UserTimeline(database_pb2.UserTimelineRequest(
+            user_id=user_id, page_size=page_size, page_token=page_token,
+        ), None)
+        self.assertEqual(res.result_type,
+                         database_pb2.UserTimelineResponse.OK)
+        return res
+
+    def items(self, user_id):
+        return [(i.post.global_id, i.reason, i.actor_id, i.timestamp.seconds)
+                for i in self.timeline(user_id).items]
+
+    def test_posts_fan_out_to_local_followers(self):
+        self.follow(1, 2)
+        self.follow(3, 2)
+        first = self.post(2, 100)
+        second = self.post(2, 200)
+        self.post(1, 300)
+        self.assertEqual(self.items(1), [
+            (second, database_pb2.TimelineItem.POSTED, 2, 200),
+            (first, database_pb2.TimelineItem.POSTED, 2, 100),
+        ])
+        self.assertEqual(self.items(3), [])
+
+    def test_share_moves_post_up(self):
+        self.follow(1, 2)
+        self.follow(1, 3)
+        old = self.post(2, 100)
+        new = self.post(2, 200)
+        self.share(3, old, 300)
+        self.assertEqual(self.items(1), [
+            (old, database_pb2.TimelineItem.SHARED, 3, 300),
+            (new, database_pb2.TimelineItem.POSTED, 2, 200),
+        ])
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        post = self.post(2, 100)
+        self.follow(1, 2, database_pb2.Follow.PENDING)
+        self.assertEqual(self.items(1), [])
+        self.set_state(1, 2, database_pb2.Follow.ACTIVE)
+        self.assertEqual([i[0] for i in self.items(1)], [post])
+        self.set_state(1, 2, database_pb2.Follow.REJECTED)
+        self.assertEqual(self.items(1), [])
+
+    def unshare(self, user_id, article_id):
+        self.db.write(lambda tx: tx.execute(
+            'DELETE FROM shares WHERE user_id = ? AND article_id = ?',
+            user_id, article_id))
+
+    def test_unshare_keeps_post_still_followed(self):
+        self.follow(1, 2)
+        self.follow(1, 3)
+        post = self.post(2, 100)
+        self.share(3, post, 300)
+        self.unshare(3, post)
+        self.assertEqual(self.items(1), [
+            (post, database_pb2.TimelineItem.POSTED, 2, 100),
+        ])
+        self.share(3, post, 300)
+        self.share(2, post, 200)
+        self.unshare(3, post)
+        self.assertEqual(self.items(1), [
+            (post, database_pb2.TimelineItem.SHARED, 2, 200),
+        ])
+        self.assertEqual(self.home_feed_items(1), self.items(1))
+
+    def test_unfollow_keeps_post_shared_by_other_followed(self):
+        self.follow(1, 2)
+        self.follow(1, 3)
+        post = self.post(2, 100)
+        other = self.post(2, 150)
+        self.share(3, post, 50)
+        self.set_state(1, 2, database_pb2.Follow.REJECTED)
+        self.assertEqual(self.items(1), [
+            (post, database_pb2.TimelineItem.SHARED, 3, 50),
+        ])
+        self.assertEqual(self.home_feed_items(1), self.items(1))
+        self.set_state(1, 2, database_pb2.Follow.ACTIVE)
+        self.share(2, other, 400)
+        self.share(3, other, 200)
+        self.follows.Follow(database_pb2.DbFollowRequest(
+            request_type=database_pb2.DbFollowRequest.DELETE,
+            match=database_pb2.Follow(follower=1, followed=2),
+        ), None)
+        self.assertEqual(self.items(1), [
+            (other, database_pb2.TimelineItem.SHARED, 3, 200),
+            (post, database_pb2.TimelineItem.SHARED, 3, 50),
+        ])
+        self.assertEqual(self.home_feed_items(1), self.items(1))
+
+    def test_deleted_post_leaves_timeline(self):
+        self.follow(1, 2)
+        post = self.post(2, 100)
+        self.posts.SafeRemovePost(database_pb2.PostsEntry(global_id=post),
+                                  None)
+        self.assertEqual(self.items(1), [])
+
+    def test_pages(self):
+        self.follow(1, 2)
+        # Two posts at the same time, to check ties are paged by id.
+        ids = [self.post(2, t) for t in (100, 200, 200, 300, 400)]
+        seen = []
+        token = ''
+        while True:
+            res = self.timeline(1, page_size=2, page_token=token)
+            seen.extend(i.post.global_id for i in res.items)
+            token = res.next_page_token
+            if not token:
+                break
+        self.assertEqual(seen, [ids[4], ids[3], ids[2], ids[1], ids[0]])
+
+    def test_bad_page_token(self):
+        res = self.posts.UserTimeline(database_pb2.UserTimelineRequest(
+            user_id=1, page_token='nope'), None)
+        self.assertEqual(res.result_type,
+                         database_pb2.UserTimelineResponse.ERROR)
+
+    def home_feed(self, user_id, page_size):
+        items = []
+        token = ''
+        while True:
+            res = self.posts.HomeFeed(database_pb2.UserTimelineRequest(
+                user_id=user_id, page_size=page_size, page_token=token,
+            ), None)
+            self.assertEqual(res.result_type,
+                             database_pb2.UserTimelineResponse.OK)
+            items.extend(res.items)
+            token = res.next_page_token
+            if not token:
+                return items
+
+    def home_feed_items(self, user_id):
+        return [(i.post.global_id, i.reason, i.actor_id, i.timestamp.seconds)
+                for i in self.home_feed(user_id, 20)]
+
+    def test_home_feed_matches_timeline(self):
+        self.follow(1, 2)
+        self.follow(1, 3)
+        old = self.post(2, 100)
+        self.post(2, 200)
+        self.post(3, 150)
+        self.post(1, 250)
+        self.share(3, old, 300)
+        self.share(2, old, 50)
+        expected = self.items(1)
+        self.assertEqual(len(expected), 3)
+        for page_size in (1, 2, 20):
+            items = self.home_feed(1, page_size)
+            self.assertEqual(
+                [(i.post.global_id, i.reason, i.actor_id,
+                  i.timestamp.seconds) for i in items], expected)
+        self.assertTrue(all(i.post.is_followed for i in items))
+        self.assertEqual(self.home_feed(2, 20), [])
+
+    def test_trim(self):
+        self.follow(1, 2)
+        ids = [self.post(2, t) for t in range(100, 110)]
+        scheduler = maintenance.Scheduler(
+            self.db, self.logger, tasks=maintenance.default_tasks(
+                timeline_length=3))
+        scheduler.run('timeline_trim')
+        self.assertEqual([i[0] for i in self.items(1)],
+                         list(reversed(ids[-3:])))
+        task = scheduler.tasks('timeline_trim')[0]
+        self.assertEqual(task.detail, 'removed 7 items from 2 timelines')
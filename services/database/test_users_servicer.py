@@ -1,6 +1,7 @@
 import unittest
 import logging
 import os
+import struct
 
 import posts_servicer
 import users_servicer
@@ -28,6 +29,7 @@ class UsersDatabaseHelper(unittest.TestCase):
                                           "rabble_schema.sql",
                                           USERS_DB_PATH)
         self.addCleanup(clean_database)
+        self.addCleanup(self.db.close)
         self.posts = posts_servicer.PostsDatabaseServicer(self.db, logger)
         self.users = users_servicer.UsersDatabaseServicer(self.db, logger)
         self.like = like_servicer.LikeDatabaseServicer(self.db, logger)
@@ -76,3 +78,145 @@ class UsersDatabase(UsersDatabaseHelper):
         self.add_user(handle='gerry adams', host=None)
         res = self.all_users()
         self.assertEqual(3, len(res.results))
+
+    def test_stream_all_users(self):
+        for i in range(5):
+            self.add_user(handle='user{}'.format(i))
+        req = database_pb2.StreamRequest(chunk_size=2)
+        chunks = list(self.users.StreamAllUsers(req, self.ctx))
+        self.assertEqual([2, 2, 1], [len(c.results) for c in chunks])
+        handles = [u.handle for c in chunks for u in c.results]
+        self.assertEqual(['user{}'.format(i) for i in range(5)], handles)
+
+    def test_stream_all_user_likes(self):
+        self.add_user(handle='a')
+        self.add_user(handle='b', host='remote.com')
+        self.add_user(handle='c')
+        for article_id in (3, 1):
+            self.like.AddLike(database_pb2.LikeEntry(
+                user_id=1, article_id=article_id), self.ctx)
+        self.like.AddLike(database_pb2.LikeEntry(
+            user_id=3, article_id=2), self.ctx)
+        req = database_pb2.StreamRequest(chunk_size=2)
+        chunks = list(self.users.StreamAllUserLikes(req, self.ctx))
+        self.assertEqual([2, 1], [len(c.results) for c in chunks])
+        got = [(u.global_id, u.host_is_null, u.likes)
+               for c in chunks for u in c.results]
+        self.assertEqual([(1, True, '1,3'), (2, False, ''), (3, True, '2')],
+                         got)
+
+    def test_stream_all_user_likes_packed(self):
+        self.add_user(handle='a')
+        self.add_user(handle='b')
+        for article_id in (2 ** 40, 7, 3):
+            self.like.AddLike(database_pb2.LikeEntry(
+                user_id=1, article_id=article_id), self.ctx)
+        req = database_pb2.StreamRequest(packed_likes=True)
+        users = [u for c in self.users.StreamAllUserLikes(req, self.ctx)
+                 for u in c.results]
+        self.assertEqual([u.likes for u in users], ['', ''])
+        self.assertEqual([u.liked_ids for u in users], [
+            struct.pack('<3q', 3, 7, 2 ** 40), b''])
+
+    def test_batch_get_users(self):
+        self.add_user(handle='a')
+        self.add_user(handle='b', host='remote.com')
+        self.add_user(handle='a', host='remote.com')
+        req = database_pb2.BatchGetUsersRequest(
+            global_ids=[3, 1, 1, 42],
+            handles=[database_pb2.UsersEntry(handle='b', host='remote.com'),
+                     database_pb2.UsersEntry(handle='a')],
+        )
+        res = self.users.BatchGetUsers(req, self.ctx)
+        self.assertEqual(res.result_type, database_pb2.UsersResponse.OK)
+        got = sorted((u.global_id, u.handle, u.host) for u in res.results)
+        self.assertEqual([(1, 'a', ''), (2, 'b', 'remote.com'),
+                          (3, 'a', 'remote.com')], got)
+
+    def test_batch_get_users_many_keys(self):
+        for i in range(3):
+            self.add_user(handle='user{}'.format(i))
+        req = database_pb2.BatchGetUsersRequest(
+            global_ids=range(1, 2000))
+        res = self.users.BatchGetUsers(req, self.ctx)
+        self.assertEqual(3, len(res.results))
+
+    def find_user(self, user_global_id=None, **match):
+        req = database_pb2.UsersRequest(
+            request_type=database_pb2.UsersRequest.FIND,
+            match=database_pb2.UsersEntry(**match),
+        )
+        if user_global_id is not None:
+            req.user_global_id.value = user_global_id
+        res = self.users.Users(req, self.ctx)
+        self.assertEqual(res.result_type, database_pb2.UsersResponse.OK)
+        return res.results
+
+    def test_find_user_is_cached(self):
+        self.add_user(handle='a', host='remote.com')
+        self.assertEqual(self.find_user(global_id=1)[0].handle, 'a')
+        self.assertEqual(self.users.cache.misses, 1)
+        self.assertEqual(
+            self.find_user(handle='a', host='remote.com')[0].global_id, 1)
+        self.assertEqual(self.find_user(global_id=1)[0].host, 'remote.com')
+        self.assertEqual(self.users.cache.hits, 2)
+        self.assertEqual(len(self.find_user(global_id=2)), 0)
+        self.assertEqual(len(self.find_user(handle='a', host_is_null=True)),
+                         0)
+
+    def test_cached_user_is_invalidated(self):
+        self.add_user(handle='a')
+        self.find_user(handle='a', host_is_null=True)
+        res = self.users.Users(database_pb2.UsersRequest(
+            request_type=database_pb2.UsersRequest.UPDATE,
+            match=database_pb2.UsersEntry(handle='a', host_is_null=True),
+            entry=database_pb2.UsersEntry(bio='new bio'),
+        ), self.ctx)
+        self.assertEqual(res.result_type, database_pb2.UsersResponse.OK)
+        self.assertEqual(self.find_user(global_id=1)[0].bio, 'new bio')
+        self.users.Users(database_pb2.UsersRequest(
+            request_type=database_pb2.UsersRequest.DELETE,
+            entry=database_pb2.UsersEntry(global_id=1),
+        ), self.ctx)
+        self.assertEqual(len(self.find_user(global_id=1)), 0)
+        self.assertEqual(len(self.find_user(handle='a', host_is_null=True)),
+                         0)
+
+    def test_cached_user_is_followed(self):
+        self.add_user(handle='a')
+        self.add_user(handle='b')
+        self.assertFalse(self.find_user(user_global_id=2,
+                                        global_id=1)[0].is_followed)
+        self.follow.Follow(database_pb2.DbFollowRequest(
+            request_type=database_pb2.DbFollowRequest.INSERT,
+            entry=database_pb2.Follow(follower=2, followed=1),
+        ), self.ctx)
+        self.assertTrue(self.find_user(user_global_id=2,
+                                       global_id=1)[0].is_followed)
+        self.assertFalse(self.find_user(user_global_id=3,
+                                        global_id=1)[0].is_followed)
+        self.assertFalse(self.find_user(global_id=1)[0].is_followed)
+        self.assertEqual(self.users.cache.misses, 1)
+
+    def test_stale_rows_are_not_cached(self):
+        cache = self.users.cache
+        self.add_user(handle='a')
+        token = cache.token()
+        row = self.db.execute('SELECT global_id, handle, host FROM users')[0]
+        cache.invalidate(global_ids=[1])
+        cache.put(row, token)
+        self.assertIsNone(cache.get_by_id(1))
+        cache.put(row, cache.token())
+        self.assertEqual(cache.get_by_handle('a', None), row)
+
+    def test_cache_evicts_least_recently_used(self):
+        users = users_servicer.UsersDatabaseServicer(
+            self.db, logging.getLogger(), cache_size=2)
+        cache = users.cache
+        for i in (1, 2, 3):
+            cache.put((i, 'user{}'.format(i), None), cache.token())
+            cache.get_by_id(1)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.get_by_handle('user2', None))
+        self.assertIsNotNone(cache.get_by_id(1))
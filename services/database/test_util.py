@@ -142,3 +142,61 @@ class UtilTest(unittest.TestCase):
         clause, vals = util.entry_to_update(entry, deferred=d)
         self.assertIn('title = ?', clause)
         self.assertIn("Megolavania", vals)
+
+    def test_page_token_round_trip(self):
+        token = util.encode_page_token(1234)
+        self.assertEqual(util.decode_page_token(token), 1234)
+
+    def test_bad_page_token(self):
+        with self.assertRaises(util.InvalidPageToken):
+            util.decode_page_token('hello')
+        with self.assertRaises(util.InvalidPageToken):
+            util.decode_page_token(util.encode_page_token('abc'))
+
+    def test_keyset_filter(self):
+        token = util.encode_page_token(10)
+        clause, vals = util.keyset_filter('title = ?', ['a'], 'id', token)
+        self.assertEqual(clause, 'title = ? AND id < ?')
+        self.assertEqual(vals, ['a', 10])
+        clause, vals = util.keyset_filter('', [], 'id', '')
+        self.assertEqual(clause, '')
+
+    def test_split_page(self):
+        rows, token = util.split_page([(3,), (2,), (1,)], 2, lambda r: r[0])
+        self.assertEqual(rows, [(3,), (2,)])
+        self.assertEqual(util.decode_page_token(token), 2)
+        rows, token = util.split_page([(3,), (2,)], 2, lambda r: r[0])
+        self.assertEqual(token, '')
+
+    def test_filter_plan_is_reused(self):
+        util.clear_plan_cache()
+        a, a_vals = util.equivalent_filter(
+            database_pb2.PostsEntry(title="a", body="b"))
+        b, b_vals = util.equivalent_filter(
+            database_pb2.PostsEntry(title="c", body="d"))
+        self.assertIs(a, b)
+        self.assertEqual(a_vals, ["a", "b"])
+        self.assertEqual(b_vals, ["c", "d"])
+        c, _ = util.equivalent_filter(database_pb2.PostsEntry(title="e"))
+        self.assertEqual(c, "title = ?")
+
+    def test_filter_plan_runs_deferred_each_time(self):
+        d = {'body': lambda entry, comp:
+             ("", util.DONT_USE_FIELD) if entry.body == "skip"
+             else ("body" + comp, entry.body.upper())}
+        clause, vals = util.equivalent_filter(
+            database_pb2.PostsEntry(title="a", body="b"), deferred=d)
+        self.assertEqual(clause, "title = ? AND body = ?")
+        self.assertEqual(vals, ["a", "B"])
+        clause, vals = util.equivalent_filter(
+            database_pb2.PostsEntry(title="a", body="skip"), deferred=d)
+        self.assertEqual(clause, "title = ?")
+        self.assertEqual(vals, ["a"])
+
+    def test_filter_defaults_line_up_with_deferred(self):
+        entry = database_pb2.PostsEntry(title="Despacito", body="nice")
+        d = {'body': lambda entry, comp: ("body" + comp, True)}
+        de = [('body', False), ('md_body', "")]
+        clause, vals = util.equivalent_filter(entry, defaults=de, deferred=d)
+        self.assertEqual(clause, "title = ? AND body = ? AND md_body = ?")
+        self.assertEqual(vals, ["Despacito", True, ""])
@@ -0,0 +1,100 @@
+import collections
+import threading
+
+# Users kept in the cache. Each is a few hundred bytes plus its keys.
+DEFAULT_SIZE = 10000
+
+
+class UserCache:
+    """
+    UserCache is an LRU cache of users rows, looked up by global_id or by
+    (handle, host).
+
+    Rows are cached as they are in the users table; anything that depends on
+    who is asking, like is_followed, has to be looked up separately.
+
+    A row read from the database may be stale by the time it is put in the
+    cache if the user is changed in between. To avoid caching it, get a
+    token before reading and pass it to put, which drops the row if anything
+    was invalidated since.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self._size = size
+        self._lock = threading.Lock()
+        # global_id -> row, least recently used first.
+        self._rows = collections.OrderedDict()
+        # (handle, host) -> global_id
+        self._handles = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _get(self, global_id):
+        row = self._rows.get(global_id)
+        if row is None:
+            self.misses += 1
+            return None
+        self._rows.move_to_end(global_id)
+        self.hits += 1
+        return row
+
+    def get_by_id(self, global_id):
+        with self._lock:
+            return self._get(global_id)
+
+    def get_by_handle(self, handle, host):
+        with self._lock:
+            global_id = self._handles.get((handle, host))
+            if global_id is None:
+                self.misses += 1
+                return None
+            return self._get(global_id)
+
+    def token(self):
+        return self._generation
+
+    def put(self, row, token):
+        """put caches a users row, whose first three columns are global_id,
+        handle and host, unless it was invalidated after token was taken."""
+        if self._size <= 0:
+            return
+        global_id, handle, host = row[:3]
+        with self._lock:
+            if token != self._generation:
+                return
+            self._rows[global_id] = row
+            self._rows.move_to_end(global_id)
+            self._handles[(handle, host)] = global_id
+            while len(self._rows) > self._size:
+                _, old = self._rows.popitem(last=False)
+                self._handles.pop((old[1], old[2]), None)
+                self.evictions += 1
+
+    def invalidate(self, global_ids=(), handles=()):
+        """
+        invalidate removes users by global_id and (handle, host). Call it
+        after the change to those users is committed.
+        """
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            for global_id in global_ids:
+                row = self._rows.pop(global_id, None)
+                if row is not None:
+                    self._handles.pop((row[1], row[2]), None)
+            for key in handles:
+                global_id = self._handles.pop(key, None)
+                if global_id is not None:
+                    self._rows.pop(global_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._rows.clear()
+            self._handles.clear()
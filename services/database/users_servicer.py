@@ -1,5 +1,6 @@
 import sqlite3
 
+import usercache
 import util
 
 from services.proto import database_pb2
@@ -10,9 +11,16 @@ CONVERT_ERROR = "Error converting tuple to UsersEntry: "
 
 class UsersDatabaseServicer:
 
-    def __init__(self, db, logger):
+    def __init__(self, db, logger, cache_size=usercache.DEFAULT_SIZE,
+                 bulk_db=None):
         self._db = db
         self._logger = logger
+        # Whole-table reads go to bulk_db, a snapshots.Snapshots or the DB
+        # itself.
+        self._bulk_db = bulk_db or db
+        # FINDs of a single user by global_id or (handle, host) are served
+        # from here. Every write to users below must invalidate it.
+        self.cache = usercache.UserCache(cache_size)
         # If new columns are added to the database, this query must be
         # changed. Change also _user_find_op & SearchUsers.
         self._select_base = (
@@ -23,6 +31,13 @@ class UsersDatabaseServicer:
             "LEFT OUTER JOIN follows f ON "
             "f.followed=u.global_id AND f.follower=? "
         )
+        # The same columns without the follows join, for rows to cache.
+        # is_followed is left false.
+        self._select_cacheable = (
+            "SELECT global_id, handle, host, display_name, password, bio, "
+            "rss, private, 0, custom_css, public_key, private_key "
+            "FROM users "
+        )
         self._users_type_handlers = {
             database_pb2.UsersRequest.INSERT: self._users_handle_insert,
             database_pb2.UsersRequest.FIND: self._users_handle_find,
@@ -72,6 +87,42 @@ class UsersDatabaseServicer:
             return False
         return True
 
+    def BatchGetUsers(self, request, context):
+        resp = database_pb2.UsersResponse()
+        user_id = -1
+        if request.HasField("user_global_id"):
+            user_id = request.user_global_id.value
+        self._logger.info('Batch reading %d users by id and %d by handle',
+                          len(request.global_ids), len(request.handles))
+        queries = []
+        for ids in util.chunked(request.global_ids, util.MAX_BATCH_KEYS):
+            queries.append(('u.global_id IN (' +
+                            util.placeholders(len(ids)) + ')', ids))
+        # Each handle key takes two parameters.
+        n = util.MAX_BATCH_KEYS // 2
+        for keys in util.chunked(request.handles, n):
+            values = []
+            for k in keys:
+                values += [k.handle, k.host or None]
+            queries.append((' OR '.join(
+                ['(u.handle = ? AND u.host IS ?)'] * len(keys)), values))
+        seen = set()
+        try:
+            for where, values in queries:
+                res = self._db.execute(self._select_base + 'WHERE ' + where,
+                                       user_id, *values)
+                for tup in res:
+                    if tup[0] in seen:
+                        continue
+                    seen.add(tup[0])
+                    if not self._db_tuple_to_entry(tup, resp.results.add()):
+                        del resp.results[-1]
+        except sqlite3.Error as e:
+            resp.result_type = database_pb2.UsersResponse.ERROR
+            resp.error = str(e)
+            return resp
+        return resp
+
     def PendingFollows(self, request, context):
         resp = database_pb2.PendingFollowResponse()
 
@@ -133,30 +184,32 @@ class UsersDatabaseServicer:
     def CreateUsersIndex(self, request, context):
         self._logger.info('Creating User Index')
         resp = database_pb2.PostsResponse()
-        try:
-            res = self._db.execute(
+
+        def create_index(tx):
+            tx.execute(
                 'CREATE VIRTUAL TABLE IF NOT EXISTS users_idx USING '
                 + 'fts5(handle, content=users, content_rowid=global_id)')
-            res = self._db.execute(
+            tx.execute(
                 "insert into users_idx(users_idx) values('rebuild')")
-            self._logger.info('Adding Triggers')
-            res = self._db.execute(
+            tx.execute(
                 'CREATE TRIGGER IF NOT EXISTS users_ai AFTER INSERT ON users BEGIN\n'
                 + '  INSERT INTO users_idx(rowid, handle) '
                 + 'VALUES (new.global_id, new.handle); \n'
                 + 'END;')
-            res = self._db.execute(
+            tx.execute(
                 'CREATE TRIGGER IF NOT EXISTS users_ad AFTER DELETE ON users BEGIN\n'
                 + '  INSERT INTO users_idx(users_idx, rowid, handle) '
                 + "VALUES ('delete', old.global_id, old.handle); \n"
                 + 'END;')
-            res = self._db.execute(
+            tx.execute(
                 'CREATE TRIGGER IF NOT EXISTS users_au AFTER UPDATE ON users BEGIN\n'
                 + '  INSERT INTO users_idx(users_idx, rowid, handle) '
                 + "VALUES ('delete', new.global_id, new.handle);\n"
                 + '  INSERT INTO users_idx(rowid, handle) '
                 + 'VALUES (new.global_id, new.handle);\n'
                 + 'END;')
+        try:
+            self._db.write(create_index)
             resp.result_type = database_pb2.PostsResponse.OK
         except sqlite3.Error as e:
             self._logger.info("Error creating users index")
@@ -174,7 +227,7 @@ class UsersDatabaseServicer:
     def AllUsers(self, request, context):
         response = database_pb2.UsersResponse()
         try:
-            db_res = self._db.execute(self._select_base, 0)
+            db_res = self._bulk_db.execute(self._select_base, 0)
         except sqlite3.Error as e:
             response.result_type = database_pb2.UsersResponse.ERROR
             response.error = str(e)
@@ -185,10 +238,80 @@ class UsersDatabaseServicer:
                 del response.results[-1]
         return response
 
+    def StreamAllUsers(self, request, context):
+        n = request.chunk_size or util.DEFAULT_CHUNK_SIZE
+        try:
+            for rows in self._bulk_db.execute_chunks(n, self._select_base, 0):
+                response = database_pb2.UsersResponse(
+                    result_type=database_pb2.UsersResponse.OK)
+                for tup in rows:
+                    if not self._db_tuple_to_entry(tup, response.results.add()):
+                        del response.results[-1]
+                yield response
+        except sqlite3.Error as e:
+            yield database_pb2.UsersResponse(
+                result_type=database_pb2.UsersResponse.ERROR,
+                error=str(e),
+            )
+
+    def StreamAllUserLikes(self, request, context):
+        n = request.chunk_size or util.DEFAULT_CHUNK_SIZE
+        # Rather than GROUP_CONCAT the likes of each user into one string in
+        # SQLite, read one row per like in user order and group them here so
+        # only one chunk of rows is held at a time.
+        rows = self._bulk_db.execute_chunks(
+            n,
+            "SELECT u.global_id, u.host, l.article_id "
+            "FROM users u "
+            "LEFT OUTER JOIN likes l ON "
+            "l.user_id = u.global_id "
+            "ORDER BY u.global_id, l.article_id"
+        )
+        try:
+            for entries in util.chunked(
+                    self._group_user_likes(rows, request.packed_likes), n):
+                yield database_pb2.UsersResponse(
+                    result_type=database_pb2.UsersResponse.OK,
+                    results=entries,
+                )
+        except sqlite3.Error as e:
+            yield database_pb2.UsersResponse(
+                result_type=database_pb2.UsersResponse.ERROR,
+                error=str(e),
+            )
+
+    def _group_user_likes(self, chunks, packed):
+        def set_likes(entry, likes):
+            if packed:
+                entry.liked_ids = util.pack_ids(likes)
+            else:
+                entry.likes = ','.join(str(i) for i in likes)
+
+        entry = None
+        likes = []
+        for rows in chunks:
+            for global_id, host, article_id in rows:
+                if entry is not None and entry.global_id != global_id:
+                    set_likes(entry, likes)
+                    yield entry
+                    entry = None
+                if entry is None:
+                    entry = database_pb2.UsersEntry(global_id=global_id)
+                    if host is not None:
+                        entry.host = host
+                    else:
+                        entry.host_is_null = True
+                    likes = []
+                if article_id is not None:
+                    likes.append(article_id)
+        if entry is not None:
+            set_likes(entry, likes)
+            yield entry
+
     def AllUserLikes(self, request, context):
         resp = database_pb2.UsersResponse()
         try:
-            db_res = self._db.execute(
+            db_res = self._bulk_db.execute(
                 "SELECT u.global_id, u.host, "
                 "GROUP_CONCAT(l.article_id) "
                 "FROM users u "
@@ -225,11 +348,13 @@ class UsersDatabaseServicer:
 
     def _users_handle_insert(self, req, resp):
         self._logger.info('Inserting new user into Users database.')
-        try:
-            self._db.execute(
+
+        def insert_user(tx):
+            tx.execute(
                 'INSERT INTO users '
-                '(handle, host, display_name, password, bio, rss, private, '
-                'public_key, private_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                '(handle, host, display_name, password, bio, rss, '
+                'private, public_key, private_key) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
                 req.entry.handle,
                 req.entry.host if not req.entry.host_is_null else None,
                 req.entry.display_name,
@@ -238,10 +363,11 @@ class UsersDatabaseServicer:
                 req.entry.rss,
                 req.entry.private.value,
                 req.entry.public_key,
-                req.entry.private_key,
-                commit=False)
-            res = self._db.execute(
+                req.entry.private_key)
+            return tx.execute(
                 'SELECT last_insert_rowid() FROM users LIMIT 1')
+        try:
+            res = self._db.write(insert_user)
         except sqlite3.Error as e:
             self._logger.info("Error inserting")
             self._logger.error(str(e))
@@ -254,6 +380,8 @@ class UsersDatabaseServicer:
             resp.result_type = database_pb2.UsersResponse.ERROR
             resp.error = err
             return
+        host = req.entry.host if not req.entry.host_is_null else None
+        self.cache.invalidate(handles=[(req.entry.handle, host)])
         resp.result_type = database_pb2.UsersResponse.OK
         resp.global_id = res[0][0]
 
@@ -264,11 +392,12 @@ class UsersDatabaseServicer:
             return
         sql = "DELETE FROM users WHERE global_id = ?"
         try:
-            self._db.execute(sql, req.entry.global_id)
+            self._db.write(lambda tx: tx.execute(sql, req.entry.global_id))
         except sqlite3.Error as e:
             resp.result_type = database_pb2.UsersResponse.ERROR
             resp.error = str(e)
             return
+        self.cache.invalidate(global_ids=[req.entry.global_id])
         resp.result_type = database_pb2.UsersResponse.OK
 
     def _users_handle_update(self, req, resp):
@@ -290,12 +419,19 @@ class UsersDatabaseServicer:
         valstr = ', '.join(str(v) for v in values)
         self._logger.debug('Running query "%s" with values (%s)', sql, valstr)
 
+        def update(tx):
+            # Find the users being changed so exactly those are
+            # invalidated.
+            ids = tx.execute('SELECT global_id FROM users WHERE ' +
+                             filter_clause, *f_values)
+            return [i[0] for i in ids], tx.execute_count(sql, *values)
         try:
-            count = self._db.execute_count(sql, *values)
+            ids, count = self._db.write(update)
         except sqlite3.Error as e:
             resp.result_type = database_pb2.UsersResponse.ERROR
             resp.error = str(e)
             return
+        self.cache.invalidate(global_ids=ids)
 
         if count != 1:
             err = 'UPDATE affected {} rows, expected 1'.format(count)
@@ -317,10 +453,53 @@ class UsersDatabaseServicer:
         self._user_find_op(resp, filter_clause, [], self._get_uid(req))
 
     def _users_handle_find(self, req, resp):
+        fields = {f.name for f, _ in req.match.ListFields()}
+        if fields == {'global_id'}:
+            return self._user_find_cached(
+                resp, self.cache.get_by_id(req.match.global_id),
+                'global_id = ?', [req.match.global_id], self._get_uid(req))
+        if fields in ({'handle', 'host'}, {'handle', 'host_is_null'}):
+            host = req.match.host or None
+            return self._user_find_cached(
+                resp, self.cache.get_by_handle(req.match.handle, host),
+                'handle = ? AND host IS ?', [req.match.handle, host],
+                self._get_uid(req))
         filter_clause, values = util.equivalent_filter(
             req.match, deferred=self._filter_defer)
         self._user_find_op(resp, filter_clause, values, self._get_uid(req))
 
+    def _user_find_cached(self, resp, row, filter_clause, values, user_id):
+        if row is None:
+            token = self.cache.token()
+            try:
+                res = self._db.execute(self._select_cacheable
+                                       + 'WHERE ' + filter_clause, *values)
+            except sqlite3.Error as e:
+                resp.result_type = database_pb2.UsersResponse.ERROR
+                resp.error = str(e)
+                return
+            resp.result_type = database_pb2.UsersResponse.OK
+            if not res:
+                return
+            row = res[0]
+            self.cache.put(row, token)
+        resp.result_type = database_pb2.UsersResponse.OK
+        entry = resp.results.add()
+        if not self._db_tuple_to_entry(row, entry):
+            del resp.results[-1]
+            return
+        # Who follows whom changes far more often than users do, and
+        # depends on the caller, so it is never cached.
+        if user_id != -1:
+            try:
+                entry.is_followed = bool(self._db.execute(
+                    'SELECT 1 FROM follows WHERE followed = ? '
+                    'AND follower = ?', entry.global_id, user_id))
+            except sqlite3.Error as e:
+                del resp.results[:]
+                resp.result_type = database_pb2.UsersResponse.ERROR
+                resp.error = str(e)
+
     def _user_find_op(self, resp, filter_clause, values, user_id):
         try:
             if not filter_clause:
@@ -1,3 +1,20 @@
+import array
+import base64
+import binascii
+import sys
+
+# Page size used when a page_token is given without a page_size.
+DEFAULT_PAGE_SIZE = 50
+# Number of results per response used by streaming RPCs.
+DEFAULT_CHUNK_SIZE = 500
+PAGE_TOKEN_PREFIX = 'v1:'
+RANK_TOKEN_PREFIX = 'r1:'
+TIME_TOKEN_PREFIX = 't1:'
+# The most keys put in a single IN (...) list. Older SQLite builds limit a
+# statement to 999 bound parameters.
+MAX_BATCH_KEYS = 500
+
+
 def equivalent_filter(entry, defaults=[], deferred={}):
     return entry_to_filter(entry, defaults, " = ?", deferred)
 
@@ -11,6 +28,63 @@ def build_filter_list(fields, comp, deferred):
 class DONT_USE_FIELD:
     pass
 
+# The most distinct clause shapes kept by _plan before the cache is reset.
+MAX_CACHED_PLANS = 4096
+
+# Clause plans keyed by request shape, see _plan.
+_plans = {}
+
+
+class _Plan:
+    """
+    _Plan holds the parts of a generated clause that only depend on which
+    fields of an entry are set, not on their values.
+    """
+    __slots__ = ('clauses', 'deferred', 'text')
+
+    def __init__(self, clauses, deferred, sep):
+        self.clauses = clauses
+        self.deferred = deferred
+        # The finished clause, usable as is when no deferred fields are set.
+        self.text = sep.join(clauses)
+
+
+def _plan(op, sep, entry, fields, comparison, deferred):
+    # Entries of one proto type always list their fields in field number
+    # order, so the numbers identify the set of populated fields.
+    key = (op, entry.DESCRIPTOR.full_name, comparison,
+           tuple(f.number for f, _ in fields), tuple(deferred))
+    plan = _plans.get(key)
+    if plan is None:
+        plan = _Plan(
+            build_filter_list(fields, comparison, deferred),
+            [f.name for f, _ in fields if f.name in deferred],
+            sep,
+        )
+        if len(_plans) >= MAX_CACHED_PLANS:
+            _plans.clear()
+        _plans[key] = plan
+    return plan
+
+
+def clear_plan_cache():
+    _plans.clear()
+
+
+def _build_clause(plan, entry, fields, comparison, deferred):
+    clause_list = list(plan.clauses)
+    values = [v for f, v in fields if f.name not in deferred]
+    used = set()
+    for name in plan.deferred:
+        filt, val = deferred[name](entry, comparison)
+        if val is DONT_USE_FIELD:
+            continue
+        clause_list.append(filt)
+        used.add(name)
+        values.append(val)
+    return clause_list, values, used
+
+
 def entry_to_filter(entry, defaults, comparison, deferred={}):
     """
     entry_to_filter converts an entry to a filter usable in sqlite3.
@@ -35,33 +109,19 @@ def entry_to_filter(entry, defaults, comparison, deferred={}):
       A filter clause and a list of values.
     """
     fields = entry.ListFields()
+    plan = _plan('filter', ' AND ', entry, fields, comparison, deferred)
+    if not plan.deferred and not defaults:
+        return plan.text, [v for _, v in fields]
+    filter_list, values, used = _build_clause(
+        plan, entry, fields, comparison, deferred)
 
-    names = {f.name for f, _ in fields if f.name not in deferred}
-    filter_list = build_filter_list(fields, comparison, deferred)
-
-    for name, _ in defaults:
-        if name not in names:
-            filter_list.append(name + comparison)
-
-    values = []
-    handle_deferred = []
-    for f, v in fields:
-        if f.name not in deferred:
-            values.append(v)
-        else:
-            handle_deferred.append(f.name)
-
-    for name in handle_deferred:
-        filt, val = deferred[name](entry, comparison)
-        if val is DONT_USE_FIELD:
-            continue
-        filter_list.append(filt)
-        names.add(name)
-        values.append(val)
-
-    for name, value in defaults:
-        if name not in names:
-            values.append(value)
+    if defaults:
+        names = {f.name for f, _ in fields if f.name not in deferred}
+        names |= used
+        for name, value in defaults:
+            if name not in names:
+                filter_list.append(name + comparison)
+                values.append(value)
 
     filter_clause = ' AND '.join(filter_list)
     return filter_clause, values
@@ -93,21 +153,168 @@ def entry_to_update(entry, deferred={}):
          "bio = ?, display_name = ?" ["my bio", "my name"]
     """
     fields = entry.ListFields()
-    update_list = build_filter_list(fields, " = ?", deferred)
-
-    values = []
-    handle_deferred = []
-    for f, v in fields:
-        if f.name not in deferred:
-            values.append(v)
-        else:
-            handle_deferred.append(f.name)
-
-    for name in handle_deferred:
-        filt, val = deferred[name](entry, " = ?")
-        if val is DONT_USE_FIELD:
-            continue
-        update_list.append(filt)
-        values.append(val)
-
+    plan = _plan('update', ', ', entry, fields, " = ?", deferred)
+    if not plan.deferred:
+        return plan.text, [v for _, v in fields]
+    update_list, values, _ = _build_clause(
+        plan, entry, fields, " = ?", deferred)
     return ', '.join(update_list), values
+
+
+class InvalidPageToken(ValueError):
+    pass
+
+
+def encode_page_token(last_id):
+    """
+    encode_page_token builds the opaque token handed to clients for the page
+    after the row with id last_id.
+    """
+    return _encode_token(PAGE_TOKEN_PREFIX + str(last_id))
+
+
+def decode_page_token(token):
+    """
+    decode_page_token returns the id stored in a token from encode_page_token.
+
+    Raises InvalidPageToken if the token wasn't made by encode_page_token.
+    """
+    try:
+        return int(_decode_token(token, PAGE_TOKEN_PREFIX))
+    except ValueError:
+        raise InvalidPageToken('Invalid page token')
+
+
+def encode_rank_token(rank, last_id):
+    """
+    encode_rank_token builds a page token for results ordered by a float
+    rank and then id, such as full text search results.
+    """
+    return _encode_token(
+        RANK_TOKEN_PREFIX + repr(float(rank)) + ':' + str(last_id))
+
+
+def decode_rank_token(token):
+    """
+    decode_rank_token returns the (rank, id) stored by encode_rank_token.
+
+    Raises InvalidPageToken if the token wasn't made by encode_rank_token.
+    """
+    try:
+        rank, last_id = _decode_token(token, RANK_TOKEN_PREFIX).split(':')
+        return float(rank), int(last_id)
+    except ValueError:
+        raise InvalidPageToken('Invalid page token')
+
+
+def encode_time_token(ts, last_id):
+    """
+    encode_time_token builds a page token for results ordered by a time in
+    seconds and then id, both descending, such as timelines.
+    """
+    return _encode_token(
+        TIME_TOKEN_PREFIX + str(int(ts)) + ':' + str(last_id))
+
+
+def decode_time_token(token):
+    """
+    decode_time_token returns the (ts, id) stored by encode_time_token.
+
+    Raises InvalidPageToken if the token wasn't made by encode_time_token.
+    """
+    try:
+        ts, last_id = _decode_token(token, TIME_TOKEN_PREFIX).split(':')
+        return int(ts), int(last_id)
+    except ValueError:
+        raise InvalidPageToken('Invalid page token')
+
+
+def _encode_token(raw):
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+
+def _decode_token(token, prefix):
+    try:
+        raw = base64.urlsafe_b64decode(token.encode('ascii')).decode('ascii')
+    except (binascii.Error, UnicodeError) as e:
+        raise InvalidPageToken('Invalid page token: ' + str(e))
+    if not raw.startswith(prefix):
+        raise InvalidPageToken('Invalid page token')
+    return raw[len(prefix):]
+
+
+def keyset_filter(filter_clause, values, column, page_token):
+    """
+    keyset_filter extends a filter to seek past the previous page.
+
+    Pages are ordered by column descending, so the next page starts at the
+    first row whose column is below the last one already returned. With an
+    index on column this costs the same for every page, unlike OFFSET.
+
+    Arguments:
+      - filter_clause, values: A filter as returned by entry_to_filter. May
+        be empty.
+      - column: The unique column the results are ordered by, e.g.
+        "p.global_id".
+      - page_token: The token from the previous page, or "" for the first.
+
+    Returns:
+      A filter clause and a list of values.
+    """
+    if not page_token:
+        return filter_clause, values
+    clause = column + ' < ?'
+    if filter_clause:
+        clause = filter_clause + ' AND ' + clause
+    return clause, values + [decode_page_token(page_token)]
+
+
+def split_page(rows, page_size, key):
+    """
+    split_page trims rows fetched with "LIMIT page_size + 1" to one page.
+
+    Arguments:
+      - rows: The rows returned by the database.
+      - page_size: The number of rows the client asked for.
+      - key: A function returning the ordering column of a row.
+
+    Returns:
+      The rows in this page and the token for the next page, or "" if this
+      is the last page.
+    """
+    if len(rows) <= page_size:
+        return rows, ''
+    rows = rows[:page_size]
+    return rows, encode_page_token(key(rows[-1]))
+
+
+def chunked(iterable, chunk_size):
+    """
+    chunked yields lists of at most chunk_size items from iterable.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def pack_ids(ids):
+    """
+    pack_ids encodes ids as little-endian 64 bit integers, the format of
+    UsersEntry.liked_ids.
+    """
+    packed = array.array('q', ids)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def placeholders(n):
+    """
+    placeholders returns "?, ?, ..." with n parameters, for IN lists.
+    """
+    return ', '.join('?' * n)
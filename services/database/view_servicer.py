@@ -1,13 +1,17 @@
-import sqlite3
-
 from services.proto import database_pb2 as db_pb
 
+import ingest
+
 
 class ViewDatabaseServicer:
 
-    def __init__(self, db, logger):
+    def __init__(self, db, logger, **ingest_options):
         self._db = db
         self._logger = logger
+        self._views = ingest.BufferedInserter(
+            db, logger, 'views',
+            'INSERT INTO views (user_id, path, datetime) VALUES (?, ?, ?)',
+            **ingest_options)
 
     def AddView(self, req, context):
         self._logger.debug(
@@ -15,14 +19,9 @@ class ViewDatabaseServicer:
             req.path, req.user
         )
         response = db_pb.AddViewResponse()
-        try:
-            self._db.execute(
-                'INSERT INTO views (user_id, path, datetime) '
-                'VALUES (?, ?, ?)',
-                req.user,
-                req.path,
-                req.datetime.seconds
-            )
-        except sqlite3.Error as e:
-            self._logger.error("AddView error: %s", str(e))
+        if not self._views.add((req.user, req.path, req.datetime.seconds)):
+            self._logger.debug("AddView: queue full, view dropped")
         return response
+
+    def close(self):
+        self._views.close()
@@ -0,0 +1,77 @@
+import util
+
+# Which kind of flag each row found by lookup is for.
+_LIKED, _SHARED, _FOLLOWED = range(3)
+
+
+class ViewerFlags:
+    """
+    ViewerFlags records which of a set of posts someone has liked or shared,
+    and which of their authors they follow.
+
+    Post rows are read without anything that depends on who is reading
+    them, and the flags are put onto the entries made from them afterwards
+    with apply. The rows are then the same for every reader.
+    """
+
+    def __init__(self, liked=(), shared=(), followed=()):
+        self.liked = set(liked)
+        self.shared = set(shared)
+        # The ids of the followed authors rather than of posts.
+        self.followed = set(followed)
+
+    def update(self, other):
+        self.liked |= other.liked
+        self.shared |= other.shared
+        self.followed |= other.followed
+
+    def apply(self, entry):
+        entry.is_liked = entry.global_id in self.liked
+        entry.is_followed = entry.author_id in self.followed
+        entry.is_shared = entry.global_id in self.shared
+
+
+def lookup(db, user_id, posts):
+    """
+    lookup finds the flags of user_id for the given posts.
+
+    The likes, shares and follows are found in one query, each part a
+    search of the table's primary key for only the ids given. Nothing is
+    read if there is no user, as for the user_id of -1 used for anonymous
+    readers.
+
+    Args:
+      db: the database.DB to read.
+      user_id: the global_id of the user reading the posts.
+      posts: (global_id, author_id, ...) rows of the posts.
+
+    Returns:
+      A ViewerFlags.
+    """
+    flags = ViewerFlags()
+    # User ids start at 1.
+    if user_id <= 0:
+        return flags
+    found = (flags.liked, flags.shared, flags.followed)
+    posts = list({tup[0]: tup for tup in posts}.values())
+    # Each chunk binds its post ids twice and up to as many author ids, so
+    # a third of MAX_BATCH_KEYS keeps the query under the parameter limit.
+    for chunk in util.chunked(posts, util.MAX_BATCH_KEYS // 3):
+        post_ids = [tup[0] for tup in chunk]
+        author_ids = list({tup[1] for tup in chunk})
+        in_posts = '(' + util.placeholders(len(post_ids)) + ')'
+        res = db.execute(
+            'SELECT {}, article_id FROM likes '
+            'WHERE user_id = ? AND article_id IN {} '
+            'UNION ALL '
+            'SELECT {}, article_id FROM shares '
+            'WHERE user_id = ? AND article_id IN {} '
+            'UNION ALL '
+            'SELECT {}, followed FROM follows '
+            'WHERE follower = ? AND followed IN ({})'.format(
+                _LIKED, in_posts, _SHARED, in_posts, _FOLLOWED,
+                util.placeholders(len(author_ids))),
+            user_id, *post_ids, user_id, *post_ids, user_id, *author_ids)
+        for kind, global_id in res:
+            found[kind].add(global_id)
+    return flags
@@ -69,12 +69,17 @@ class GetFollowsReceiver:
             user_following = self._util.get_follows(follower_id=uid).results
             user_following_ids = set([x.followed for x in user_following])
 
+        ids = [f.follower if request_type == self.RequestType.FOLLOWERS
+               else f.followed for f in following_ids]
+        users = self._users_util.get_users_from_db(ids)
+        if users is None:
+            resp.result_type = follows_pb2.GetFollowsResponse.ERROR
+            resp.error = 'Could not get users from database'
+            return resp
+
         # Convert other following users and add to output proto.
-        for following_id in following_ids:
-            _id = following_id.followed
-            if request_type == self.RequestType.FOLLOWERS:
-                _id = following_id.follower
-            user = self._users_util.get_or_create_user_from_db(global_id=_id)
+        for _id in ids:
+            user = users.get(_id)
             if user is None:
                 self._logger.warning('Could not find user for id %d',
                                      _id)
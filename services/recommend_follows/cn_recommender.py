@@ -3,6 +3,7 @@ import os
 from collections import defaultdict
 
 from services.proto import database_pb2
+from utils.recommenders import STREAM_CHUNK_SIZE, stream_results
 
 
 class CNRecommender:
@@ -40,19 +41,16 @@ class CNRecommender:
         self._compute_recommendations()
 
     def _load_data(self):
-        follow_req = database_pb2.DbFollowRequest(
-            request_type=database_pb2.DbFollowRequest.FIND,
-            match=None)
-        follow_resp = self._db.Follow(follow_req)
-        if follow_resp.result_type == database_pb2.DbFollowResponse.ERROR:
-            self._logger.error('Could not get follows from database: %s',
-                               follow_resp.error)
-        return follow_resp
-
-    def _convert_data(self, follow_resp):
-        '''Given the database response with all follows, create the sets of
-        out-links and in-links for each user, along with a set of all user IDs
-        appearing in the follow graph.'''
+        resps = self._db.StreamAllFollows(
+            database_pb2.StreamRequest(chunk_size=STREAM_CHUNK_SIZE))
+        return stream_results(self._logger, resps,
+                              database_pb2.DbFollowResponse.ERROR,
+                              'follows from database')
+
+    def _convert_data(self, follows):
+        '''Given all the active follows, create the sets of out-links and
+        in-links for each user, along with a set of all user IDs appearing in
+        the follow graph.'''
 
         # out_links[x] is the set of nodes with a directed edge from x;
         # ie. the users that x follows.
@@ -63,7 +61,7 @@ class CNRecommender:
 
         # a set of all user ids with associated follows
         users = set()
-        for follow in follow_resp.results:
+        for follow in follows:
             # We don't want to suggest the user follow someone who doesn't
             # accept follows, so only consider ACTIVE follows.
             if follow.state == follow.ACTIVE:
@@ -3,6 +3,7 @@ import os
 from collections import defaultdict
 
 from services.proto import database_pb2
+from utils.recommenders import STREAM_CHUNK_SIZE, stream_results
 
 
 class GraphDistanceRecommender:
@@ -31,11 +32,12 @@ class GraphDistanceRecommender:
         self._compute_recommendations()
 
     def _load_data(self):
-        users_resp = self._db.AllUsers(database_pb2.AllUsersRequest())
-        if users_resp.result_type == database_pb2.UsersResponse.ERROR:
-            self._logger.error('Could not get users from database: %s',
-                               users_resp.error)
-        return [(u.global_id, u.host_is_null) for u in users_resp.results]
+        resps = self._db.StreamAllUsers(
+            database_pb2.StreamRequest(chunk_size=STREAM_CHUNK_SIZE))
+        users = stream_results(self._logger, resps,
+                               database_pb2.UsersResponse.ERROR,
+                               'users from database')
+        return [(u.global_id, u.host_is_null) for u in users]
 
     def _get_neighbours(self, uid, inverse=False):
         '''Get the neighbours of the user with the given uid.
@@ -62,8 +62,18 @@ class FollowRecommendationsServicer(follows_pb2_grpc.FollowsServicer):
             recommend_follows_pb2.FollowRecommendationResponse.OK
 
         # Get the recommendations and package them into proto.
-        for p in self._get_recommendations(user.global_id):
-            a = self._users_util.get_or_create_user_from_db(global_id=p[0])
+        recommendations = list(self._get_recommendations(user.global_id))
+        users = self._users_util.get_users_from_db(
+            [p[0] for p in recommendations])
+        if users is None:
+            resp.result_type = \
+                recommend_follows_pb2.FollowRecommendationResponse.ERROR
+            resp.error = "Could not get recommended users."
+            return resp
+        for p in recommendations:
+            a = users.get(p[0])
+            if a is None:
+                continue
             user_obj = resp.results.add()
             user_obj.handle = a.handle
             user_obj.host = a.host
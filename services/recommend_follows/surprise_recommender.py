@@ -4,6 +4,7 @@ from collections import defaultdict
 from enum import Enum
 
 from services.proto import database_pb2
+from utils.recommenders import STREAM_CHUNK_SIZE, stream_results
 
 import pandas as pd
 
@@ -22,16 +23,13 @@ class SurpriseRecommender:
         self._compute_recommendations()
 
     def _load_data(self):
-        follow_req = database_pb2.DbFollowRequest(
-            request_type=database_pb2.DbFollowRequest.FIND,
-            match=None)
-        follow_resp = self._db.Follow(follow_req)
-        if follow_resp.result_type == database_pb2.DbFollowResponse.ERROR:
-            self._logger.error('Could not get follows from database: %s',
-                               follow_resp.error)
-        return follow_resp
-
-    def _convert_data(self, follow_resp):
+        resps = self._db.StreamAllFollows(
+            database_pb2.StreamRequest(chunk_size=STREAM_CHUNK_SIZE))
+        return stream_results(self._logger, resps,
+                              database_pb2.DbFollowResponse.ERROR,
+                              'follows from database')
+
+    def _convert_data(self, follow_entries):
         # Must be (user_id, item_id, rating)
         d = [[], [], []]
         user_id = []
@@ -40,7 +38,7 @@ class SurpriseRecommender:
 
         follows = defaultdict(set)
         inverse_follows = defaultdict(set)
-        for follow in follow_resp.results:
+        for follow in follow_entries:
             # Do not have to worry about follow state, because even a rejected
             # follow is still a strong signal of interest by the followee.
             user_id.append(follow.follower)
@@ -64,7 +62,7 @@ class SurpriseRecommender:
 
         # We only want to add as many zeros as there are ones.
         num_zeros_added = 0
-        num_ones = len(follow_resp.results)
+        num_ones = len(rating)
 
         # Important to keep track of attempts to randomly add zeros, so that
         # in a densely connected graph (eg. on a small instance where everyone
@@ -3,8 +3,9 @@ from collections import defaultdict
 from heapq import heappush, heappushpop
 
 from services.proto import database_pb2
-from utils.recommenders import RecommendersUtil
-from utils.articles import get_article
+from utils.recommenders import (
+    RecommendersUtil, STREAM_CHUNK_SIZE, stream_results, unpack_ids)
+from utils.articles import get_article, get_articles
 
 
 class CosineRecommender:
@@ -22,10 +23,10 @@ class CosineRecommender:
         self.post_tag_freq = defaultdict(int)
         self.user_tag_freq = defaultdict(int)
         self.posts = self._get_all_posts_and_tags()
-        self._logger.info("post-tags: {}".format(self.posts))
+        self._logger.info("Loaded {} tagged posts".format(len(self.posts)))
         self.users = self._get_all_user()
         self.user_models = self._create_user_models(self.users)
-        self._logger.info("user_models: {}".format(self.user_models))
+        self._logger.info("Built {} user models".format(len(self.user_models)))
 
         # Calculate Inverse Frequencies
         self.user_tag_ifs = self._calculate_based_itf(
@@ -40,14 +41,14 @@ class CosineRecommender:
             itfs[key] = itf
         return itfs
 
-    def _clean_post_entries(self, pes):
+    def _clean_post_tags(self, pts, tag_names):
         posts = defaultdict(lambda: {"tags": [], "author_id": 0})
-        for pe in pes:
-            tags = self._recommender_util.split_tags(pe.tags)
+        for pt in pts:
+            tags = [tag_names[t] for t in pt.tag_ids if t in tag_names]
             for t in tags:
                 self.post_tag_freq[t] += 1
-            posts[pe.global_id] = {
-                "author_id": pe.author_id,
+            posts[pt.post_id] = {
+                "author_id": pt.author_id,
                 "tags": tags
             }
         return posts
@@ -57,7 +58,7 @@ class CosineRecommender:
         # indexing by global_id
         users = defaultdict(lambda: {"likes": []})
         for ue in ues:
-            likes = self._clean_likes(ue.likes)
+            likes = unpack_ids(ue.liked_ids).tolist()
             if not ue.host_is_null:
                 # Do not generate anything for foreign users.
                 continue
@@ -66,10 +67,6 @@ class CosineRecommender:
             }
         return users
 
-    def _clean_likes(self, likes):
-        # The GROUP_CONCAT method in sqlite joins objects with "," into a string
-        return [int(x) for x in likes.split(",") if x != ""]
-
     def _create_user_models(self, users):
         # Iterate over every user like and add all tags of that post to the user
         # model
@@ -82,21 +79,28 @@ class CosineRecommender:
         return user_models
 
     def _get_all_posts_and_tags(self):
-        find_resp = self._db.TaggedPosts(database_pb2.PostsRequest())
-        if find_resp.result_type == database_pb2.PostsResponse.ERROR:
+        resps = self._db.StreamPostTags(
+            database_pb2.StreamRequest(chunk_size=STREAM_CHUNK_SIZE))
+        pts = list(stream_results(
+            self._logger, resps, database_pb2.PostTagsResponse.ERROR,
+            'PostTags for Cosine'))
+        # Tags are never removed, so the names are read after the posts to
+        # include any tags added while streaming.
+        stats = self._db.TagStats(database_pb2.TagStatsRequest())
+        if stats.result_type == database_pb2.TagStatsResponse.ERROR:
             self._logger.error(
-                'Error getting TaggedPosts for Cosine: {}'.format(find_resp.error))
-            return []
-        return self._clean_post_entries(find_resp.results)
+                'Error getting TagStats for Cosine: ' + stats.error)
+            return defaultdict(lambda: {"tags": [], "author_id": 0})
+        tag_names = {t.tag_id: t.name for t in stats.tags}
+        return self._clean_post_tags(pts, tag_names)
 
     def _get_all_user(self):
-        find_resp = self._db.AllUserLikes(database_pb2.AllUsersRequest())
-        if find_resp.result_type == database_pb2.UsersResponse.ERROR:
-            self._logger.error(
-                'Error getting AllUserLikes for Cosine: {}'.format(find_resp.error))
-            return []
-
-        return self._clean_user_entries(find_resp.results)
+        resps = self._db.StreamAllUserLikes(
+            database_pb2.StreamRequest(chunk_size=STREAM_CHUNK_SIZE,
+                                       packed_likes=True))
+        return self._clean_user_entries(stream_results(
+            self._logger, resps, database_pb2.UsersResponse.ERROR,
+            'AllUserLikes for Cosine'))
 
     def _tf_idf_cosine_similarity(self, user_model, post_tags):
         sum_user_item_tf = 0
@@ -135,10 +139,10 @@ class CosineRecommender:
         # get top n results
         sims = sorted(sims, reverse=True)
         self._logger.info('Recommended (score, id): {}'.format(sims))
-        posts_entries = []
-        for result in sims:
-            art = get_article(self._logger, self._db, global_id=result[1])
-            posts_entries.append(art)
+        arts = get_articles(self._logger, self._db, [r[1] for r in sims])
+        if arts is None:
+            return [], "Could not get recommended articles"
+        posts_entries = [arts[r[1]] for r in sims if r[1] in arts]
         return posts_entries, None
 
     def update_model(self, user_id, article_id):
@@ -67,24 +67,33 @@ func (s *serverWrapper) convertRssUrlToHandle(url string) string {
 	return strings.Replace(url, "/", "-", -1)
 }
 
-func (s *serverWrapper) sendCreateArticle(ctx context.Context, authorID int64, title string, content string, cTime *tspb.Timestamp) {
-	na := &pb.NewArticle{
+func newArticle(authorID int64, title string, content string, cTime *tspb.Timestamp) *pb.NewArticle {
+	return &pb.NewArticle{
 		AuthorId:         authorID,
 		Title:            title,
 		Body:             content,
 		CreationDatetime: cTime,
 		Foreign:          false,
 	}
-	newArtResp, newArtErr := s.art.CreateNewArticle(ctx, na)
+}
+
+// sendCreateArticles creates all the articles with one request, which the
+// database writes in a single transaction.
+func (s *serverWrapper) sendCreateArticles(ctx context.Context, articles []*pb.NewArticle) {
+	if len(articles) == 0 {
+		return
+	}
+	newArtResp, newArtErr := s.art.CreateNewArticles(ctx, &pb.NewArticles{Articles: articles})
 	if newArtErr != nil {
-		log.Printf("ERROR: Could not create new article: %v", newArtErr)
-	} else if newArtResp.ResultType != pb.NewArticleResponse_OK {
-		log.Printf("ERROR: Could not create new article message: %v", newArtResp.Error)
+		log.Printf("ERROR: Could not create new articles: %v", newArtErr)
+	} else if newArtResp.ResultType != pb.NewArticlesResponse_OK {
+		log.Printf("ERROR: Could not create new articles message: %v", newArtResp.Error)
 	}
 }
 
 // createArticlesFromFeed converts gofeed.Feed types to article type.
 func (s *serverWrapper) createArticlesFromFeed(ctx context.Context, gf *gofeed.Feed, authorID int64) {
+	var articles []*pb.NewArticle
 	for _, r := range gf.Items {
 		// convert time to creation_datetime
 		creationTime, creationErr := s.convertFeedItemDatetime(r)
@@ -95,8 +104,9 @@ func (s *serverWrapper) createArticlesFromFeed(ctx context.Context, gf *gofeed.F
 		if content == "" {
 			content = r.Description
 		}
-		s.sendCreateArticle(ctx, authorID, r.Title, content, creationTime)
+		articles = append(articles, newArticle(authorID, r.Title, content, creationTime))
 	}
+	s.sendCreateArticles(ctx, articles)
 }
 
 func (s *serverWrapper) createRssHeader(ue *pb.UsersEntry) string {
@@ -105,12 +105,14 @@ func (s *serverWrapper) runScraper() {
 				}
 			}
 			// use the latest timestamp from last to get all new posts
+			var articles []*pb.NewArticle
 			for _, p := range postFormArray {
 				if latestTimestamp.GetSeconds() < p.CreationDatetime.GetSeconds() {
 					log.Printf("Making new article, title: %s\n", p.Title)
-					s.sendCreateArticle(ctx, u.GlobalId, p.Title, p.Body, p.CreationDatetime)
+					articles = append(articles, newArticle(u.GlobalId, p.Title, p.Body, p.CreationDatetime))
 				}
 			}
+			s.sendCreateArticles(ctx, articles)
 
 			<-guard
 			wg.Done()
@@ -325,19 +325,19 @@ class ActivitiesUtil:
         self._logger.info("Have %d users to notify", len(resp.results))
         # Gather up the users, filter local and non-unique hosts.
         hosts_to_users = {}
+        user_resp = self._db.BatchGetUsers(database_pb2.BatchGetUsersRequest(
+            global_ids=[follow.follower for follow in resp.results]))
+        if user_resp.result_type != database_pb2.UsersResponse.OK:
+            self._logger.warning("Error finding followers: %s",
+                                 user_resp.error)
+            return user_resp.error
+        users = {u.global_id: u for u in user_resp.results}
         for follow in resp.results:
-            user_resp = self._db.Users(database_pb2.UsersRequest(
-                request_type=database_pb2.UsersRequest.FIND,
-                match=database_pb2.UsersEntry(global_id=follow.follower)))
-            if user_resp.result_type != database_pb2.UsersResponse.OK:
-                self._logger.warning(
-                    "Error finding user %d, skipping", follow.follower)
-                continue
-            if len(user_resp.results) != 1:
+            user = users.get(follow.follower)
+            if user is None:
                 self._logger.warning(
                     "Couldn't find user %d, skipping", follow.follower)
                 continue
-            user = user_resp.results[0]
             if not user.host or user.host_is_null:
                 continue  # Local user, skip.
             hosts_to_users[user.host] = user
@@ -35,6 +35,23 @@ def get_article(logger, db, global_id=None, ap_id=None):
         return None
     return resp.results[0]
 
+def get_articles(logger, db, global_ids):
+    """
+    Retrieve many PostEntries from the database in one call.
+    Returns a dict from global_id to PostEntry, without any ids that were not
+    found, or None on error.
+    """
+    if not global_ids:
+        return {}
+    logger.info("Getting %d articles", len(global_ids))
+    resp = db.BatchGetPosts(database_pb2.BatchGetPostsRequest(
+        global_ids=global_ids,
+    ))
+    if resp.result_type != database_pb2.PostsResponse.OK:
+        logger.error("Error getting articles: %s", resp.error)
+        return None
+    return {p.global_id: p for p in resp.results}
+
 def delete_article(logger, db, global_id=None, ap_id=None):
     """
     Deletes an article from the database safely (removing all references).
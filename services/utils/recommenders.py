@@ -1,12 +1,42 @@
 import os
 import json
+import sys
 import time
+from array import array
 from services.proto import database_pb2
 from services.proto import recommend_posts_pb2_grpc
 from services.proto import recommend_follows_pb2_grpc 
 from utils.users import UsersUtil
 from utils.connect import get_service_channel
 
+# The number of entries the database sends per message when streaming a
+# whole table to a recommender.
+STREAM_CHUNK_SIZE = 500
+
+
+def stream_results(logger, responses, error_type, name):
+    '''Yield the entries from a streaming database RPC one by one, so a
+    recommender can build its model without holding the full result set.
+
+    If the database reports an error part-way through, it is logged and the
+    stream ends early.'''
+    for resp in responses:
+        if resp.result_type == error_type:
+            logger.error('Error getting {}: {}'.format(name, resp.error))
+            return
+        for entry in resp.results:
+            yield entry
+
+
+def unpack_ids(packed):
+    '''Decode the ids in a UsersEntry.liked_ids, which are little-endian 64
+    bit integers, into an array.'''
+    ids = array('q')
+    ids.frombytes(packed)
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids
+
 
 class RecommendersUtil:
     def __init__(self, logger, db, default=None, env_var=None, recommenders=None):
@@ -63,7 +93,7 @@ class RecommendersUtil:
     def split_tags(self, tags):
         if tags == "":
             return []
-        return [t.replace("%7G", "|") for t in tags.split("|")]
+        return [t.replace("%7C", "|") for t in tags.split("|")]
 
     def get_post_recommendation_stub(self):
         post_recommender_location = os.environ.get(
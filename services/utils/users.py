@@ -195,6 +195,24 @@ class UsersUtil:
                                handle, host, global_id)
             return find_resp.results[0]
 
+    def get_users_from_db(self, global_ids):
+        '''Look up many users by global_id in one database call.
+
+        Returns a dict from global_id to UsersEntry, leaving out any ids
+        that were not found, or None on error.'''
+        if not global_ids:
+            return {}
+        self._logger.debug('%d users requested from database',
+                           len(global_ids))
+        resp = self._db.BatchGetUsers(database_pb2.BatchGetUsersRequest(
+            global_ids=global_ids,
+        ))
+        if resp.result_type != database_pb2.UsersResponse.OK:
+            self._logger.error('Error getting users from database: %s',
+                               resp.error)
+            return None
+        return {u.global_id: u for u in resp.results}
+
     def get_follower_list(self, user_id):
         follow_entry = database_pb2.Follow(
             followed=user_id
@@ -216,10 +234,11 @@ class UsersUtil:
 
     def remove_local_users(self, followers):
         foreign_followers = []
+        users = self.get_users_from_db([f.follower for f in followers])
+        if users is None:
+            return foreign_followers
         for follow in followers:
-            follower_entry = self.get_user_from_db(
-                global_id=follow.follower
-            )
+            follower_entry = users.get(follow.follower)
             if follower_entry is None:
                 self._logger.error(
                     "Could not find follower in db. Id: %s", follow.follower)